@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'polls.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after Django is set up
+from polls_api.live import LiveResultsApp  # noqa: E402
+
+# server-sent live results are streamed outside of Django, which can't stream asynchronously
+application = LiveResultsApp(django_application)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -42,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls_api.middleware.InstrumentationMiddleware',
+    'polls_api.replicas.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -51,6 +54,34 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# Per-request timing, SQL query counts and Server-Timing headers,
+# totals per route are served at /api/stats to superusers
+POLLS_INSTRUMENTATION = False
+
+# 'sync' saves answers during the request, 'queue' puts validated answers
+# into a local spool and returns 202, `manage.py drain_answers` saves them
+POLLS_ANSWER_INGESTION = 'sync'
+POLLS_ANSWER_SPOOL = BASE_DIR / 'answer_spool.sqlite3'
+
+# Repeated answer of a participant on the same question:
+# 'allow' saves every answer, 'reject' responds with 400,
+# 'replace' overwrites the previous answer keeping its id and date,
+# 'keep-latest' saves the new answer and deletes the previous ones
+POLLS_REPEAT_ANSWERS = 'allow'
+
+# Selected choices are stored in Answer.choice_ids. With True they are also written
+# to the answer-choice table, turn off after 'manage.py compact_answers --drop-rows'
+POLLS_ANSWER_CHOICE_ROWS = True
+
+# Answers of polls expired more than this many days ago are moved
+# to the archive table by 'manage.py archive_answers'
+POLLS_ARCHIVE_GRACE_DAYS = 30
+
+# Live results under ASGI: seconds between reads of the counters of a watched poll,
+# i.e. the longest delay of an update, and seconds between keep-alive comments
+POLLS_LIVE_INTERVAL = 1.0
+POLLS_LIVE_KEEPALIVE = 15
+
 ROOT_URLCONF = 'polls.urls'
 
 TEMPLATES = [
@@ -75,10 +106,74 @@ WSGI_APPLICATION = 'polls.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/3.2/ref/settings/#databases
 
-DATABASES = {
+# Selected with environment variables: POLLS_DB_ENGINE is 'sqlite' (default)
+# or 'postgresql', the latter configured by POLLS_DB_NAME, POLLS_DB_USER,
+# POLLS_DB_PASSWORD, POLLS_DB_HOST and POLLS_DB_PORT
+
+POLLS_DB_ENGINE = os.environ.get('POLLS_DB_ENGINE', 'sqlite')
+
+if POLLS_DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POLLS_DB_NAME', 'polls'),
+            'USER': os.environ.get('POLLS_DB_USER', 'polls'),
+            'PASSWORD': os.environ.get('POLLS_DB_PASSWORD', ''),
+            'HOST': os.environ.get('POLLS_DB_HOST', 'localhost'),
+            'PORT': os.environ.get('POLLS_DB_PORT', '5432'),
+            # persistent connections, seconds, 0 closes them after every request
+            'CONN_MAX_AGE': int(os.environ.get('POLLS_DB_CONN_MAX_AGE', 60)),
+            'OPTIONS': {'connect_timeout': 5},
+        }
+    }
+    # POLLS_DB_POOLER=pgbouncer when connecting through PgBouncer in transaction
+    # pooling mode, server side cursors don't survive between transactions there
+    if os.environ.get('POLLS_DB_POOLER') == 'pgbouncer':
+        DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = True
+        DATABASES['default']['CONN_MAX_AGE'] = 0
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('POLLS_DB_NAME', BASE_DIR / 'db.sqlite3'),
+            # file based test database, so threads in tests can wait for the write lock
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+        }
+    }
+
+# Read replicas: POLLS_DB_REPLICAS is a comma separated list of replica hosts
+# for PostgreSQL or of database files for SQLite. GET requests read from a replica,
+# clients which wrote something read from the primary for POLLS_REPLICA_PIN_SECONDS
+POLLS_DB_REPLICAS = []
+for number, location in enumerate(filter(None, os.environ.get('POLLS_DB_REPLICAS', '').split(',')), 1):
+    alias = 'replica{}'.format(number)
+    DATABASES[alias] = dict(DATABASES['default'], TEST={'MIRROR': 'default'},
+                            **({'HOST': location} if POLLS_DB_ENGINE == 'postgresql' else {'NAME': location}))
+    POLLS_DB_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['polls_api.replicas.ReplicaRouter']
+POLLS_REPLICA_PIN_SECONDS = 5
+
+# Persistent connections are checked before a request reuses them,
+# a connection dropped by the server is replaced instead of failing the request
+POLLS_DB_HEALTH_CHECKS = os.environ.get('POLLS_DB_HEALTH_CHECKS', 'true').lower() in ('true', '1', 'yes')
+
+# Applied to every new SQLite connection: readers don't block the writer with WAL,
+# writers wait for the lock up to busy_timeout ms instead of failing at once
+POLLS_SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.environ.get('POLLS_SQLITE_BUSY_TIMEOUT', 20000)),
+}
+
+
+# Cache of poll detail responses, a shared backend (e.g. Memcached) is
+# needed to invalidate it across several server processes
+# https://docs.djangoproject.com/en/3.2/topics/cache/
+
+CACHES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
     }
 }
 
@@ -128,5 +223,23 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Default schema
 REST_FRAMEWORK = {
-    'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema'
+    'DEFAULT_SCHEMA_CLASS': 'rest_framework.schemas.coreapi.AutoSchema',
+    # orjson based JSON when the package is installed, stdlib json otherwise
+    'DEFAULT_RENDERER_CLASSES': [
+        'polls_api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'polls_api.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    # token buckets of answer submission: burst size / refill period, None (or an empty
+    # variable) disables. Answering question by question takes one request per question,
+    # a participant may answer a 100 question poll at once, and many participants
+    # may share an address behind NAT
+    'DEFAULT_THROTTLE_RATES': {
+        'answer_ip': os.environ.get('POLLS_THROTTLE_ANSWER_IP', '1200/minute') or None,
+        'answer_participant': os.environ.get('POLLS_THROTTLE_ANSWER_PARTICIPANT', '120/minute') or None,
+    },
 }
\ No newline at end of file
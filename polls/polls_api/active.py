@@ -0,0 +1,80 @@
+"""
+Materialized list of active polls. It changes only when a poll is saved or deleted
+or when the nearest start or expiration date passes, so it is kept in memory until then
+"""
+import threading
+import time
+from django.core.cache import cache as django_cache
+from django.db.models import Min
+from django.utils import timezone
+from .models import Poll
+from .cache import POLL_RESPONSE_TIMEOUT
+from .serializers import PollValuesSerializer
+from . import replicas
+
+# version of the list in the Django cache, replaced on every poll change, like poll versions
+ACTIVE_POLLS_VERSION_KEY = 'polls_api:active_polls:version'
+ACTIVE_POLLS_KEY = 'polls_api:active_polls:{}'
+
+_local = {'version': None, 'polls': None, 'expires': None}
+_local_lock = threading.Lock()
+
+
+def current_time():
+    """
+    Time against which start and expiration dates are compared. Aware UTC time, attaching
+    a pytz zone to a naive local time with replace() gives its LMT offset (+02:30 for Moscow)
+    """
+    return timezone.now()
+
+
+def active_polls(now=None):
+    """
+    Polls which have started and are not expired
+    :param now: datetime, current time by default
+    :return: queryset of active polls
+    """
+    now = now or current_time()
+    return Poll.objects.filter(start_date__lte=now, expiration_date__gt=now)
+
+
+def _load(now):
+    """
+    :return: tuple (list of active poll values ordered by start date and id, expiration datetime or None)
+    """
+    polls = list(PollValuesSerializer.values(active_polls(now).order_by('start_date', 'id')))
+    starts = Poll.objects.filter(start_date__gt=now, expiration_date__gt=now).aggregate(date=Min('start_date'))
+    boundaries = [poll['expiration_date'] for poll in polls] + [starts['date']]
+    boundaries = [date for date in boundaries if date is not None]
+    return polls, min(boundaries) if boundaries else None
+
+
+def cached_active_polls():
+    """
+    Active polls from memory, then from the Django cache, then from the database.
+    Entries are dropped on poll changes and at the next start or expiration date
+    :return: list of dicts of PollValuesSerializer.values() ordered by start date and id
+    """
+    version = django_cache.get_or_set(ACTIVE_POLLS_VERSION_KEY, time.time_ns, None)
+    now = current_time()
+    with _local_lock:
+        if _local['version'] == version and (_local['expires'] is None or now < _local['expires']):
+            return _local['polls']
+    entry = django_cache.get(ACTIVE_POLLS_KEY.format(version))
+    if entry is None or (entry[1] is not None and now >= entry[1]):
+        with replicas.primary():
+            entry = _load(now)
+        timeout = POLL_RESPONSE_TIMEOUT
+        if entry[1] is not None:
+            timeout = max(1, min(timeout, int((entry[1] - now).total_seconds()) + 1))
+        django_cache.set(ACTIVE_POLLS_KEY.format(version), entry, timeout)
+    with _local_lock:
+        _local.update(version=version, polls=entry[0], expires=entry[1])
+    return entry[0]
+
+
+def reset_active_polls():
+    """
+    Invalidates the list in every process sharing the Django cache
+    """
+    django_cache.set(ACTIVE_POLLS_VERSION_KEY, time.time_ns(), None)
@@ -1,19 +1,109 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.views.main import PAGE_VAR
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections, models
+from django.db.models import Count, Max, Min
 from django.forms import TextInput, Textarea
-from django.db import models
-from .models import Poll, Question, Choice, Answer, Participant
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .models import Poll, Question, Choice, Answer, ArchivedAnswer, Participant, store_choice_rows
+from . import tallies
+
+
+class AtLeast(int):
+    """
+    Count which stopped at a limit, shown as '10000+'
+    """
+
+    def __str__(self):
+        return '{}+'.format(int(self))
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Counting all rows of a large table is slow. Unfiltered tables on PostgreSQL
+    are counted from the planner estimate, other counts stop count_limit rows
+    after the requested page, so the pages after it can always be reached
+    """
+    count_limit = 10000
+
+    def __init__(self, *args, page_number=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.page_number = page_number
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = max(self.page_number - 1, 0) * self.per_page + self.count_limit
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row is not None and row[0] > limit:
+                return int(row[0])
+        count = queryset[:limit + 1].count()
+        return AtLeast(limit) if count > limit else count
+
+
+class EstimatedCountMixin:
+    """
+    Admin of a large table, its paginator knows the requested page
+    """
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        try:
+            page_number = int(request.GET.get(PAGE_VAR, 1))
+        except ValueError:
+            page_number = 1
+        return self.paginator(queryset, per_page, orphans, allow_empty_first_page, page_number=page_number)
+
+
+class PollFilter(admin.SimpleListFilter):
+    title = 'poll'
+    parameter_name = 'poll'
+
+    def lookups(self, request, model_admin):
+        return Poll.objects.order_by('-id').values_list('id', 'title')
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(question__poll=self.value())
+        return queryset
+
+
+class QuestionFilter(admin.SimpleListFilter):
+    """
+    Questions of the poll selected by PollFilter, not of all polls
+    """
+    title = 'question'
+    parameter_name = 'question'
+
+    def lookups(self, request, model_admin):
+        poll = request.GET.get(PollFilter.parameter_name, '')
+        question = request.GET.get(self.parameter_name, '')
+        if poll.isdigit():
+            questions = Question.objects.filter(poll=poll)
+        elif question.isdigit():
+            # a filter without choices isn't applied, a question linked to directly is kept
+            questions = Question.objects.filter(pk=question)
+        else:
+            return []
+        return questions.order_by('id').values_list('id', 'text')
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(question=self.value())
+        return queryset
 
 
 # Register your models here.
-class AnswerInline(admin.TabularInline):
-    model = Answer
-    extra = 0
-    formfield_overrides = {
-        models.CharField: {'widget': TextInput(attrs={'size': 20})},
-        models.TextField: {'widget': Textarea(attrs={'rows': 3, 'cols': 30})}
-    }
-
-
 class ChoiceInline(admin.TabularInline):
     model = Choice
     extra = 0
@@ -32,7 +122,11 @@ class QuestionInline(admin.TabularInline):
 
 
 class QuestionAdmin(admin.ModelAdmin):
-    list_display = ('text', 'type')
+    list_display = ('text', 'type', 'poll')
+    list_select_related = ('poll',)
+    search_fields = ('text',)
+    ordering = ('-id',)
+    raw_id_fields = ('poll',)
     inlines = [
         ChoiceInline
     ]
@@ -48,15 +142,90 @@ class PollAdmin(admin.ModelAdmin):
     ]
 
 
-class AnswerAdmin(admin.ModelAdmin):
+class AnswerAdminForm(forms.ModelForm):
+    """
+    Choices are edited as choice rows, or as choice_ids without them
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # answers on choice questions have no text
+        self.fields['text_input'].required = False
+
+    def clean_choice_ids(self):
+        choice_ids = self.cleaned_data.get('choice_ids') or []
+        if not isinstance(choice_ids, list) or not all(isinstance(choice_id, int) for choice_id in choice_ids):
+            raise ValidationError('Expected a list of choice ids')
+        return sorted(set(choice_ids))
+
+    def clean(self):
+        cleaned_data = super().clean()
+        question = cleaned_data.get('question')
+        if question is None:
+            return cleaned_data
+        valid_choices = set(question.choices.values_list('id', flat=True))
+        if 'choices' in cleaned_data and not {choice.id for choice in cleaned_data['choices']} <= valid_choices:
+            self.add_error('choices', 'Choices do not correspond question')
+        if 'choice_ids' in cleaned_data and not set(cleaned_data['choice_ids']) <= valid_choices:
+            self.add_error('choice_ids', 'Choices do not correspond question')
+        return cleaned_data
+
+
+class AnswerAdmin(EstimatedCountMixin, admin.ModelAdmin):
+    form = AnswerAdminForm
     list_display = ('question', 'text_input', 'date', 'user_id')
-
-
-class ParticipantAdmin(admin.ModelAdmin):
-    inlines = [
-        AnswerInline
-    ]
+    list_select_related = ('question', 'user_id')
+    list_filter = (PollFilter, QuestionFilter, ('date', admin.DateFieldListFilter))
+    autocomplete_fields = ('question', 'user_id')
+    raw_id_fields = ('choices',)
+    ordering = ('-date', '-id')
+
+    def get_fields(self, request, obj=None):
+        # lists, results and tallies read choice_ids, without choice rows they are edited directly
+        hidden = 'choice_ids' if store_choice_rows() else 'choices'
+        return [name for name in super().get_fields(request, obj) if name != hidden]
+
+    def save_model(self, request, obj, form, change):
+        """
+        Uncounts the answer as it was, it is counted again with its choices by save_related()
+        """
+        question_ids = {obj.question_id}
+        if change:
+            previous = Answer.objects.get(pk=obj.pk)
+            tallies.remove_answer(previous)
+            question_ids.add(previous.question_id)
+        super().save_model(request, obj, form, change)
+        tallies.recount_participants(question_ids)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        answer = form.instance
+        if store_choice_rows():
+            answer.choice_ids = sorted(choice.id for choice in form.cleaned_data['choices'])
+            answer.save(update_fields=['choice_ids'])
+        tallies.add_answers(answer.user_id_id, answer.question.poll_id,
+                            [(answer.question_id, answer.text_input, answer.choice_ids)], participants=False)
+
+
+class ParticipantAdmin(EstimatedCountMixin, admin.ModelAdmin):
     list_display = ('user_id', 'first_name', 'last_name', 'email')
+    search_fields = ('=user_id', 'email')
+    ordering = ('user_id',)
+    readonly_fields = ('answers_summary',)
+
+    @admin.display(description='answers')
+    def answers_summary(self, participant):
+        """
+        Counts instead of an inline with every answer, the answers are listed by AnswerAdmin
+        """
+        summary = Answer.objects.filter(user_id=participant).aggregate(
+            answers=Count('id'), polls=Count('question__poll', distinct=True), first=Min('date'), last=Max('date'))
+        archived = ArchivedAnswer.objects.filter(user_id=participant).count()
+        first, last = (timezone.localtime(summary[name]).strftime('%Y-%m-%d %H:%M') if summary[name] else '-'
+                       for name in ('first', 'last'))
+        url = '{}?user_id__exact={}'.format(reverse('admin:polls_api_answer_changelist'), participant.pk)
+        return format_html('{} answers on {} polls, first {}, last {}, {} archived. <a href="{}">Show answers</a>',
+                           summary['answers'], summary['polls'], first, last, archived, url)
 
 
 admin.site.register(Poll, PollAdmin)
@@ -1,6 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class PollsApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'polls_api'
+
+    def ready(self):
+        from . import db, signals  # noqa: F401
+        from .search import index_migrated
+        post_migrate.connect(index_migrated, sender=self)
@@ -0,0 +1,80 @@
+"""
+Archival of answers of expired polls. Answers are moved to ArchivedAnswer in small
+transactions, vote counters of the polls stay as they are and keep serving results
+"""
+import contextvars
+import datetime
+import time
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Poll, Answer, ArchivedAnswer, PollArchive, fill_choice_ids
+
+ARCHIVED_FIELDS = ['id', 'question_id', 'text_input', 'choice_ids', 'date', 'user_id_id', 'user_id_requested']
+
+# set while answers are deleted by archival, deletion signals don't uncount them
+_archiving = contextvars.ContextVar('archiving', default=False)
+
+
+def archiving():
+    return _archiving.get()
+
+
+def archive_cutoff(grace_days=None):
+    """
+    :param grace_days: days after expiration, settings.POLLS_ARCHIVE_GRACE_DAYS by default
+    :return: polls expired before this datetime are archived
+    """
+    if grace_days is None:
+        grace_days = getattr(settings, 'POLLS_ARCHIVE_GRACE_DAYS', 30)
+    return timezone.now() - datetime.timedelta(days=grace_days)
+
+
+def polls_to_archive(cutoff):
+    """
+    Expired polls not archived yet or with answers saved after archival
+    """
+    return Poll.objects.filter(expiration_date__lt=cutoff) \
+        .filter(Q(archive__isnull=True) | Q(questions__answers__isnull=False)).distinct().order_by('id')
+
+
+def archive_poll(poll, batch_size=1000, pause=0):
+    """
+    Moves answers of the poll to the archive, batch_size answers per transaction
+    :param poll: Poll instance
+    :param pause: seconds to sleep between batches, leaves the database to live submissions
+    :return: number of moved answers
+    """
+    moved = 0
+    while True:
+        rows = list(Answer.objects.filter(question__poll=poll).order_by('id').values(*ARCHIVED_FIELDS)[:batch_size])
+        if not rows:
+            break
+        # choice rows are deleted with the answers, choices of unconverted answers are copied from them
+        fill_choice_ids(rows, force=True)
+        token = _archiving.set(True)
+        try:
+            with transaction.atomic():
+                # the transaction starts with a write, SQLite doesn't need to upgrade a read lock
+                ArchivedAnswer.objects.bulk_create([ArchivedAnswer(**row) for row in rows], ignore_conflicts=True)
+                Answer.objects.filter(id__in=[row['id'] for row in rows]).delete()
+        finally:
+            _archiving.reset(token)
+        moved += len(rows)
+        if pause:
+            time.sleep(pause)
+    PollArchive.objects.update_or_create(
+        poll=poll, defaults={'answers': ArchivedAnswer.objects.filter(question__poll=poll).count()})
+    return moved
+
+
+def is_archived(poll_id):
+    return PollArchive.objects.filter(poll=poll_id).exists()
+
+
+def answer_model(poll_id):
+    """
+    :return: model holding answers of the poll, ArchivedAnswer or Answer
+    """
+    return ArchivedAnswer if is_archived(poll_id) else Answer
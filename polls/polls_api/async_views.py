@@ -0,0 +1,146 @@
+"""
+Async versions of the read-heavy endpoints and of answer submission, for ASGI servers.
+A request waiting on a slow client holds a coroutine, not a worker thread or process.
+Django 3.2 ORM is synchronous, database work runs through sync_to_async
+"""
+import json
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse, HttpResponseNotAllowed
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from .models import Question
+from . import serializers
+from .ingestion import queue_payload
+from .spool import get_spool, queue_enabled
+from .throttling import AnswerIPThrottle, AnswerParticipantThrottle
+from .active import active_polls
+from .pagination import PollKeysetPagination
+from .views import PollViewSet, active_polls_started
+
+
+def _not_found():
+    return JsonResponse({'detail': 'Not found.'}, status=404)
+
+
+def _error(exc):
+    """
+    Response of a DRF exception, as its exception handler gives
+    """
+    data = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return exc.status_code, data
+
+
+@sync_to_async
+def _poll_list(request):
+    """
+    Same as PollViewSet.list
+    :return: tuple (status code, response data)
+    """
+    request = Request(request)
+    paginator = PollKeysetPagination()
+    try:
+        page = paginator.paginate_queryset(active_polls_started(request), request, PollViewSet)
+    except APIException as exc:
+        return _error(exc)
+    return 200, paginator.get_paginated_response(serializers.PollValuesSerializer.serialize(page)).data
+
+
+@sync_to_async
+def _poll_detail(poll_id, expand_choices):
+    queryset = active_polls().prefetch_related('questions__choices' if expand_choices else 'questions')
+    poll = queryset.filter(pk=poll_id).first()
+    if poll is None:
+        return None
+    serializer_class = serializers.PollFullSerializer if expand_choices else serializers.PollDetailSerializer
+    return serializer_class(poll).data
+
+
+@sync_to_async
+def _question_detail(poll_id, question_id):
+    question = Question.objects.filter(poll=poll_id, pk=question_id).prefetch_related('choices').first()
+    if question is None:
+        return None
+    return serializers.QuestionDetailSerializer(question).data
+
+
+def _throttle_wait(request):
+    """
+    Applies throttles of AnswerViewSet.create
+    :return: seconds until the request would be allowed or None
+    """
+    request = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES])
+    waits = [throttle.wait() for throttle in (AnswerIPThrottle(), AnswerParticipantThrottle())
+             if not throttle.allow_request(request, None)]
+    return max(waits) if waits else None
+
+
+@sync_to_async
+def _create_answer(request, data):
+    """
+    Same as AnswerViewSet.create
+    :return: tuple (status code, response data)
+    """
+    wait = _throttle_wait(request)
+    if wait is not None:
+        return 429, {'detail': 'Request was throttled. Expected available in {} seconds.'.format(int(wait + 1))}
+    serializer = serializers.AnswerSerializer(data=data)
+    if not serializer.is_valid():
+        return 400, serializer.errors
+    if queue_enabled():
+        submission_id = get_spool().put(queue_payload(serializer.validated_data))
+        return 202, {'submission': submission_id, 'status': 'queued'}
+    serializer.save()
+    return 201, serializer.data
+
+
+async def poll_list(request):
+    """
+    Return active polls page by page ordered by start date, since and until filter by start date
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    status, data = await _poll_list(request)
+    return JsonResponse(data, status=status)
+
+
+async def poll_detail(request, poll_id):
+    """
+    Return the given poll, with expand=questions.choices with choices of every question
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    expand_choices = 'questions.choices' in request.GET.get('expand', '').split(',')
+    data = await _poll_detail(poll_id, expand_choices)
+    return _not_found() if data is None else JsonResponse(data)
+
+
+async def question_detail(request, poll_id, question_id):
+    """
+    Return the given question with choices
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    data = await _question_detail(poll_id, question_id)
+    return _not_found() if data is None else JsonResponse(data)
+
+
+async def answer_create(request, poll_id, question_id):
+    """
+    Post an answer on question
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return JsonResponse({'detail': 'JSON parse error'}, status=400)
+    else:
+        data = request.POST
+    status, response_data = await _create_answer(request, data)
+    return JsonResponse(response_data, status=status)
+
+
+# csrf_exempt() of Django 3.2 wraps views into sync functions, API clients don't send CSRF tokens
+answer_create.csrf_exempt = True
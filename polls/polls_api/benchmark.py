@@ -0,0 +1,170 @@
+"""
+Benchmark of the API endpoints on a seeded dataset
+"""
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from .models import Poll, Question, Choice, Answer, Participant, store_choice_rows
+from . import tallies
+
+
+def seed(polls=20, questions=10, choices=5, participants=1000, answers=20000, rnd=None):
+    """
+    Fills empty database with active polls and answers on them
+    :return: dict with lists of ids of the created objects
+    """
+    rnd = rnd or random.Random(0)
+    now = timezone.now()
+    types = ['TEXT', 'SINGLE', 'MULTI']
+    with transaction.atomic():
+        Poll.objects.bulk_create(
+            [Poll(id=poll_id, title='poll {}'.format(poll_id), start_date=now - timedelta(days=1),
+                  expiration_date=now + timedelta(days=30))
+             for poll_id in range(1, polls + 1)], batch_size=1000)
+        # start_date is auto_now_add, put it in the past
+        Poll.objects.update(start_date=now - timedelta(days=1))
+        question_objects = [Question(id=question_id, text='question {}'.format(question_id),
+                                     type=types[question_id % 3], poll_id=(question_id - 1) // questions + 1)
+                            for question_id in range(1, polls * questions + 1)]
+        Question.objects.bulk_create(question_objects, batch_size=1000)
+        choice_ids = {}
+        choice_objects = []
+        for question in question_objects:
+            if question.type == 'TEXT':
+                continue
+            first = len(choice_objects) + 1
+            choice_ids[question.id] = list(range(first, first + choices))
+            choice_objects.extend(Choice(id=choice_id, question_id=question.id, title='choice {}'.format(choice_id))
+                                  for choice_id in choice_ids[question.id])
+        Choice.objects.bulk_create(choice_objects, batch_size=1000)
+        Participant.objects.bulk_create([Participant(user_id=user_id) for user_id in range(1, participants + 1)],
+                                        batch_size=1000)
+        answer_objects = []
+        through_objects = []
+        for answer_id in range(1, answers + 1):
+            question = rnd.choice(question_objects)
+            user_id = rnd.randint(1, participants)
+            selected = []
+            if question.type != 'TEXT':
+                selected = sorted(rnd.sample(choice_ids[question.id], 1 if question.type == 'SINGLE' else 2))
+            answer_objects.append(Answer(id=answer_id, question_id=question.id, user_id_id=user_id,
+                                         user_id_requested=user_id, choice_ids=selected,
+                                         text_input='answer' if question.type == 'TEXT' else None))
+            if store_choice_rows():
+                through_objects.extend(Answer.choices.through(answer_id=answer_id, choice_id=choice_id)
+                                       for choice_id in selected)
+        Answer.objects.bulk_create(answer_objects, batch_size=1000)
+        Answer.choices.through.objects.bulk_create(through_objects, batch_size=1000)
+        tallies.rebuild()
+    return {'polls': list(range(1, polls + 1)),
+            'questions': [(question.poll_id, question.id, question.type) for question in question_objects],
+            'choices': choice_ids,
+            'participants': list(range(1, participants + 1))}
+
+
+def scenarios(dataset, rnd):
+    """
+    Requests of every benchmarked endpoint
+    :return: dict of name -> function returning (method, url, data, admin)
+    """
+    def poll():
+        return rnd.choice(dataset['polls'])
+
+    def question():
+        return rnd.choice(dataset['questions'])
+
+    def answer():
+        poll_id, question_id, question_type = question()
+        data = {'question': question_id, 'user_id_requested': rnd.choice(dataset['participants'])}
+        if question_type == 'TEXT':
+            data['text_input'] = 'benchmark answer'
+        else:
+            data['choices'] = rnd.sample(dataset['choices'][question_id], 1 if question_type == 'SINGLE' else 2)
+        return 'post', '/api/poll/{}/question/{}/answer/'.format(poll_id, question_id), data, False
+
+    return {
+        'poll_list': lambda: ('get', '/api/poll/', None, False),
+        'poll_retrieve': lambda: ('get', '/api/poll/{}/'.format(poll()), None, False),
+        'question_retrieve': lambda: ('get', '/api/poll/{}/question/{}/'.format(*question()[:2]), None, False),
+        'answer_create': answer,
+        'answer_list': lambda: ('get', '/api/poll/{}/question/{}/answer/'.format(*question()[:2]), None, True),
+        'user_list': lambda: ('get', '/api/user', None, False),
+        'user_retrieve': lambda: ('get', '/api/user/{}'.format(rnd.choice(dataset['participants'])), None, False),
+    }
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def run_scenario(make_request, requests=200, concurrency=1, cold=False):
+    """
+    Sends requests of one scenario and measures them
+    :param make_request: function returning (method, url, data, admin)
+    :param requests: number of requests
+    :param concurrency: number of threads sending requests
+    :param cold: clear the cache before every request
+    :return: dict with latency percentiles in ms, throughput and SQL query counts
+    """
+    admin = User.objects.filter(is_superuser=True).first()
+    local = threading.local()
+    lock = threading.Lock()
+
+    def send():
+        if not hasattr(local, 'client'):
+            local.client = Client()
+            local.client.force_login(admin)
+            local.anonymous = Client()
+        with lock:
+            method, url, data, as_admin = make_request()
+        client = local.client if as_admin else local.anonymous
+        if cold:
+            cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            if method == 'post':
+                response = client.post(url, data, content_type='application/json', HTTP_ACCEPT='application/json')
+            else:
+                response = client.get(url, HTTP_ACCEPT='application/json')
+            elapsed = time.perf_counter() - started
+        return elapsed * 1000, len(queries.captured_queries), response.status_code
+
+    def work(count):
+        try:
+            return [send() for _ in range(count)]
+        finally:
+            # once per thread, requests of the thread reuse its connection as those of a server worker do
+            connection.close()
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        counts = [requests // concurrency + (number < requests % concurrency) for number in range(concurrency)]
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = [result for results in executor.map(work, counts) for result in results]
+    else:
+        results = [send() for _ in range(requests)]
+    total = time.perf_counter() - started
+    latencies = [latency for latency, _, _ in results]
+    query_counts = [count for _, count, _ in results]
+    return {'requests': requests,
+            'concurrency': concurrency,
+            'throughput_rps': round(requests / total, 2),
+            'latency_ms': {'mean': round(statistics.mean(latencies), 3),
+                           'p50': round(percentile(latencies, 0.50), 3),
+                           'p90': round(percentile(latencies, 0.90), 3),
+                           'p99': round(percentile(latencies, 0.99), 3),
+                           'max': round(max(latencies), 3)},
+            'queries': {'mean': round(statistics.mean(query_counts), 2),
+                        'max': max(query_counts)},
+            'status': dict(Counter(str(status) for _, _, status in results))}
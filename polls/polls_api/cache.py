@@ -0,0 +1,106 @@
+"""
+In-process caches for the hot paths of the polls API
+"""
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache import cache as django_cache
+
+
+class LRUCache:
+    """
+    Thread-safe LRU mapping with an optional time to live of the entries
+    """
+
+    def __init__(self, maxsize=1024, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Return cached value and mark it as recently used
+        :param key: cache key
+        :param default: returned on miss or on expired entry
+        :return: cached value
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """
+        Put value to the cache, evicting the least recently used entry
+        """
+        expires = time.monotonic() + self.timeout if self.timeout is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __len__(self):
+        return len(self._data)
+
+
+# question id -> (poll version, question type, frozenset of its choice ids). Entries of
+# an old version are loaded again, so edits made by another process are seen at once
+question_schemas = LRUCache(maxsize=4096)
+
+
+def get_question_schema(question):
+    """
+    Type and valid choice ids of the question, one query on cache miss
+    :param question: Question instance
+    :return: tuple (type, frozenset of choice ids)
+    """
+    # read before the choices, a change in between leaves an entry of the old version
+    version = poll_version(question.poll_id)
+    entry = question_schemas.get(question.id)
+    if entry is None or entry[0] != version:
+        entry = (version, question.type, frozenset(question.choices.values_list('id', flat=True)))
+        question_schemas.set(question.id, entry)
+    return entry[1:]
+
+
+# Versions of the poll structure in the Django cache. A version is replaced,
+# not incremented, so a version evicted from the cache is never reused. Versions
+# expire with the responses cached under them, ids of missing polls don't pile up
+POLL_VERSION_KEY = 'polls_api:poll:{}:version'
+POLL_RESPONSE_TIMEOUT = 60 * 60
+
+
+def poll_version(poll_id):
+    """
+    Current structure version of the poll: its questions and choices
+    :param poll_id: id of the poll
+    :return: version token
+    """
+    return django_cache.get_or_set(POLL_VERSION_KEY.format(poll_id), time.time_ns, POLL_RESPONSE_TIMEOUT)
+
+
+def bump_poll_version(poll_id):
+    """
+    Invalidates cached responses of the poll
+    :param poll_id: id of the poll
+    """
+    django_cache.set(POLL_VERSION_KEY.format(poll_id), time.time_ns(), POLL_RESPONSE_TIMEOUT)
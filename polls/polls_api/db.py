@@ -0,0 +1,33 @@
+"""
+Setup of database connections
+"""
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    """
+    Applies settings.POLLS_SQLITE_PRAGMAS to a new SQLite connection
+    """
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'POLLS_SQLITE_PRAGMAS', {}).items():
+            cursor.execute('PRAGMA {} = {}'.format(name, value))
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    """
+    Closes persistent connections which stopped working, so the request opens a new one
+    """
+    if not getattr(settings, 'POLLS_DB_HEALTH_CHECKS', False):
+        return
+    for connection in connections.all():
+        if (connection.connection is not None and connection.settings_dict['CONN_MAX_AGE']
+                and not connection.in_atomic_block and not connection.is_usable()):
+            connection.close()
@@ -0,0 +1,31 @@
+"""
+Export of poll results row by row, with constant memory use
+"""
+from .models import Choice, Answer, iter_choice_ids
+from .archive import answer_model
+
+EXPORT_COLUMNS = ['answer_id', 'date', 'question_id', 'question_text', 'question_type',
+                  'user_id', 'first_name', 'last_name', 'email', 'text_input', 'choices']
+CHUNK_SIZE = 2000
+
+
+def iter_answer_rows(poll, chunk_size=CHUNK_SIZE):
+    """
+    Answers of the poll joined with question and participant,
+    choice ids of the answers are replaced by titles of the choices.
+    Answers of archived polls are read from the archive
+    :param poll: Poll instance or id
+    :param chunk_size: number of rows fetched from the database at once
+    :return: generator of lists of values in EXPORT_COLUMNS order
+    """
+    titles = dict(Choice.objects.filter(question__poll=poll).values_list('id', 'title'))
+    model = answer_model(poll)
+    fields = ['id', 'date', 'question_id', 'question__text', 'question__type',
+              'user_id_id', 'user_id__first_name', 'user_id__last_name', 'user_id__email', 'text_input']
+    rows = model.objects.filter(question__poll=poll).order_by('id').values(*fields, 'choice_ids') \
+        .iterator(chunk_size=chunk_size)
+    if model is Answer:
+        rows = iter_choice_ids(rows, chunk_size)
+    for row in rows:
+        yield [row[name] for name in fields] + [[titles[choice_id] for choice_id in row['choice_ids']
+                                                 if choice_id in titles]]
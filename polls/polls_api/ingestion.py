@@ -0,0 +1,59 @@
+"""
+Writes queued answer submissions to the database in batches
+"""
+import uuid
+from django.db import IntegrityError, transaction
+from rest_framework.exceptions import ValidationError
+from .models import AnswerSubmission
+from .serializers import AnswerSerializer
+
+
+def queue_payload(validated_data):
+    """
+    JSON serializable answer data kept in the spool
+    :param validated_data: validated data of AnswerSerializer
+    :return: dict accepted by AnswerSerializer
+    """
+    return {'question': validated_data['question'].id,
+            'text_input': validated_data.get('text_input'),
+            'choices': validated_data['choices'],
+            'user_id_requested': validated_data.get('user_id_requested', 0)}
+
+
+def process_batch(spool, limit):
+    """
+    Saves up to limit queued submissions in one transaction
+    :param spool: AnswerSpool
+    :param limit: maximum number of submissions
+    :return: tuple (number of saved, number of failed submissions)
+    """
+    claimed = spool.claim(limit)
+    if not claimed:
+        return 0, 0
+    saved = AnswerSubmission.objects.filter(id__in=[uuid.UUID(submission_id) for submission_id, _ in claimed])
+    done = {str(submission_id): answer_id for submission_id, answer_id in saved.values_list('id', 'answer_id')}
+    failed = {}
+    valid = []
+    # everything is read before the transaction, on SQLite it then starts with a write
+    for submission_id, payload in claimed:
+        if submission_id in done:  # saved before the worker stopped
+            continue
+        serializer = AnswerSerializer(data=payload)
+        if serializer.is_valid():
+            valid.append((submission_id, serializer))
+        else:
+            failed[submission_id] = serializer.errors
+    with transaction.atomic():
+        for submission_id, serializer in valid:
+            try:
+                with transaction.atomic():
+                    answer = serializer.save()
+                    AnswerSubmission.objects.create(id=submission_id, answer=answer)
+            except IntegrityError as error:
+                failed[submission_id] = {'detail': str(error)}
+            except ValidationError as error:  # repeated answer rejected by the policy
+                failed[submission_id] = error.detail
+            else:
+                done[submission_id] = answer.id
+    spool.finish(done, failed)
+    return len(done), len(failed)
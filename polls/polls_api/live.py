@@ -0,0 +1,209 @@
+"""
+Live results of polls streamed as server-sent events. One publisher per watched poll
+reads its counters once per settings.POLLS_LIVE_INTERVAL and sends the changes to
+every subscriber, so the database cost doesn't depend on the number of viewers
+"""
+import asyncio
+import json
+import logging
+import re
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+from .models import Poll, PollTally, ChoiceTally
+
+logger = logging.getLogger(__name__)
+
+LIVE_PATH = re.compile(r'^/api/poll/(?P<poll_id>[0-9]+)/live$')
+
+# publishers of the process by poll id, all run on the event loop of the ASGI server
+publishers = {}
+
+
+def read_counts(poll_id):
+    """
+    :return: dict with participants of the poll and votes by choice id
+    """
+    return {'participants': PollTally.objects.filter(poll=poll_id).values_list('participants', flat=True).first() or 0,
+            'choices': dict(ChoiceTally.objects.filter(choice__question__poll=poll_id)
+                            .values_list('choice_id', 'votes'))}
+
+
+def diff_counts(old, new):
+    """
+    :return: changes from old to new counts in the format of read_counts, participants only if changed
+    """
+    deltas = {'choices': {choice_id: votes - old['choices'].get(choice_id, 0)
+                          for choice_id, votes in new['choices'].items()
+                          if votes != old['choices'].get(choice_id, 0)}}
+    if new['participants'] != old['participants']:
+        deltas['participants'] = new['participants'] - old['participants']
+    return deltas
+
+
+class Subscriber:
+    """
+    Events waiting to be sent to one client. A slow client gets the changes
+    of several intervals merged into one event, nothing is queued up
+    """
+
+    def __init__(self):
+        self.started = False
+        self.counts = None
+        self.deltas = {'choices': {}}
+        self.closed = False
+        self.ready = asyncio.Event()
+
+    def start(self, counts):
+        self.started = True
+        self.counts = {'participants': counts['participants'], 'choices': dict(counts['choices'])}
+        self.ready.set()
+
+    def push(self, deltas):
+        # changes before the first event was sent are applied to it
+        target = self.counts if self.counts is not None else self.deltas
+        for choice_id, delta in deltas['choices'].items():
+            target['choices'][choice_id] = target['choices'].get(choice_id, 0) + delta
+        if 'participants' in deltas:
+            target['participants'] = target.get('participants', 0) + deltas['participants']
+        self.ready.set()
+
+    def close(self):
+        self.closed = True
+        self.ready.set()
+
+    def pop(self):
+        """
+        :return: list of tuples (event name, data) to send
+        """
+        self.ready.clear()
+        events = []
+        if self.counts is not None:
+            events.append(('counts', self.counts))
+            self.counts = None
+        else:
+            choices = {choice_id: delta for choice_id, delta in self.deltas['choices'].items() if delta}
+            if choices or self.deltas.get('participants'):
+                events.append(('delta', dict(self.deltas, choices=choices)))
+            self.deltas = {'choices': {}}
+        if self.closed:
+            events.append(('end', {}))
+        return events
+
+
+class PollPublisher:
+    """
+    Reads counters of the poll while it has subscribers, until the poll expires
+    """
+
+    def __init__(self, poll_id, expiration_date):
+        self.poll_id = poll_id
+        self.expiration_date = expiration_date
+        self.subscribers = set()
+        self.counts = None
+        self.task = None
+
+    def subscribe(self):
+        subscriber = Subscriber()
+        if self.counts is not None:
+            subscriber.start(self.counts)
+        self.subscribers.add(subscriber)
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def run(self):
+        try:
+            while self.subscribers:
+                counts = await sync_to_async(read_counts)(self.poll_id)
+                deltas = diff_counts(self.counts, counts) if self.counts is not None else None
+                self.counts = counts
+                for subscriber in self.subscribers:
+                    if not subscriber.started:
+                        subscriber.start(counts)
+                    elif deltas['choices'] or 'participants' in deltas:
+                        subscriber.push(deltas)
+                if timezone.now() >= self.expiration_date:
+                    break
+                await asyncio.sleep(getattr(settings, 'POLLS_LIVE_INTERVAL', 1.0))
+        except Exception:
+            logger.exception('Live results of poll %s failed', self.poll_id)
+        finally:
+            # checked and removed without awaiting in between, a new subscriber starts a new publisher
+            if publishers.get(self.poll_id) is self:
+                del publishers[self.poll_id]
+            for subscriber in self.subscribers:
+                subscriber.close()
+
+
+def format_event(name, data):
+    return 'event: {}\ndata: {}\n\n'.format(name, json.dumps(data, separators=(',', ':'))).encode()
+
+
+class LiveResultsApp:
+    """
+    ASGI application serving GET /api/poll/<poll_id>/live, other requests go to the wrapped application.
+    Events: 'counts' with all counters first, then 'delta' with changes, 'end' when the poll expires
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        match = LIVE_PATH.match(scope['path']) if scope['type'] == 'http' else None
+        if match is None:
+            return await self.app(scope, receive, send)
+        if scope['method'] != 'GET':
+            return await self.respond(send, 405, {'detail': 'Method "{}" not allowed.'.format(scope['method'])})
+        poll_id = int(match.group('poll_id'))
+        poll = await sync_to_async(Poll.objects.filter(pk=poll_id).values('expiration_date').first)()
+        if poll is None:
+            return await self.respond(send, 404, {'detail': 'Not found.'})
+        publisher = publishers.get(poll_id)
+        if publisher is None:
+            publisher = publishers[poll_id] = PollPublisher(poll_id, poll['expiration_date'])
+        subscriber = publisher.subscribe()
+        try:
+            await self.stream(subscriber, receive, send)
+        finally:
+            publisher.unsubscribe(subscriber)
+
+    async def respond(self, send, status, data):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'application/json')]})
+        await send({'type': 'http.response.body', 'body': json.dumps(data).encode()})
+
+    async def stream(self, subscriber, receive, send):
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream'),
+                                (b'cache-control', b'no-cache'),
+                                # proxies must not buffer the stream
+                                (b'x-accel-buffering', b'no')]})
+        await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+        disconnect = asyncio.ensure_future(self.wait_disconnect(receive))
+        try:
+            while True:
+                ready = asyncio.ensure_future(subscriber.ready.wait())
+                done, _ = await asyncio.wait({ready, disconnect}, return_when=asyncio.FIRST_COMPLETED,
+                                             timeout=getattr(settings, 'POLLS_LIVE_KEEPALIVE', 15))
+                if ready not in done:
+                    ready.cancel()
+                if disconnect in done:
+                    return
+                if ready not in done:
+                    await send({'type': 'http.response.body', 'body': b': keep-alive\n\n', 'more_body': True})
+                    continue
+                body = b''.join(format_event(name, data) for name, data in subscriber.pop())
+                if body:
+                    await send({'type': 'http.response.body', 'body': body, 'more_body': not subscriber.closed})
+                if subscriber.closed:
+                    return
+        finally:
+            disconnect.cancel()
+
+    async def wait_disconnect(self, receive):
+        while (await receive())['type'] != 'http.disconnect':
+            pass
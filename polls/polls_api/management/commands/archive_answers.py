@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+from polls_api.models import Answer
+from polls_api import archive
+
+
+class Command(BaseCommand):
+    help = ('Moves answers of polls expired more than the grace period ago to the archive table. '
+            'Results of archived polls are kept in the counters. Meant to be run periodically, e.g. by cron')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-days', type=float, default=None,
+                            help='days after expiration, settings.POLLS_ARCHIVE_GRACE_DAYS by default')
+        parser.add_argument('--poll', type=int, action='append', dest='polls',
+                            help='id of an expired poll to archive, may be repeated (all by default)')
+        parser.add_argument('--batch', type=int, default=1000, help='answers moved per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true', help='only list the polls and their answer counts')
+
+    def handle(self, *args, **options):
+        polls = archive.polls_to_archive(archive.archive_cutoff(options['grace_days']))
+        if options['polls']:
+            polls = polls.filter(pk__in=options['polls'])
+        if options['dry_run']:
+            counts = dict(Answer.objects.filter(question__poll__in=polls).order_by().values('question__poll')
+                          .annotate(count=Count('id')).values_list('question__poll', 'count'))
+            for poll in polls:
+                self.stdout.write('poll {}: {} answers'.format(poll.id, counts.get(poll.id, 0)))
+            return
+        total = 0
+        for poll in polls:
+            moved = archive.archive_poll(poll, options['batch'], options['pause'])
+            total += moved
+            self.stdout.write('poll {}: archived {} answers'.format(poll.id, moved))
+        self.stdout.write(self.style.SUCCESS('Archived {} answers'.format(total)))
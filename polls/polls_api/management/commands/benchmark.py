@@ -0,0 +1,76 @@
+import json
+import platform
+import random
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_test_environment, teardown_test_environment
+from django.utils import timezone
+from polls_api import benchmark
+
+
+class Command(BaseCommand):
+    help = ('Seeds a test database and measures latency, throughput and SQL queries '
+            'of the API endpoints, prints results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--polls', type=int, default=20)
+        parser.add_argument('--questions', type=int, default=10, help='questions per poll')
+        parser.add_argument('--choices', type=int, default=5, help='choices per question')
+        parser.add_argument('--participants', type=int, default=1000)
+        parser.add_argument('--answers', type=int, default=20000)
+        parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=1, help='threads sending requests')
+        parser.add_argument('--cold', action='store_true', help='clear the cache before every request')
+        parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='scenario to run, may be repeated (all by default)')
+        parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+        parser.add_argument('--output', help='write JSON to the file instead of stdout')
+
+    def handle(self, *args, **options):
+        rnd = random.Random(options['seed'])
+        setup_test_environment()
+        # the dataset goes to a throwaway test database, never to the configured one
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            cache.clear()
+            dataset = benchmark.seed(polls=options['polls'], questions=options['questions'],
+                                     choices=options['choices'], participants=options['participants'],
+                                     answers=options['answers'], rnd=rnd)
+            User.objects.create_superuser('benchmark', 'benchmark@example.com', 'benchmark')
+            scenarios = benchmark.scenarios(dataset, rnd)
+            names = options['scenarios'] or list(scenarios)
+            unknown = set(names) - set(scenarios)
+            if unknown:
+                raise CommandError('Unknown scenarios: {}'.format(', '.join(sorted(unknown))))
+            results = {}
+            # every request comes from one address, answer throttles would reject most of them
+            with override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={})):
+                for name in names:
+                    self.stderr.write('Running {}...'.format(name))
+                    results[name] = benchmark.run_scenario(scenarios[name], requests=options['requests'],
+                                                           concurrency=options['concurrency'],
+                                                           cold=options['cold'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        report = {'date': timezone.now().isoformat(),
+                  'environment': {'python': platform.python_version(),
+                                  'django': django.get_version(),
+                                  'database': connection.vendor,
+                                  'conn_max_age': connection.settings_dict['CONN_MAX_AGE'],
+                                  'sqlite_pragmas': (getattr(settings, 'POLLS_SQLITE_PRAGMAS', {})
+                                                     if connection.vendor == 'sqlite' else None)},
+                  'dataset': {name: options[name] for name in
+                              ('polls', 'questions', 'choices', 'participants', 'answers', 'seed')},
+                  'options': {name: options[name] for name in ('requests', 'concurrency', 'cold')},
+                  'scenarios': results}
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                file.write(output + '\n')
+        else:
+            self.stdout.write(output)
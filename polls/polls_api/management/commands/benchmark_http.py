@@ -0,0 +1,78 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = ('Sends concurrent requests from slow clients to a running server, '
+            'to compare the WSGI and ASGI deployments. Prints results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', help='e.g. http://127.0.0.1:8000/api/async/poll/')
+        parser.add_argument('--clients', type=int, default=200, help='simultaneous connections')
+        parser.add_argument('--requests', type=int, default=1000, help='total number of requests')
+        parser.add_argument('--slow', type=float, default=0.5,
+                            help='seconds every client takes to send its request, like a slow mobile network')
+        parser.add_argument('--timeout', type=float, default=30.0, help='seconds to wait for a response')
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        if url.scheme != 'http':
+            raise CommandError('Only http:// urls are supported')
+        results = asyncio.run(self.run(url, options))
+        latencies = sorted(latency for latency, ok in results if ok)
+        errors = sum(1 for _, ok in results if not ok)
+        elapsed = self.elapsed
+        report = {'url': options['url'],
+                  'clients': options['clients'],
+                  'requests': options['requests'],
+                  'slow_client_s': options['slow'],
+                  'errors': errors,
+                  'throughput_rps': round(len(latencies) / elapsed, 2)}
+        if latencies:
+            report['latency_ms'] = {'mean': round(statistics.mean(latencies), 3),
+                                    'p50': round(latencies[len(latencies) // 2], 3),
+                                    'p90': round(latencies[int(len(latencies) * 0.9)], 3),
+                                    'p99': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 3),
+                                    'max': round(latencies[-1], 3)}
+        self.stdout.write(json.dumps(report, indent=2))
+
+    async def run(self, url, options):
+        semaphore = asyncio.Semaphore(options['clients'])
+        request = ('GET {} HTTP/1.1\r\nHost: {}\r\nAccept: application/json\r\n'
+                   'Connection: close\r\n\r\n').format(url.path + ('?' + url.query if url.query else ''),
+                                                       url.netloc).encode()
+
+        async def client():
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    response = await asyncio.wait_for(self.send(url, request, options['slow']), options['timeout'])
+                except (OSError, asyncio.TimeoutError):
+                    return 0, False
+                ok = response.startswith(b'HTTP/1.1 200') or response.startswith(b'HTTP/1.0 200')
+                return (time.perf_counter() - started) * 1000, ok
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(client() for _ in range(options['requests'])))
+        self.elapsed = time.perf_counter() - started
+        return results
+
+    async def send(self, url, request, slow):
+        """
+        Sends the request in a few parts spread over slow seconds and reads the whole response
+        """
+        reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+        try:
+            parts = 4
+            size = len(request) // parts + 1
+            for offset in range(0, len(request), size):
+                writer.write(request[offset:offset + size])
+                await writer.drain()
+                await asyncio.sleep(slow / parts)
+            return await reader.read()
+        finally:
+            writer.close()
@@ -0,0 +1,154 @@
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+from polls_api.models import Poll, Question, Answer, Participant
+
+ALIAS = 'index_benchmark'
+MODELS = [Poll, Question, Participant, Answer]
+
+
+class Command(BaseCommand):
+    help = ('Seeds a separate SQLite database with polls and answers and compares '
+            'query plans and latencies of the hot queries without and with indexes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--answers', type=int, default=2000000, help='number of answers to seed')
+        parser.add_argument('--polls', type=int, default=20000, help='number of polls, most of them expired')
+        parser.add_argument('--questions', type=int, default=500, help='number of questions with answers')
+        parser.add_argument('--participants', type=int, default=50000, help='number of participants')
+        parser.add_argument('--repeat', type=int, default=20, help='runs of every query')
+        parser.add_argument('--database', help='path of the SQLite file, temporary by default')
+        parser.add_argument('--json', action='store_true', help='print the report as JSON')
+
+    def handle(self, *args, **options):
+        directory = None if options['database'] else tempfile.mkdtemp()
+        path = options['database'] or os.path.join(directory, 'index_benchmark.sqlite3')
+        connections.databases[ALIAS] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': path}
+        connection = connections[ALIAS]
+        try:
+            self.create_tables(connection)
+            self.seed(connection, options)
+            queries = self.queries(options)
+            report = {'database': path, 'answers': options['answers'], 'queries': {}}
+            for stage in ('without_indexes', 'with_indexes'):
+                if stage == 'with_indexes':
+                    self.add_indexes(connection)
+                for name, queryset in queries.items():
+                    report['queries'].setdefault(name, {})[stage] = self.measure(connection, queryset,
+                                                                                 options['repeat'])
+        finally:
+            connection.close()
+            del connections.databases[ALIAS]
+            if directory:
+                shutil.rmtree(directory)
+        self.write_report(report, options['json'])
+
+    def create_tables(self, connection):
+        """
+        Tables of the models with the indexes of Meta.indexes dropped
+        """
+        with connection.schema_editor() as editor:
+            for model in MODELS:
+                editor.create_model(model)
+        # indexes are created when the editor exits
+        with connection.schema_editor() as editor:
+            for model in MODELS:
+                for index in model._meta.indexes:
+                    editor.remove_index(model, index)
+
+    def add_indexes(self, connection):
+        with connection.schema_editor() as editor:
+            for model in MODELS:
+                for index in model._meta.indexes:
+                    editor.add_index(model, index)
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def seed(self, connection, options):
+        """
+        Polls start during the last year and last up to two months,
+        answers are spread over the questions and the last 30 days
+        """
+        rnd = random.Random(0)
+        now = timezone.now()
+        self.stderr.write('Seeding {} answers...'.format(options['answers']))
+        with transaction.atomic(using=ALIAS), connection.cursor() as cursor:
+            polls = []
+            for poll_id in range(1, options['polls'] + 1):
+                start = now - timedelta(days=rnd.uniform(0, 365))
+                polls.append((poll_id, 'poll', start, start + timedelta(days=rnd.uniform(1, 60)), ''))
+            cursor.executemany('INSERT INTO polls_api_poll (id, title, start_date, expiration_date, description) '
+                               'VALUES (%s, %s, %s, %s, %s)', polls)
+            cursor.executemany('INSERT INTO polls_api_question (id, text, type, poll_id) VALUES (%s, %s, %s, %s)',
+                               [(question_id, 'question', 'TEXT', rnd.randint(1, options['polls']))
+                                for question_id in range(1, options['questions'] + 1)])
+            cursor.executemany('INSERT INTO polls_api_participant (user_id) VALUES (%s)',
+                               [(user_id,) for user_id in range(1, options['participants'] + 1)])
+            batch = 50000
+            for offset in range(0, options['answers'], batch):
+                cursor.executemany(
+                    'INSERT INTO polls_api_answer (question_id, text_input, date, user_id_id, user_id_requested, '
+                    'choice_ids) VALUES (%s, %s, %s, %s, %s, %s)',
+                    [(rnd.randint(1, options['questions']), 'text',
+                      now - timedelta(seconds=rnd.uniform(0, 30 * 24 * 3600)),
+                      user_id, user_id, '[]')
+                     for user_id in (rnd.randint(1, options['participants'])
+                                     for _ in range(min(batch, options['answers'] - offset)))])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def queries(self, options):
+        """
+        Querysets as built by PollViewSet.list, AnswerViewSet.list and participant views
+        """
+        now = timezone.now()
+        question_id = options['questions'] // 2
+        participant_id = options['participants'] // 2
+        return {
+            'active_polls': Poll.objects.using(ALIAS).filter(start_date__lte=now, expiration_date__gt=now),
+            'question_answers': Answer.objects.using(ALIAS).filter(question=question_id),
+            'question_answers_since': Answer.objects.using(ALIAS).filter(
+                question=question_id, date__gte=now - timedelta(days=1)),
+            'participant_answers': Answer.objects.using(ALIAS).filter(user_id=participant_id),
+        }
+
+    def measure(self, connection, queryset, repeat):
+        """
+        :return: dict with the query plan, number of rows and latency percentiles in ms
+        """
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+            timings = []
+            rows = 0
+            for _ in range(repeat):
+                started = time.perf_counter()
+                cursor.execute(sql, params)
+                rows = len(cursor.fetchall())
+                timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        return {'plan': plan,
+                'rows': rows,
+                'p50_ms': round(statistics.median(timings), 3),
+                'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3)}
+
+    def write_report(self, report, as_json):
+        if as_json:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for name, stages in report['queries'].items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for stage, result in stages.items():
+                self.stdout.write('  {}: {} rows, p50 {} ms, p95 {} ms'.format(
+                    stage, result['rows'], result['p50_ms'], result['p95_ms']))
+                for line in result['plan']:
+                    self.stdout.write('    ' + line)
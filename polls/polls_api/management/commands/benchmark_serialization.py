@@ -0,0 +1,83 @@
+import gc
+import io
+import json
+import platform
+import random
+import statistics
+import time
+import django
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from polls_api import benchmark, renderers
+from polls_api.models import Answer
+from polls_api.serializers import AnswerSerializer, AnswerValuesSerializer
+
+
+class Command(BaseCommand):
+    help = ('Seeds a test database and compares serialization, JSON rendering and parsing '
+            'of the answer list: model serializer and stdlib json against values() rows and orjson. '
+            'Prints results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--answers', type=int, default=100000)
+        parser.add_argument('--repeat', type=int, default=5, help='runs of every measurement')
+        parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+
+    def measure(self, function, repeat):
+        """
+        :return: tuple (dict of median and best time in ms, result of the last run)
+        """
+        timings = []
+        for _ in range(repeat):
+            # like timeit, garbage collection would add noise depending on what ran before
+            gc.collect()
+            gc.disable()
+            try:
+                started = time.perf_counter()
+                result = function()
+                timings.append((time.perf_counter() - started) * 1000)
+            finally:
+                gc.enable()
+        return {'median_ms': round(statistics.median(timings), 3), 'best_ms': round(min(timings), 3)}, result
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        setup_test_environment()
+        # the dataset goes to a throwaway test database, never to the configured one
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.stderr.write('Seeding {} answers...'.format(options['answers']))
+            benchmark.seed(answers=options['answers'], rnd=random.Random(options['seed']))
+            queryset = Answer.objects.order_by('date', 'id')
+            serialize = {
+                'model_serializer': lambda: AnswerSerializer(queryset, many=True).data,
+                'values_serializer': lambda: AnswerValuesSerializer.serialize(AnswerValuesSerializer.values(queryset)),
+            }
+            results = {'serialize': {}}
+            for name, function in serialize.items():
+                results['serialize'][name], data = self.measure(function, repeat)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        render = {'stdlib': JSONRenderer(), 'fast': renderers.FastJSONRenderer()}
+        results['render'] = {}
+        for name, renderer in render.items():
+            results['render'][name], content = self.measure(lambda: renderer.render(data), repeat)
+        parse = {'stdlib': JSONParser(), 'fast': renderers.FastJSONParser()}
+        results['parse'] = {}
+        for name, parser in parse.items():
+            results['parse'][name], _ = self.measure(lambda: parser.parse(io.BytesIO(content)), repeat)
+        for step in ('serialize', 'render', 'parse'):
+            timings = [timing['median_ms'] for timing in results[step].values()]
+            results[step]['speedup'] = round(timings[0] / timings[1], 2)
+        report = {'environment': {'python': platform.python_version(),
+                                  'django': django.get_version(),
+                                  'database': connection.vendor,
+                                  'orjson': getattr(renderers.orjson, '__version__', None)},
+                  'rows': len(data),
+                  'payload_bytes': len(content),
+                  'results': results}
+        self.stdout.write(json.dumps(report, indent=2))
@@ -0,0 +1,56 @@
+from itertools import groupby
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from polls_api.models import Answer
+
+
+class Command(BaseCommand):
+    help = ('Fills Answer.choice_ids from the answer-choice table of existing answers. '
+            'Optionally drops the table rows afterwards or restores them from choice_ids')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000, help='answers per transaction')
+        parser.add_argument('--drop-rows', action='store_true',
+                            help='delete answer-choice rows after copying, '
+                                 'then set POLLS_ANSWER_CHOICE_ROWS = False')
+        parser.add_argument('--restore-rows', action='store_true',
+                            help='only recreate answer-choice rows from choice_ids, '
+                                 'before setting POLLS_ANSWER_CHOICE_ROWS = True again')
+
+    def handle(self, *args, **options):
+        if options['drop_rows'] and options['restore_rows']:
+            raise CommandError('--drop-rows and --restore-rows are exclusive')
+        through = Answer.choices.through
+        last_id, updated, rows = 0, 0, 0
+        while True:
+            with transaction.atomic():
+                answers = list(Answer.objects.filter(id__gt=last_id).order_by('id')
+                               .only('id', 'choice_ids')[:options['batch']])
+                if not answers:
+                    break
+                last_id = answers[-1].id
+                if options['restore_rows']:
+                    rows += len(through.objects.bulk_create(
+                        [through(answer_id=answer.id, choice_id=choice_id)
+                         for answer in answers for choice_id in answer.choice_ids],
+                        ignore_conflicts=True))
+                    continue
+                selected = through.objects.filter(answer_id__in=[answer.id for answer in answers]) \
+                    .order_by('answer_id', 'choice_id').values_list('answer_id', 'choice_id')
+                choice_ids = {answer_id: [row[1] for row in group]
+                              for answer_id, group in groupby(selected, key=lambda row: row[0])}
+                changed = []
+                for answer in answers:
+                    # answers without rows keep their choice_ids, they may be already compacted
+                    if answer.id in choice_ids and answer.choice_ids != choice_ids[answer.id]:
+                        answer.choice_ids = choice_ids[answer.id]
+                        changed.append(answer)
+                Answer.objects.bulk_update(changed, ['choice_ids'])
+                updated += len(changed)
+                if options['drop_rows']:
+                    rows += through.objects.filter(answer_id__in=list(choice_ids)).delete()[0]
+        if options['restore_rows']:
+            self.stdout.write(self.style.SUCCESS('Restored {} answer-choice rows'.format(rows)))
+            return
+        self.stdout.write(self.style.SUCCESS('Updated choice_ids of {} answers, deleted {} answer-choice rows'
+                                             .format(updated, rows)))
@@ -0,0 +1,30 @@
+import time
+from django.core.management.base import BaseCommand
+from polls_api import ingestion
+from polls_api.spool import get_spool
+
+
+class Command(BaseCommand):
+    help = 'Saves answers accepted into the spool (POLLS_ANSWER_INGESTION = "queue") in batched transactions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=500, help='submissions saved in one transaction')
+        parser.add_argument('--interval', type=float, default=1.0, help='seconds to wait when the queue is empty')
+        parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+        parser.add_argument('--keep', type=float, default=7 * 24 * 3600,
+                            help='seconds to keep finished submissions for status requests')
+
+    def handle(self, *args, **options):
+        spool = get_spool()
+        purged = time.monotonic()
+        while True:
+            saved, failed = ingestion.process_batch(spool, options['batch'])
+            if saved or failed:
+                self.stdout.write('Saved {} answers, {} failed'.format(saved, failed))
+                continue
+            if options['once']:
+                return
+            if time.monotonic() - purged > 3600:
+                spool.purge(options['keep'])
+                purged = time.monotonic()
+            time.sleep(options['interval'])
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand, CommandError
+from polls_api.renderers import FastJSONRenderer, YAMLRenderer
+from polls_api.serializers import PollDefinitionSerializer, polls_with_definitions
+
+
+class Command(BaseCommand):
+    help = 'Prints the poll with its questions and choices as JSON or YAML, for import_poll'
+
+    def add_arguments(self, parser):
+        parser.add_argument('poll', type=int, help='id of the poll')
+        parser.add_argument('--format', choices=['json', 'yaml'], default='json')
+
+    def handle(self, *args, **options):
+        poll = polls_with_definitions().filter(pk=options['poll']).first()
+        if poll is None:
+            raise CommandError('Poll {} does not exist'.format(options['poll']))
+        data = PollDefinitionSerializer(poll).data
+        if options['format'] == 'yaml':
+            content = YAMLRenderer().render(data)
+        else:
+            content = FastJSONRenderer().render(data, renderer_context={'indent': 2})
+        self.stdout.write(content.decode())
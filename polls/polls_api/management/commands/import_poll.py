@@ -0,0 +1,35 @@
+import io
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.exceptions import ParseError
+from polls_api.renderers import FastJSONParser, YAMLParser
+from polls_api.serializers import PollDefinitionSerializer
+
+
+class Command(BaseCommand):
+    help = 'Creates a poll with its questions and choices from a JSON or YAML definition, as given by export_poll'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="definition file, '-' for stdin")
+        parser.add_argument('--format', choices=['json', 'yaml'],
+                            help='format of the file, by default guessed from its extension')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('yaml' if path.endswith(('.yaml', '.yml')) else 'json')
+        if path == '-':
+            content = sys.stdin.buffer.read()
+        else:
+            with open(path, 'rb') as file:
+                content = file.read()
+        parser = YAMLParser() if fmt == 'yaml' else FastJSONParser()
+        try:
+            data = parser.parse(io.BytesIO(content))
+        except ParseError as exc:
+            raise CommandError(exc.detail)
+        serializer = PollDefinitionSerializer(data=data)
+        if not serializer.is_valid():
+            raise CommandError('Invalid definition: {}'.format(serializer.errors))
+        poll = serializer.save()
+        self.stdout.write(self.style.SUCCESS('Created poll {} with {} questions'.format(
+            poll.id, len(serializer.validated_data['questions']))))
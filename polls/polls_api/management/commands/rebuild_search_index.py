@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from polls_api import search
+
+
+class Command(BaseCommand):
+    help = ('Creates the full-text search index of answers, which is also done by migrate, '
+            'and indexes all answers again')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default='default', help='database alias')
+
+    def handle(self, *args, **options):
+        search.create_index(options['database'], rebuild=True)
+        self.stdout.write(self.style.SUCCESS('Search index is up to date'))
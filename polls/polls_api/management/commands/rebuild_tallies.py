@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from polls_api.models import Poll
+from polls_api import tallies
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds vote counters of polls from the answers table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll', type=int, action='append', dest='polls',
+                            help='id of the poll to rebuild, may be repeated (all polls by default)')
+        parser.add_argument('--verify', action='store_true',
+                            help='only compare stored counters to the answers, change nothing')
+
+    def handle(self, *args, **options):
+        polls = Poll.objects.all()
+        if options['polls']:
+            polls = polls.filter(pk__in=options['polls'])
+        if options['verify']:
+            mismatches = tallies.verify(polls)
+            for model, pk, stored, actual in mismatches:
+                self.stdout.write('{} {}: stored {}, actual {}'.format(model, pk, stored, actual))
+            if mismatches:
+                raise CommandError('{} counters are out of date'.format(len(mismatches)))
+            self.stdout.write(self.style.SUCCESS('All counters are up to date'))
+            return
+        rebuilt = tallies.rebuild(polls)
+        self.stdout.write(self.style.SUCCESS('Rebuilt {} counters'.format(rebuilt)))
@@ -0,0 +1,144 @@
+"""
+Per-request timing and SQL instrumentation
+"""
+import bisect
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+# upper bounds of the request duration histogram buckets, ms
+BUCKETS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf')]
+# the same SQL executed this many times in one request is reported as duplicate
+DUPLICATE_THRESHOLD = 2
+
+
+class RouteStats:
+    """
+    Thread-safe totals and duration histograms of requests per route
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def add(self, route, duration, queries, sql_duration, duplicates):
+        """
+        :param route: view name, e.g. AnswerViewSet.create
+        :param duration: wall time of the request, ms
+        :param queries: number of SQL queries
+        :param sql_duration: time spent in SQL, ms
+        :param duplicates: number of queries repeating another query of the request
+        """
+        bucket = bisect.bisect_left(BUCKETS, duration)
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = {'requests': 0, 'duration_ms': 0.0, 'max_duration_ms': 0.0,
+                                               'queries': 0, 'sql_duration_ms': 0.0,
+                                               'duplicate_queries': 0, 'requests_with_duplicates': 0,
+                                               'histogram': [0] * len(BUCKETS)}
+            stats['requests'] += 1
+            stats['duration_ms'] += duration
+            stats['max_duration_ms'] = max(stats['max_duration_ms'], duration)
+            stats['queries'] += queries
+            stats['sql_duration_ms'] += sql_duration
+            stats['duplicate_queries'] += duplicates
+            stats['requests_with_duplicates'] += bool(duplicates)
+            stats['histogram'][bucket] += 1
+
+    def snapshot(self):
+        """
+        :return: dict of route -> totals, means and histogram keyed by bucket bound
+        """
+        with self._lock:
+            routes = {route: dict(stats, histogram=list(stats['histogram'])) for route, stats in self._routes.items()}
+        for stats in routes.values():
+            requests = stats['requests']
+            for name in ('duration_ms', 'max_duration_ms', 'sql_duration_ms'):
+                stats[name] = round(stats[name], 3)
+            stats['mean_duration_ms'] = round(stats['duration_ms'] / requests, 3)
+            stats['mean_queries'] = round(stats['queries'] / requests, 2)
+            stats['mean_sql_duration_ms'] = round(stats['sql_duration_ms'] / requests, 3)
+            stats['histogram'] = {('le_{}'.format(bound) if bound != float('inf') else 'inf'): count
+                                  for bound, count in zip(BUCKETS, stats['histogram'])}
+        return routes
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+
+stats = RouteStats()
+
+
+class QueryRecorder:
+    """
+    Database execute wrapper counting queries, their time and repeats
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - started
+            self.count += 1
+            self.statements[sql] += 1
+
+    @property
+    def duplicates(self):
+        return sum(count - 1 for count in self.statements.values() if count >= DUPLICATE_THRESHOLD)
+
+
+def route_name(request):
+    """
+    Name of the resolved view: class and action for DRF views, function name otherwise
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name or match.func.__name__
+    actions = getattr(match.func, 'actions', None) or {}
+    return '{}.{}'.format(view_class.__name__, actions.get(request.method.lower(), request.method.lower()))
+
+
+class InstrumentationMiddleware:
+    """
+    Measures every request: wall time, SQL queries and their time, duplicate queries.
+    Adds Server-Timing header and collects totals per route into stats.
+    Enabled with POLLS_INSTRUMENTATION = True in settings
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'POLLS_INSTRUMENTATION', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            response = self.get_response(request)
+        duration = (time.perf_counter() - started) * 1000
+        sql_duration = recorder.duration * 1000
+        duplicates = recorder.duplicates
+        stats.add(route_name(request), duration, recorder.count, sql_duration, duplicates)
+        response['Server-Timing'] = ', '.join([
+            'app;dur={:.3f}'.format(duration),
+            'db;dur={:.3f};desc="{} queries"'.format(sql_duration, recorder.count),
+            'dup;desc="{} duplicate queries"'.format(duplicates),
+        ])
+        return response
@@ -1,5 +1,10 @@
-from django.db import models
+from collections import defaultdict
+from itertools import islice
+from django.conf import settings
+from django.core.cache import cache as django_cache
+from django.db import models, transaction
 from django.contrib.auth import get_user_model
+from .cache import LRUCache, question_schemas
 
 
 # models for polls_api
@@ -10,6 +15,12 @@ class Poll(models.Model):
     expiration_date = models.DateTimeField()
     description = models.CharField(max_length=4096, blank=True)
 
+    class Meta:
+        indexes = [
+            # active polls: expiration_date > now and start_date <= now
+            models.Index(fields=['expiration_date', 'start_date'], name='poll_active_idx'),
+        ]
+
     def __str__(self):
         return self.title
 
@@ -58,13 +69,227 @@ class Answer(models.Model):
                                 related_name='answers',
                                 on_delete=models.CASCADE)
     user_id_requested = models.IntegerField(default=0)
+    # sorted ids of the selected choices, read by lists, export and tallies instead of
+    # the choices table, which is written only with settings.POLLS_ANSWER_CHOICE_ROWS
+    choice_ids = models.JSONField(default=list, blank=True)
 
     class Meta:
         ordering = ['date']
+        indexes = [
+            # answers of a question or of a participant in date order
+            models.Index(fields=['question', 'date'], name='answer_question_date_idx'),
+            models.Index(fields=['user_id', 'date'], name='answer_user_date_idx'),
+            # repeated answers of a participant on a question
+            models.Index(fields=['user_id', 'question'], name='answer_user_question_idx'),
+            # admin list of answers in date order, filtered by date
+            models.Index(fields=['date'], name='answer_date_idx'),
+        ]
+
+
+def store_choice_rows():
+    """
+    Whether selected choices are also saved as rows of Answer.choices
+    """
+    return getattr(settings, 'POLLS_ANSWER_CHOICE_ROWS', True)
+
+
+# result of the last check in the cache of the process, checked again every minute until True
+CHOICE_IDS_CONVERTED_KEY = 'polls_api:choice_ids_converted'
+
+
+def choice_ids_converted():
+    """
+    Whether choice_ids of every answer are filled. Answers saved before the column
+    was added have only choice rows until compact_answers copies them, readers fall
+    back to the rows until then. Not converted is checked again after a minute
+    :return: bool
+    """
+    converted = django_cache.get(CHOICE_IDS_CONVERTED_KEY)
+    if converted is None:
+        converted = not Answer.choices.through.objects.filter(answer__choice_ids=[]).exists()
+        django_cache.set(CHOICE_IDS_CONVERTED_KEY, converted, None if converted else 60)
+    return converted
+
+
+def fill_choice_ids(rows, force=False):
+    """
+    Reads choices of answers with empty choice_ids from the choice rows, while not converted
+    :param rows: list of dicts of answers with id and choice_ids, changed in place
+    :param force: read the choice rows even if answers are converted
+    :return: rows
+    """
+    if not force and choice_ids_converted():
+        return rows
+    empty = [row['id'] for row in rows if not row['choice_ids']]
+    if empty:
+        selected = defaultdict(list)
+        for answer_id, choice_id in Answer.choices.through.objects.filter(answer_id__in=empty) \
+                .order_by('choice_id').values_list('answer_id', 'choice_id'):
+            selected[answer_id].append(choice_id)
+        for row in rows:
+            if not row['choice_ids'] and row['id'] in selected:
+                row['choice_ids'] = selected[row['id']]
+    return rows
+
+
+def iter_choice_ids(rows, chunk_size=1000):
+    """
+    fill_choice_ids() over an iterable of rows, chunk by chunk
+    :return: generator of rows
+    """
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield from fill_choice_ids(chunk)
+
+
+def _text_answer(answer):
+    """
+    Whether the answer is known to be on a TEXT question without a query, such answers have no choices
+    """
+    question = answer._state.fields_cache.get('question')
+    if question is not None:
+        return question.type == 'TEXT'
+    schema = question_schemas.get(answer.question_id)
+    return schema is not None and schema[1] == 'TEXT'
+
+
+def fill_answer_choice_ids(answers):
+    """
+    fill_choice_ids() for Answer instances, one query for all of them.
+    Filled answers are marked, answer_choice_ids() doesn't query them again
+    :param answers: iterable of Answer instances, changed in place
+    :return: list of the answers
+    """
+    answers = list(answers)
+    if choice_ids_converted():
+        return answers
+    empty = {answer.pk: answer for answer in answers
+             if not answer.choice_ids and answer.pk is not None
+             and not getattr(answer, 'choice_ids_filled', False) and not _text_answer(answer)}
+    if empty:
+        for answer_id, choice_id in Answer.choices.through.objects.filter(answer_id__in=list(empty)) \
+                .order_by('choice_id').values_list('answer_id', 'choice_id'):
+            empty[answer_id].choice_ids.append(choice_id)
+    for answer in answers:
+        answer.choice_ids_filled = True
+    return answers
+
+
+def answer_choice_ids(answer):
+    """
+    fill_choice_ids() for an Answer instance, one query per unconverted answer
+    not filled by fill_answer_choice_ids()
+    :return: list of choice ids
+    """
+    if answer.choice_ids or answer.pk is None or getattr(answer, 'choice_ids_filled', False) \
+            or _text_answer(answer) or choice_ids_converted():
+        return answer.choice_ids
+    return list(Answer.choices.through.objects.filter(answer_id=answer.pk)
+                .order_by('choice_id').values_list('choice_id', flat=True))
+
+
+# ids of participants known to exist, saves a query on every answer
+known_participants = LRUCache(maxsize=65536, timeout=300)
+
+
+class ParticipantManager(models.Manager):
+    def ensure(self, user_id):
+        """
+        Creates participant if it doesn't exist yet. Safe against concurrent
+        requests: a single INSERT ... ON CONFLICT DO NOTHING (INSERT OR IGNORE
+        on SQLite), skipped entirely for recently seen ids
+        :param user_id: id of the participant
+        :return: Participant instance usable as a foreign key value
+        """
+        if user_id not in known_participants:
+            self.bulk_create([self.model(user_id=user_id)], ignore_conflicts=True)
+            # not cached before commit, a rolled back row must be inserted again
+            transaction.on_commit(lambda: known_participants.set(user_id, True))
+        return self.model(user_id=user_id)
 
 
 class Participant(models.Model):
     user_id = models.IntegerField(primary_key=True, unique=True)
     first_name = models.CharField(max_length=64, null=True)
     last_name = models.CharField(max_length=64, null=True)
-    email = models.CharField(max_length=64, null=True)
\ No newline at end of file
+    email = models.CharField(max_length=64, null=True)
+
+    objects = ParticipantManager()
+
+
+# Vote counters, maintained in the same transaction as answers
+
+class PollTally(models.Model):
+    poll = models.OneToOneField(Poll,
+                                primary_key=True,
+                                related_name='tally',
+                                on_delete=models.CASCADE)
+    participants = models.IntegerField(default=0)
+
+
+class QuestionTally(models.Model):
+    question = models.OneToOneField(Question,
+                                    primary_key=True,
+                                    related_name='tally',
+                                    on_delete=models.CASCADE)
+    answers = models.IntegerField(default=0)
+    text_answers = models.IntegerField(default=0)
+    participants = models.IntegerField(default=0)
+
+
+class ChoiceTally(models.Model):
+    choice = models.OneToOneField(Choice,
+                                  primary_key=True,
+                                  related_name='tally',
+                                  on_delete=models.CASCADE)
+    votes = models.IntegerField(default=0)
+
+
+class AnswerSubmission(models.Model):
+    """
+    Answer saved from a queued submission, makes replays of the queue idempotent
+    """
+    id = models.UUIDField(primary_key=True)
+    answer = models.OneToOneField(Answer,
+                                  related_name='submission',
+                                  on_delete=models.CASCADE)
+
+
+# Answers of expired polls moved out of the answers table by archive_answers,
+# results of archived polls are read from the tallies, which are kept
+
+class ArchivedAnswer(models.Model):
+    id = models.BigIntegerField(primary_key=True)  # id the answer had in the answers table
+    question = models.ForeignKey(Question,
+                                 related_name='archived_answers',
+                                 on_delete=models.CASCADE)
+    text_input = models.CharField('text answer',
+                                  max_length=8096,
+                                  null=True)
+    choice_ids = models.JSONField(default=list, blank=True)
+    date = models.DateTimeField()
+    user_id = models.ForeignKey(Participant,
+                                related_name='archived_answers',
+                                on_delete=models.CASCADE)
+    user_id_requested = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['date']
+        indexes = [
+            models.Index(fields=['question', 'date'], name='archived_question_date_idx'),
+        ]
+
+
+class PollArchive(models.Model):
+    """
+    Marks a poll whose answers were moved to ArchivedAnswer
+    """
+    poll = models.OneToOneField(Poll,
+                                primary_key=True,
+                                related_name='archive',
+                                on_delete=models.CASCADE)
+    archived_at = models.DateTimeField(auto_now=True)
+    answers = models.IntegerField(default=0)
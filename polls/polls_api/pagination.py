@@ -0,0 +1,177 @@
+import base64
+import bisect
+import json
+from collections import OrderedDict
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Pages through rows by a unique combination of fields, e.g. (date, id).
+    A page starts right after (or before) the row of the cursor, so its cost
+    doesn't depend on how deep it is and rows inserted meanwhile are not skipped
+    """
+    ordering = ('id',)
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param],
+                                 strict=True, cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def key(self, row):
+        """
+        Values of the ordering fields of a model instance or a values() dict
+        """
+        if isinstance(row, dict):
+            return tuple(row[name] for name in self.ordering)
+        return tuple(getattr(row, name) for name in self.ordering)
+
+    def encode_cursor(self, direction, row):
+        # str() keeps microseconds of datetimes, DjangoJSONEncoder cuts them
+        values = list(self.key(row))
+        cursor = base64.urlsafe_b64encode(json.dumps([direction] + values, default=str).encode())
+        return replace_query_param(self.base_url, self.cursor_query_param, cursor.decode())
+
+    def decode_cursor(self, request, model):
+        """
+        :return: tuple (direction 'after' or 'before', list of ordering values) or None
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            direction, *values = json.loads(base64.urlsafe_b64decode(encoded.encode()).decode())
+            if direction not in ('after', 'before') or len(values) != len(self.ordering):
+                raise ValueError
+            return direction, [self.to_python(model, name, value) for name, value in zip(self.ordering, values)]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def to_python(self, model, name, value):
+        """
+        Ordering value of the cursor converted by the model field
+        """
+        return model._meta.get_field(name).to_python(value)
+
+    def beyond(self, values, lookup):
+        """
+        Rows ordered after (lookup 'gt') or before ('lt') the values
+        """
+        condition = Q()
+        for position in reversed(range(len(self.ordering))):
+            equal = Q(**{name: value for name, value in zip(self.ordering[:position], values)})
+            condition |= equal & Q(**{'{}__{}'.format(self.ordering[position], lookup): values[position]})
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        :param queryset: queryset or list of rows already sorted by ordering
+        """
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        if isinstance(queryset, list):
+            rows = self.paginate_list(queryset, self.decode_cursor(request, view.queryset.model))
+        else:
+            rows = self.paginate_rows(queryset, self.decode_cursor(request, queryset.model))
+        self.page = rows
+        return rows
+
+    def paginate_rows(self, queryset, cursor):
+        if cursor is not None and cursor[0] == 'before':
+            queryset = queryset.filter(self.beyond(cursor[1], 'lt'))
+            rows = list(queryset.order_by(*('-' + name for name in self.ordering))[:self.page_size + 1])
+            self.has_previous, self.has_next = len(rows) > self.page_size, True
+            return rows[:self.page_size][::-1]
+        if cursor is not None:
+            queryset = queryset.filter(self.beyond(cursor[1], 'gt'))
+        rows = list(queryset.order_by(*self.ordering)[:self.page_size + 1])
+        self.has_previous, self.has_next = cursor is not None, len(rows) > self.page_size
+        return rows[:self.page_size]
+
+    def paginate_list(self, rows, cursor):
+        keys = [self.key(row) for row in rows]
+        if cursor is not None and cursor[0] == 'before':
+            end = bisect.bisect_left(keys, tuple(cursor[1]))
+            start = max(0, end - self.page_size)
+            self.has_previous, self.has_next = start > 0, True
+            return rows[start:end]
+        start = bisect.bisect_right(keys, tuple(cursor[1])) if cursor is not None else 0
+        self.has_previous, self.has_next = cursor is not None, start + self.page_size < len(rows)
+        return rows[start:start + self.page_size]
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor('after', self.page[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor('before', self.page[0])
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_schema_fields(self, view):
+        import coreapi
+        import coreschema
+        return [
+            coreapi.Field(name=self.cursor_query_param, required=False, location='query',
+                          schema=coreschema.String(title='Cursor', description='The pagination cursor value.')),
+            coreapi.Field(name=self.page_size_query_param, required=False, location='query',
+                          schema=coreschema.Integer(title='Page size',
+                                                    description='Number of results to return per page.')),
+        ]
+
+
+class AnswerKeysetPagination(KeysetPagination):
+    ordering = ('date', 'id')
+
+
+class PollKeysetPagination(KeysetPagination):
+    ordering = ('start_date', 'id')
+
+
+class ParticipantKeysetPagination(KeysetPagination):
+    ordering = ('user_id',)
+
+
+class SearchKeysetPagination(KeysetPagination):
+    """
+    Search results from the best match, rank is an annotation and not a model field
+    """
+    ordering = ('rank', 'id')
+
+    def to_python(self, model, name, value):
+        if name == 'rank':
+            return float(value)
+        return super().to_python(model, name, value)
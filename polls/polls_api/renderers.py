@@ -0,0 +1,135 @@
+import csv
+import json
+import yaml
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json is used without it
+    orjson = None
+
+
+class Echo:
+    """
+    File-like object that returns written value instead of storing it
+    """
+
+    def write(self, value):
+        return value
+
+
+class CSVRenderer(BaseRenderer):
+    """
+    Renders rows as CSV. Exports stream rows through stream(),
+    render() is used for small payloads like error details
+    """
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        header = list(rows[0].keys()) if rows else []
+        return ''.join(self.stream(header, ([row.get(key) for key in header] for row in rows))).encode(self.charset)
+
+    def stream(self, header, rows):
+        """
+        Yields CSV lines one by one
+        :param header: list of column names
+        :param rows: iterable of lists of values, lists are joined with '; '
+        """
+        writer = csv.writer(Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(['; '.join(value) if isinstance(value, list) else value for value in row])
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders rows as newline delimited JSON objects
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in rows).encode(self.charset)
+
+    def stream(self, header, rows):
+        """
+        Yields one JSON object per row
+        :param header: list of keys
+        :param rows: iterable of lists of values
+        """
+        for row in rows:
+            yield json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder) + '\n'
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer rendering with orjson when it is installed. Indented output
+    (e.g. for the browsable API) and environments without orjson use stdlib json
+    """
+
+    def __init__(self):
+        self.encoder = self.encoder_class()
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or data is None or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        # datetimes go through the encoder, orjson writes UTC as +00:00 where DRF writes Z
+        return orjson.dumps(data, default=self.encoder.default,
+                            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME)
+
+
+class FastJSONParser(JSONParser):
+    """
+    JSONParser parsing with orjson when it is installed
+    """
+    renderer_class = FastJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        if orjson is None or encoding.lower().replace('-', '') != 'utf8':
+            return super().parse(stream, media_type, parser_context)
+        try:
+            return orjson.loads(stream.read())
+        except orjson.JSONDecodeError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class YAMLRenderer(BaseRenderer):
+    """
+    Renders data as YAML, keys in the order of the serializer
+    """
+    media_type = 'application/yaml'
+    format = 'yaml'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # serializer output is made of OrderedDicts and ReturnLists, which safe_dump doesn't know
+        data = json.loads(json.dumps(data, cls=DjangoJSONEncoder))
+        return yaml.safe_dump(data, allow_unicode=True, sort_keys=False).encode(self.charset)
+
+
+class YAMLParser(BaseParser):
+    media_type = 'application/yaml'
+    renderer_class = YAMLRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            return yaml.safe_load(stream.read().decode(encoding))
+        except (yaml.YAMLError, UnicodeDecodeError) as exc:
+            raise ParseError('YAML parse error - %s' % str(exc))
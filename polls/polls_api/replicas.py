@@ -0,0 +1,80 @@
+"""
+Routing of reads to database replicas. Requests with safe methods read from
+a replica, everything else and every write goes to the primary ('default')
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+
+PRIMARY = 'default'
+# set on the client after a write, its reads go to the primary while replicas may lag behind
+PIN_COOKIE = 'polls_primary'
+
+# outside of requests (management commands, workers) everything uses the primary
+_use_primary = contextvars.ContextVar('use_primary', default=True)
+
+
+def replica_aliases():
+    return getattr(settings, 'POLLS_DB_REPLICAS', [])
+
+
+@contextmanager
+def primary():
+    """
+    Reads inside of the block go to the primary. Used when filling caches:
+    right after invalidation a lagging replica would put old data there
+    """
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Database router sending reads of safe requests to a random replica
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = replica_aliases()
+        if _use_primary.get() or not replicas:
+            return PRIMARY
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same data as the primary
+        databases = {PRIMARY, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaRoutingMiddleware:
+    """
+    Marks requests which may read from replicas: safe methods from clients
+    which haven't written recently. Enabled when settings.POLLS_DB_REPLICAS is set
+    """
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        if not replica_aliases():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        write = request.method not in self.safe_methods
+        token = _use_primary.set(write or PIN_COOKIE in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            _use_primary.reset(token)
+        if write and response.status_code < 400:
+            response.set_cookie(PIN_COOKIE, '1', max_age=getattr(settings, 'POLLS_REPLICA_PIN_SECONDS', 5),
+                                httponly=True, samesite='Lax')
+        return response
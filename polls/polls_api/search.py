@@ -0,0 +1,93 @@
+"""
+Full-text search over text answers. SQLite uses an FTS5 table kept in sync
+with the answers table by triggers, PostgreSQL an expression GIN index.
+Other databases fall back to a substring scan
+"""
+from django.db import connections
+from django.db.models import F, FloatField, Value
+from django.db.models.expressions import RawSQL
+from .models import Answer
+
+FTS_TABLE = 'polls_api_answer_fts'
+# text search configuration of the PostgreSQL index, queries must use the same one
+SEARCH_CONFIG = 'simple'
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+    "text_input, content='{answers}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {answers} BEGIN "
+    "INSERT INTO {fts}(rowid, text_input) VALUES (new.id, new.text_input); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {answers} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, text_input) VALUES ('delete', old.id, old.text_input); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF text_input ON {answers} BEGIN "
+    "INSERT INTO {fts}({fts}, rowid, text_input) VALUES ('delete', old.id, old.text_input); "
+    "INSERT INTO {fts}(rowid, text_input) VALUES (new.id, new.text_input); END",
+]
+
+# the same expression as SearchVector('text_input') builds, otherwise the index isn't used
+POSTGRESQL_INDEX = [
+    "CREATE INDEX IF NOT EXISTS answer_text_search_idx ON {answers} "
+    "USING gin (to_tsvector('{config}'::regconfig, COALESCE((text_input)::text, '')))",
+]
+
+
+def create_index(using='default', rebuild=False):
+    """
+    Creates the search index of answers if it doesn't exist, existing answers are indexed
+    :param using: database alias
+    :param rebuild: index all answers again, only needed for SQLite
+    """
+    connection = connections[using]
+    answers = Answer._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            created = FTS_TABLE not in connection.introspection.table_names(cursor)
+            for statement in SQLITE_INDEX:
+                cursor.execute(statement.format(fts=FTS_TABLE, answers=answers))
+            if created or rebuild:
+                cursor.execute("INSERT INTO {0}({0}) VALUES ('rebuild')".format(FTS_TABLE))
+        elif connection.vendor == 'postgresql':
+            for statement in POSTGRESQL_INDEX:
+                cursor.execute(statement.format(answers=answers, config=SEARCH_CONFIG))
+
+
+def index_migrated(sender, using='default', **kwargs):
+    """
+    post_migrate receiver, the index isn't a model and isn't created by migrations
+    """
+    create_index(using)
+
+
+def fts_query(text):
+    """
+    Every word of the text is quoted, so FTS5 operators in user input are plain words
+    :return: FTS5 query matching rows which contain all words
+    """
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in text.split())
+
+
+def search_answers(queryset, text):
+    """
+    Answers of the queryset whose text contains all words of the text
+    :param queryset: queryset of answers
+    :param text: search query, words separated by spaces
+    :return: queryset annotated with rank, lower rank is a better match
+    """
+    connection = connections[queryset.db]
+    if connection.vendor == 'sqlite':
+        # joined rather than a subquery per row, FTS5 computes rank (bm25, lower is better) once
+        answers = connection.ops.quote_name(Answer._meta.db_table)
+        return queryset.extra(tables=[FTS_TABLE],
+                              where=['{}.rowid = {}.id'.format(FTS_TABLE, answers), FTS_TABLE + ' MATCH %s'],
+                              params=[fts_query(text)]) \
+            .annotate(rank=RawSQL(FTS_TABLE + '.rank', (), output_field=FloatField()))
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+        vector = SearchVector('text_input', config=SEARCH_CONFIG)
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type='plain')
+        return queryset.annotate(document=vector).filter(document=query) \
+            .annotate(rank=-SearchRank(F('document'), query))
+    queryset = queryset.all()
+    for word in text.split():
+        queryset = queryset.filter(text_input__icontains=word)
+    return queryset.annotate(rank=Value(0.0, output_field=FloatField()))
@@ -1,5 +1,14 @@
-from rest_framework import serializers
-from .models import Poll, Question, Answer, Choice, Participant
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
+from .models import Poll, Question, Answer, Choice, Participant, store_choice_rows, answer_choice_ids, fill_choice_ids, \
+    fill_answer_choice_ids
+from .cache import get_question_schema
+from . import tallies
 
 
 class ChoiceSerializer(serializers.ModelSerializer):
@@ -36,50 +45,195 @@ class PollDetailSerializer(serializers.ModelSerializer):
         fields = ['title', 'start_date', 'expiration_date', 'description', 'questions']
 
 
+class ChoiceItemSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Choice
+        fields = ['id', 'title', 'lock_other']
+
+
+class QuestionWithChoicesSerializer(serializers.ModelSerializer):
+    choices = ChoiceItemSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Question
+        fields = ['id', 'text', 'type', 'choices']
+
+
+class PollFullSerializer(serializers.ModelSerializer):
+    """
+    Poll with questions and their choices, expects them to be prefetched
+    """
+    questions = QuestionWithChoicesSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Poll
+        fields = ['title', 'start_date', 'expiration_date', 'description', 'questions']
+
+
+def check_answer(question_type, valid_choices, text_input, choices):
+    """
+    Checks the answer against the type and choices of its question
+    :param question_type: one of ANSWER_TYPES
+    :param valid_choices: set of choice ids of the question
+    :param text_input: submitted text
+    :param choices: submitted choice ids
+    :return: list of choice ids to save
+    """
+    if question_type == 'TEXT':
+        if not text_input:
+            raise serializers.ValidationError({'text_input': ['Provide text input to this question']})
+        return []
+    elif question_type == 'SINGLE':
+        if len(choices) != 1:
+            raise serializers.ValidationError({'choices': ['Select one']})
+    if len(choices) < 1:  # multi-choice variant
+        raise serializers.ValidationError({'choices': ['Select at least one']})
+    if not valid_choices.issuperset(choices):
+        raise serializers.ValidationError({'choices': ['Choice do not correspond question']})
+    return list(dict.fromkeys(choices))
+
+
+REPEAT_ANSWER_POLICIES = ('allow', 'reject', 'replace', 'keep-latest')
+
+
+def repeat_answer_policy():
+    """
+    :return: what to do with repeated answers of a participant, settings.POLLS_REPEAT_ANSWERS
+    """
+    policy = getattr(settings, 'POLLS_REPEAT_ANSWERS', 'allow')
+    if policy not in REPEAT_ANSWER_POLICIES:
+        raise ImproperlyConfigured('POLLS_REPEAT_ANSWERS must be one of {}'.format(', '.join(REPEAT_ANSWER_POLICIES)))
+    return policy
+
+
+def previous_answers(user_id, question_ids):
+    """
+    Answers the participant has already given, found by answer_user_question_idx
+    :param user_id: id of the participant
+    :param question_ids: ids of the questions
+    :return: queryset of answers
+    """
+    return Answer.objects.filter(user_id=user_id, question_id__in=question_ids)
+
+
+def already_answered():
+    return serializers.ValidationError({'question': ['Question is already answered']})
+
+
+class ChoiceIdsField(serializers.ListField):
+    """
+    Choice ids of the answer. Unlike PrimaryKeyRelatedField doesn't fetch
+    every submitted choice, ids are checked against the question at once.
+    Read from Answer.choice_ids, lists fill unconverted answers at once
+    """
+    child = serializers.IntegerField()
+
+    def get_attribute(self, instance):
+        return answer_choice_ids(instance)
+
+
+class AnswerListSerializer(serializers.ListSerializer):
+    """
+    Choices of unconverted answers are read for the whole list in one query
+    """
+
+    def to_representation(self, data):
+        iterable = data.all() if hasattr(data, 'all') else data
+        return super().to_representation(fill_answer_choice_ids(iterable))
+
+
 class AnswerSerializer(serializers.ModelSerializer):
     # choices = ChoiceSerializer(many=True, read_only=True)
+    choices = ChoiceIdsField(required=False)
 
     class Meta:
         model = Answer
         fields = ['question', 'text_input', 'choices', 'user_id_requested', 'date']
+        list_serializer_class = AnswerListSerializer
 
-    def validate_choices(self, value):
-        question_id = self.initial_data.get('question')
-        question = Question.objects.get(id=question_id)
-        if question.type == 'TEXT':
-            if not self.initial_data.get('text_input'):
-                raise serializers.ValidationError(detail='Provide text input to this question')
-            return None
-        elif question.type == 'SINGLE':
-            if len(value) != 1:
-                raise serializers.ValidationError(detail='Select one')
-        if len(value) < 1:  # multi-choice variant
-            raise serializers.ValidationError(detail='Select at least one')
-        for choice in value:
-            if choice.question.id != question.id:
-                raise serializers.ValidationError(detail='Choice do not correspond question')
-        return value
+    def validate(self, attrs):
+        # partial update checks the answer as it will be saved
+        question = attrs.get('question') or self.instance.question
+        text_input = attrs.get('text_input', getattr(self.instance, 'text_input', None))
+        choices = attrs.get('choices')
+        if choices is None:
+            choices = list(answer_choice_ids(self.instance)) if self.instance else []
+        question_type, valid_choices = get_question_schema(question)
+        attrs['choices'] = check_answer(question_type, valid_choices, text_input, choices)
+        if self.instance is None and repeat_answer_policy() == 'reject':
+            if previous_answers(attrs.get('user_id_requested', 0), [question.id]).exists():
+                raise already_answered()
+        return attrs
 
     def get_user_id(self, **validated_data):
         user_id_requested = validated_data.get('user_id_requested')
-        # check if user exists
-        participant_queryset = Participant.objects.filter(user_id=user_id_requested)
-        if participant_queryset.count() < 1:
-            participant = Participant.objects.create(user_id=user_id_requested)
-        else:
-            participant = participant_queryset.last()
-        validated_data.update(user_id=participant)
+        validated_data.update(user_id=Participant.objects.ensure(user_id_requested))
         return validated_data
 
     def create(self, validated_data):
         validated_data = self.get_user_id(**validated_data)
         choices = validated_data.pop('choices')
-        answer_object = Answer(**validated_data)
-        answer_object.save()
-        if choices:
-            answer_object.choices.set(choices)
+        question = validated_data['question']
+        policy = repeat_answer_policy()
+        with transaction.atomic():
+            tallies.add_answers(validated_data['user_id'].pk, question.poll_id,
+                                [(question.id, validated_data.get('text_input'), choices)])
+            # checked again after the write above, concurrent answers are serialized by then
+            previous = [] if policy == 'allow' else list(previous_answers(validated_data['user_id'].pk,
+                                                                          [question.id]).order_by('id'))
+            if previous and policy == 'reject':
+                raise already_answered()
+            if previous and policy == 'replace':
+                answer_object, previous = previous[0], previous[1:]
+                tallies.remove_answer(answer_object)
+                answer_object.text_input = validated_data.get('text_input')
+                answer_object.user_id_requested = validated_data.get('user_id_requested', 0)
+                answer_object.choice_ids = sorted(choices)
+                answer_object.save(update_fields=['text_input', 'user_id_requested', 'choice_ids'])
+                if store_choice_rows():
+                    answer_object.choices.set(choices)
+            else:
+                answer_object = Answer(choice_ids=sorted(choices), **validated_data)
+                answer_object.save()
+                if choices and store_choice_rows():
+                    answer_object.choices.set(choices)
+            if previous:
+                # deletion signals uncount the answers and count participants again
+                Answer.objects.filter(pk__in=[answer.pk for answer in previous]).delete()
         return answer_object
 
+    def update(self, instance, validated_data):
+        choices = validated_data['choices']
+        validated_data['choice_ids'] = sorted(choices)
+        if not store_choice_rows():
+            del validated_data['choices']
+        with transaction.atomic():
+            tallies.remove_answer(instance)
+            question_id = instance.question_id
+            instance = super().update(instance, validated_data)
+            tallies.add_answers(instance.user_id_id, instance.question.poll_id,
+                                [(instance.question_id, instance.text_input, choices)],
+                                participants=False)
+            tallies.recount_participants({question_id, instance.question_id})
+        return instance
+
+
+class ParticipantSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Participant
+        fields = ['user_id', 'first_name', 'last_name', 'email']
+
+
+class ParticipantListSerializer(serializers.ListSerializer):
+    """
+    Choices of unconverted answers of all participants are read in one query
+    """
+
+    def to_representation(self, data):
+        participants = list(data.all() if hasattr(data, 'all') else data)
+        fill_answer_choice_ids(answer for participant in participants for answer in participant.answers.all())
+        return super().to_representation(participants)
+
 
 class ParticipantSerializer(serializers.ModelSerializer):
     answers = AnswerSerializer(many=True, read_only=True, allow_null=True)
@@ -87,3 +241,279 @@ class ParticipantSerializer(serializers.ModelSerializer):
     class Meta:
         model = Participant
         fields = ['user_id', 'first_name', 'last_name', 'email', 'answers']
+        list_serializer_class = ParticipantListSerializer
+
+
+class PollAnswerSerializer(serializers.Serializer):
+    """
+    One answer inside of a poll submission
+    """
+    question = serializers.IntegerField()
+    text_input = serializers.CharField(max_length=8096, required=False, allow_null=True, allow_blank=True)
+    choices = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    date = serializers.DateTimeField(read_only=True)
+
+
+class PollSubmissionSerializer(serializers.Serializer):
+    """
+    All answers of a participant on the poll, validated and saved at once.
+    Poll is passed through the serializer context
+    """
+    user_id_requested = serializers.IntegerField(default=0)
+    answers = PollAnswerSerializer(many=True, allow_empty=False)
+
+    def validate_answers(self, value):
+        poll = self.context['poll']
+        # questions and their choices of the whole poll in two queries
+        questions = {question.id: question for question in poll.questions.prefetch_related('choices')}
+        errors = []
+        answered = set()
+        for answer in value:
+            question = questions.get(answer['question'])
+            errors.append({})
+            if question is None:
+                errors[-1] = {'question': ['Question do not correspond poll']}
+                continue
+            if question.id in answered:
+                errors[-1] = {'question': ['Question is answered twice']}
+                continue
+            answered.add(question.id)
+            valid_choices = {choice.id for choice in question.choices.all()}
+            try:
+                answer['choices'] = check_answer(question.type, valid_choices,
+                                                 answer.get('text_input'), answer.get('choices') or [])
+            except serializers.ValidationError as error:
+                errors[-1] = error.detail
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return value
+
+    def validate(self, attrs):
+        if repeat_answer_policy() == 'reject':
+            answered = set(previous_answers(attrs['user_id_requested'],
+                                            [answer['question'] for answer in attrs['answers']])
+                           .values_list('question_id', flat=True))
+            if answered:
+                raise serializers.ValidationError({'answers': [
+                    already_answered().detail if answer['question'] in answered else {}
+                    for answer in attrs['answers']]})
+        return attrs
+
+    def create(self, validated_data):
+        """
+        With 'replace' policy previous answers on the questions are overwritten keeping
+        their ids and dates, as by AnswerSerializer. With 'keep-latest' they are deleted
+        and the new ones inserted
+        """
+        user_id_requested = validated_data['user_id_requested']
+        answers_data = validated_data['answers']
+        question_ids = [answer['question'] for answer in answers_data]
+        policy = repeat_answer_policy()
+        with transaction.atomic():
+            participant = Participant.objects.ensure(user_id_requested)
+            tallies.add_answers(participant.pk, self.context['poll'].id,
+                                [(answer['question'], answer.get('text_input'), answer['choices'])
+                                 for answer in answers_data])
+            previous = [] if policy == 'allow' else list(previous_answers(participant.pk, question_ids)
+                                                         .order_by('id'))
+            if previous and policy == 'reject':
+                raise serializers.ValidationError({'answers': ['Questions are already answered']})
+            # the first previous answer on every question is overwritten, the others are deleted
+            replaced = {}
+            if policy == 'replace':
+                for answer in previous:
+                    replaced.setdefault(answer.question_id, answer)
+                previous = [answer for answer in previous if replaced[answer.question_id] is not answer]
+                tallies.remove_answers([(answer.question_id, answer.text_input, answer_choice_ids(answer))
+                                        for answer in replaced.values()])
+            answers, created = [], []
+            for answer_data in answers_data:
+                answer = replaced.get(answer_data['question'])
+                if answer is None:
+                    answer = Answer(question_id=answer_data['question'], user_id=participant)
+                    created.append(answer)
+                answer.text_input = answer_data.get('text_input')
+                answer.user_id_requested = user_id_requested
+                answer.choice_ids = sorted(answer_data['choices'])
+                answers.append(answer)
+            Answer.objects.bulk_create(created)
+            Answer.objects.bulk_update(list(replaced.values()), ['text_input', 'user_id_requested', 'choice_ids'])
+            if store_choice_rows():
+                if created and not connection.features.can_return_rows_from_bulk_insert:
+                    # the write lock is held until commit, so the latest rows
+                    # of the participant are the ones just inserted
+                    ids = Answer.objects.filter(user_id=participant).order_by('-id').values_list('id', flat=True)
+                    for answer, answer_id in zip(created, reversed(list(ids[:len(created)]))):
+                        answer.id = answer_id
+                through = Answer.choices.through
+                through.objects.filter(answer_id__in=[answer.id for answer in replaced.values()]).delete()
+                through.objects.bulk_create([
+                    through(answer_id=answer.id, choice_id=choice_id)
+                    for answer, answer_data in zip(answers, answers_data)
+                    for choice_id in answer_data['choices']])
+            if previous:
+                # deletion signals uncount the answers and count participants again
+                Answer.objects.filter(pk__in=[answer.pk for answer in previous]).delete()
+        return {'user_id_requested': user_id_requested,
+                'answers': [{'question': answer.question_id,
+                             'text_input': answer.text_input,
+                             'choices': answer_data['choices'],
+                             'date': answer.date}
+                            for answer, answer_data in zip(answers, answers_data)]}
+
+
+class ChoiceDefinitionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Choice
+        fields = ['title', 'lock_other']
+
+
+class QuestionDefinitionSerializer(serializers.ModelSerializer):
+    choices = ChoiceDefinitionSerializer(many=True, required=False)
+
+    class Meta:
+        model = Question
+        fields = ['text', 'type', 'choices']
+
+    def validate(self, attrs):
+        choices = attrs.setdefault('choices', [])
+        if attrs['type'] == 'TEXT' and choices:
+            raise serializers.ValidationError({'choices': ['Text questions have no choices']})
+        if attrs['type'] != 'TEXT' and not choices:
+            raise serializers.ValidationError({'choices': ['At least one choice is required']})
+        return attrs
+
+
+class PollDefinitionSerializer(serializers.ModelSerializer):
+    """
+    Whole poll with questions and choices, without ids, for import and export.
+    Imported poll is inserted with one query per table
+    """
+    questions = QuestionDefinitionSerializer(many=True)
+
+    class Meta:
+        model = Poll
+        fields = ['title', 'start_date', 'expiration_date', 'description', 'questions']
+
+    def create(self, validated_data):
+        questions_data = validated_data.pop('questions')
+        with transaction.atomic():
+            # saved one by one, signals of the poll reset the cached lists of polls
+            poll = Poll.objects.create(**validated_data)
+            questions = Question.objects.bulk_create([
+                Question(poll=poll, text=question['text'], type=question['type'])
+                for question in questions_data])
+            if not connection.features.can_return_rows_from_bulk_insert:
+                # nobody else has questions of the new poll yet
+                ids = Question.objects.filter(poll=poll).order_by('id').values_list('id', flat=True)
+                for question, question_id in zip(questions, ids):
+                    question.id = question_id
+            Choice.objects.bulk_create([
+                Choice(question_id=question.id, **choice)
+                for question, question_data in zip(questions, questions_data)
+                for choice in question_data['choices']])
+        return poll
+
+
+def polls_with_definitions():
+    """
+    :return: queryset of polls for PollDefinitionSerializer, questions and choices prefetched in id order
+    """
+    return Poll.objects.prefetch_related(
+        Prefetch('questions', queryset=Question.objects.order_by('id').prefetch_related(
+            Prefetch('choices', queryset=Choice.objects.order_by('id')))))
+
+
+def datetime_formatter():
+    """
+    Formats datetimes like DateTimeField of DRF does with ISO 8601 format,
+    current timezone is looked up once instead of for every value
+    :return: function of datetime returning string
+    """
+    if api_settings.DATETIME_FORMAT != ISO_8601:
+        return serializers.DateTimeField().to_representation
+    zone = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def to_representation(value):
+        if zone is not None and value.utcoffset() is not None:
+            value = value.astimezone(zone)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return to_representation
+
+
+class ValuesSerializer:
+    """
+    Read-only serialization of .values() rows into the same dicts as the model
+    serializer gives, without building model instances and serializer fields per row
+    """
+    fields = []
+    # selected with values() but not in the output
+    extra_fields = []
+    datetime_fields = []
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values(*cls.fields, *cls.extra_fields)
+
+    @classmethod
+    def serialize(cls, rows):
+        """
+        :param rows: iterable of dicts from values()
+        :return: list of dicts
+        """
+        to_datetime = datetime_formatter()
+        dates = [name for name in cls.fields if name in cls.datetime_fields]
+        result = []
+        for row in rows:
+            item = {name: row[name] for name in cls.fields}
+            for name in dates:
+                if item[name] is not None:
+                    item[name] = to_datetime(item[name])
+            result.append(item)
+        return result
+
+
+class PollValuesSerializer(ValuesSerializer):
+    """
+    Same output as PollSerializer
+    """
+    fields = ['id', 'title', 'start_date', 'expiration_date', 'description']
+    datetime_fields = ['start_date', 'expiration_date']
+
+
+class QuestionValuesSerializer(ValuesSerializer):
+    """
+    Same output as QuestionSerializer
+    """
+    fields = ['id', 'text', 'type', 'poll']
+
+
+class AnswerValuesSerializer(ValuesSerializer):
+    """
+    Same output as AnswerSerializer, choices come from Answer.choice_ids
+    """
+    fields = ['question', 'text_input', 'choices', 'user_id_requested', 'date']
+    extra_fields = ['id']
+    datetime_fields = ['date']
+
+    @classmethod
+    def values(cls, queryset):
+        return queryset.values('question', 'text_input', 'choice_ids', 'user_id_requested', 'date', *cls.extra_fields)
+
+    @classmethod
+    def serialize(cls, rows):
+        rows = fill_choice_ids(list(rows))
+        for row in rows:
+            row['choices'] = row.pop('choice_ids')
+        return super().serialize(rows)
+
+
+class AnswerSearchValuesSerializer(ValuesSerializer):
+    """
+    Answers found by text, rows are annotated with rank by search.search_answers
+    """
+    fields = ['id', 'question', 'text_input', 'user_id_requested', 'date', 'rank']
+    datetime_fields = ['date']
@@ -0,0 +1,148 @@
+"""
+Keeps caches and vote counters consistent with the data
+"""
+import contextvars
+from django.db import connections
+from django.db.models.signals import pre_save, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from .models import Poll, Question, Choice, Answer, Participant, known_participants, answer_choice_ids
+from . import tallies
+from .cache import question_schemas, bump_poll_version
+from .active import reset_active_polls
+from .archive import archiving
+
+# ids of questions and polls whose deletion is in progress, set before the
+# cascade deletes their choices and answers, which then need no bookkeeping
+_deleting = contextvars.ContextVar('deleting', default=frozenset())
+
+
+def deleting(model, pk):
+    """
+    :return: whether the object is being deleted together with its related rows
+    """
+    return (model, pk) in _deleting.get()
+
+
+@receiver(pre_delete, sender=Poll)
+@receiver(pre_delete, sender=Question)
+def mark_deleting(sender, instance, **kwargs):
+    _deleting.set(_deleting.get() | {(sender, instance.pk)})
+
+
+@receiver(post_delete, sender=Poll)
+@receiver(post_delete, sender=Question)
+def unmark_deleting(sender, instance, **kwargs):
+    _deleting.set(_deleting.get() - {(sender, instance.pk)})
+
+
+def _poll_of_question(question_id):
+    return Question.objects.filter(pk=question_id).values_list('poll_id', flat=True).first()
+
+
+@receiver([post_save, post_delete], sender=Poll)
+def reset_poll(sender, instance, **kwargs):
+    bump_poll_version(instance.id)
+    reset_active_polls()
+
+
+@receiver(pre_save, sender=Question)
+def reset_moved_question(sender, instance, **kwargs):
+    if instance.pk:
+        poll_id = _poll_of_question(instance.pk)
+        if poll_id is not None and poll_id != instance.poll_id:
+            bump_poll_version(poll_id)
+
+
+@receiver([post_save, post_delete], sender=Question)
+def reset_question(sender, instance, **kwargs):
+    question_schemas.pop(instance.id)
+    bump_poll_version(instance.poll_id)
+
+
+@receiver(pre_save, sender=Choice)
+def reset_moved_choice(sender, instance, **kwargs):
+    if instance.pk:
+        question_id = Choice.objects.filter(pk=instance.pk).values_list('question_id', flat=True).first()
+        if question_id is not None and question_id != instance.question_id:
+            question_schemas.pop(question_id)
+            bump_poll_version(_poll_of_question(question_id))
+
+
+@receiver([post_save, post_delete], sender=Choice)
+def reset_choice(sender, instance, **kwargs):
+    question_schemas.pop(instance.question_id)
+    poll_id = _poll_of_question(instance.question_id)
+    if poll_id is not None:
+        bump_poll_version(poll_id)
+
+
+@receiver(post_delete, sender=Choice)
+def forget_choice(sender, instance, **kwargs):
+    # choice rows of answers are deleted by cascade, choice_ids are updated here
+    if deleting(Question, instance.question_id):
+        return
+    answers = Answer.objects.filter(question_id=instance.question_id)
+    connection = connections[answers.db]
+    if connection.features.supports_json_field_contains:
+        answers = answers.filter(choice_ids__contains=[instance.id])
+    elif connection.vendor == 'sqlite':
+        answers = answers.extra(where=['EXISTS (SELECT 1 FROM json_each({}.choice_ids) WHERE value = %s)'.format(
+            connection.ops.quote_name(Answer._meta.db_table))], params=[instance.id])
+    changed = []
+    for answer in answers.only('id', 'choice_ids').iterator():
+        if instance.id in answer.choice_ids:
+            answer.choice_ids = [choice_id for choice_id in answer.choice_ids if choice_id != instance.id]
+            changed.append(answer)
+    Answer.objects.bulk_update(changed, ['choice_ids'], batch_size=1000)
+
+
+@receiver(post_delete, sender=Participant)
+def forget_participant(sender, instance, **kwargs):
+    known_participants.pop(instance.user_id)
+
+
+# answers collected for deletion: a delete sends all pre_delete signals
+# before it removes any row and the first post_delete signal after that
+_deleted_answers = contextvars.ContextVar('deleted_answers', default=None)
+
+
+@receiver(pre_delete, sender=Answer)
+def collect_deleted_answer(sender, instance, **kwargs):
+    # archived answers stay counted
+    if archiving():
+        return
+    answers = _deleted_answers.get()
+    if answers is None:
+        answers = []
+        _deleted_answers.set(answers)
+    answers.append((instance.id, instance.question_id, instance.text_input, answer_choice_ids(instance)))
+
+
+@receiver(post_delete, sender=Answer)
+def uncount_deleted_answers(sender, instance, **kwargs):
+    """
+    Uncounts all answers of the delete at once and counts participants
+    of their questions again, instead of per answer
+    """
+    answers = _deleted_answers.get()
+    if not answers:
+        return
+    _deleted_answers.set(None)
+    # answers of a delete which failed before removing rows are still there,
+    # answers of deleted questions go with their counters
+    ids = [answer[0] for answer in answers]
+    remaining = set()
+    for start in range(0, len(ids), 1000):
+        remaining.update(Answer.objects.filter(pk__in=ids[start:start + 1000]).order_by()
+                         .values_list('pk', flat=True))
+    answers = [answer[1:] for answer in answers
+               if answer[0] not in remaining and not deleting(Question, answer[1])]
+    tallies.remove_answers(answers)
+    tallies.recount_participants({question_id for question_id, _, _ in answers})
+
+
+@receiver(post_delete, sender=Question)
+def recount_poll_participants(sender, instance, **kwargs):
+    # participants who answered only the deleted question are not participants of the poll anymore
+    if not archiving() and not deleting(Poll, instance.poll_id):
+        tallies.recount_participants((), [instance.poll_id])
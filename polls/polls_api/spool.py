@@ -0,0 +1,132 @@
+"""
+Durable local queue of accepted answer submissions, drained by `manage.py drain_answers`
+"""
+import json
+import sqlite3
+import threading
+import time
+import uuid
+from django.conf import settings
+
+QUEUED = 'queued'
+PROCESSING = 'processing'
+DONE = 'done'
+FAILED = 'failed'
+
+# a submission claimed by a worker which died is given to another one after this time, s
+CLAIM_TIMEOUT = 300
+
+
+class AnswerSpool:
+    """
+    Submissions stored in their own SQLite file, so accepting an answer
+    doesn't wait for the write lock of the main database
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    @property
+    def connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS submission ('
+                               'id TEXT PRIMARY KEY, payload TEXT NOT NULL, status TEXT NOT NULL, '
+                               'error TEXT, answer_id INTEGER, created REAL NOT NULL, claimed REAL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS submission_status ON submission (status, created)')
+            self._local.connection = connection
+        return connection
+
+    def put(self, payload):
+        """
+        Stores the submission, it is on disk when the method returns
+        :param payload: JSON serializable data of the answer
+        :return: id of the submission
+        """
+        submission_id = str(uuid.uuid4())
+        self.connection.execute('INSERT INTO submission (id, payload, status, created) VALUES (?, ?, ?, ?)',
+                                (submission_id, json.dumps(payload), QUEUED, time.time()))
+        return submission_id
+
+    def claim(self, limit):
+        """
+        Marks the oldest queued submissions as being processed
+        :param limit: maximum number of submissions
+        :return: list of tuples (id, payload)
+        """
+        connection = self.connection
+        now = time.time()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            rows = connection.execute(
+                'SELECT id, payload FROM submission WHERE status = ? OR (status = ? AND claimed < ?) '
+                'ORDER BY created LIMIT ?', (QUEUED, PROCESSING, now - CLAIM_TIMEOUT, limit)).fetchall()
+            connection.executemany('UPDATE submission SET status = ?, claimed = ? WHERE id = ?',
+                                   [(PROCESSING, now, submission_id) for submission_id, _ in rows])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        return [(submission_id, json.loads(payload)) for submission_id, payload in rows]
+
+    def finish(self, done, failed):
+        """
+        :param done: dict of submission id -> id of the saved answer
+        :param failed: dict of submission id -> error data
+        """
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('UPDATE submission SET status = ?, answer_id = ? WHERE id = ?',
+                                   [(DONE, answer_id, submission_id) for submission_id, answer_id in done.items()])
+            connection.executemany('UPDATE submission SET status = ?, error = ? WHERE id = ?',
+                                   [(FAILED, json.dumps(error), submission_id)
+                                    for submission_id, error in failed.items()])
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def status(self, submission_id):
+        """
+        :return: dict with status, answer id and error of the submission or None
+        """
+        row = self.connection.execute('SELECT status, answer_id, error FROM submission WHERE id = ?',
+                                      (submission_id,)).fetchone()
+        if row is None:
+            return None
+        status, answer_id, error = row
+        return {'submission': submission_id, 'status': status, 'answer': answer_id,
+                'error': json.loads(error) if error else None}
+
+    def purge(self, older_than):
+        """
+        Deletes finished submissions
+        :param older_than: age in seconds
+        :return: number of deleted submissions
+        """
+        cursor = self.connection.execute('DELETE FROM submission WHERE status IN (?, ?) AND created < ?',
+                                         (DONE, FAILED, time.time() - older_than))
+        return cursor.rowcount
+
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def get_spool():
+    """
+    :return: AnswerSpool at settings.POLLS_ANSWER_SPOOL
+    """
+    global _spool
+    with _spool_lock:
+        if _spool is None or _spool.path != str(settings.POLLS_ANSWER_SPOOL):
+            _spool = AnswerSpool(settings.POLLS_ANSWER_SPOOL)
+        return _spool
+
+
+def queue_enabled():
+    return getattr(settings, 'POLLS_ANSWER_INGESTION', 'sync') == 'queue'
@@ -0,0 +1,240 @@
+"""
+Incrementally maintained vote counters and the results built from them
+"""
+from collections import Counter
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Q, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from .models import Poll, Question, Choice, Answer, Participant, PollTally, QuestionTally, ChoiceTally, \
+    answer_choice_ids, iter_choice_ids
+
+
+def _create_missing(model, ids):
+    """
+    Inserts zero tally rows which don't exist yet
+    :param model: tally model
+    :param ids: primary keys of the rows
+    """
+    ids = list(ids)
+    if ids:
+        model.objects.bulk_create([model(pk=pk) for pk in ids], ignore_conflicts=True)
+
+
+def _bump(model, ids, delta=1, **fields):
+    """
+    Adds delta to counter fields of the tally rows
+    :param model: tally model
+    :param ids: primary keys of the rows
+    :param delta: value added to every field
+    :param fields: names of the counters to change, with True
+    """
+    ids = list(ids)
+    if ids:
+        model.objects.filter(pk__in=ids).update(**{name: F(name) + delta for name in fields})
+
+
+def add_answers(participant_id, poll_id, answers, participants=True):
+    """
+    Counts new answers of the participant, must be called before they are saved
+    and in the same transaction. Every question may be answered once in the batch.
+    The participant row stays locked until commit
+    :param participant_id: user id of the participant
+    :param poll_id: id of the poll the questions belong to
+    :param answers: list of tuples (question id, text input, list of choice ids)
+    :param participants: whether to count the participant of the poll and questions
+    """
+    question_ids = [question_id for question_id, _, _ in answers]
+    choice_ids = [choice_id for _, _, answer_choices in answers for choice_id in answer_choices]
+    # writing first takes the SQLite write lock before anything is read,
+    # a transaction which has read already fails instead of waiting for it
+    _create_missing(PollTally, [poll_id])
+    _create_missing(QuestionTally, question_ids)
+    _create_missing(ChoiceTally, choice_ids)
+    if participants:
+        # concurrent answers of the participant wait for this one to commit and
+        # then see it, under READ COMMITTED both would count the participant otherwise
+        list(Participant.objects.select_for_update().filter(pk=participant_id).values_list('pk'))
+        answered = Answer.objects.filter(user_id=participant_id, question_id__in=question_ids)
+        answered = set(answered.order_by().values_list('question_id', flat=True).distinct())
+        if not Answer.objects.filter(user_id=participant_id, question__poll=poll_id).exists():
+            _bump(PollTally, [poll_id], participants=True)
+        _bump(QuestionTally, set(question_ids) - answered, participants=True)
+    _bump(QuestionTally, question_ids, answers=True)
+    _bump(QuestionTally, [question_id for question_id, text_input, _ in answers if text_input], text_answers=True)
+    _bump(ChoiceTally, choice_ids, votes=True)
+
+
+def _subtract(model, counter, name):
+    """
+    Subtracts the counted numbers from a counter field, one UPDATE per distinct number
+    :param counter: Counter of tally primary keys
+    """
+    by_delta = {}
+    for pk, delta in counter.items():
+        by_delta.setdefault(delta, []).append(pk)
+    for delta, ids in by_delta.items():
+        _bump(model, ids, -delta, **{name: True})
+
+
+def remove_answers(answers):
+    """
+    Uncounts answers and their choices, must be called in the transaction which deletes them.
+    Participants are counted again by recount_participants() after deletion
+    :param answers: list of tuples (question id, text input, list of choice ids)
+    """
+    with transaction.atomic():
+        _subtract(QuestionTally, Counter(question_id for question_id, _, _ in answers), 'answers')
+        _subtract(QuestionTally, Counter(question_id for question_id, text_input, _ in answers if text_input),
+                  'text_answers')
+        _subtract(ChoiceTally, Counter(choice_id for _, _, choice_ids in answers for choice_id in choice_ids),
+                  'votes')
+
+
+def remove_answer(answer):
+    """
+    remove_answers() for one Answer instance, before it is deleted or changed
+    """
+    remove_answers([(answer.question_id, answer.text_input, answer_choice_ids(answer))])
+
+
+def recount_participants(question_ids, poll_ids=()):
+    """
+    Counts distinct participants of the questions and their polls again,
+    used when answers are changed or deleted. One UPDATE per tally table
+    :param question_ids: ids of the questions
+    :param poll_ids: ids of other polls to count
+    """
+    questions = dict(Question.objects.filter(pk__in=list(question_ids)).values_list('id', 'poll_id'))
+    polls = set(questions.values()) | set(Poll.objects.filter(pk__in=list(poll_ids)).values_list('id', flat=True))
+    participants = Count('user_id', distinct=True)
+    with transaction.atomic():
+        if questions:
+            _create_missing(QuestionTally, questions)
+            QuestionTally.objects.filter(pk__in=list(questions)).update(participants=Coalesce(Subquery(
+                Answer.objects.filter(question=OuterRef('pk')).order_by().values('question')
+                .annotate(participants=participants).values('participants')), 0))
+        if polls:
+            _create_missing(PollTally, polls)
+            PollTally.objects.filter(pk__in=polls).update(participants=Coalesce(Subquery(
+                Answer.objects.filter(question__poll=OuterRef('pk')).order_by().values('question__poll')
+                .annotate(participants=participants).values('participants')), 0))
+
+
+def count(polls=None):
+    """
+    Aggregates counters over the answers table
+    :param polls: queryset of polls to count, all polls by default, archived polls are skipped
+    :return: tuple of lists of unsaved PollTally, QuestionTally and ChoiceTally
+    """
+    polls = Poll.objects.all() if polls is None else polls
+    # answers of archived polls are gone, their counters are final
+    polls = polls.filter(archive__isnull=True)
+    questions = Question.objects.filter(poll__in=polls)
+    choices = Choice.objects.filter(question__in=questions)
+    poll_tallies = polls.annotate(
+        participant_count=Count('questions__answers__user_id', distinct=True))
+    question_tallies = questions.annotate(
+        answer_count=Count('answers'),
+        text_answer_count=Count('answers', filter=Q(answers__text_input__isnull=False) & ~Q(answers__text_input='')),
+        participant_count=Count('answers__user_id', distinct=True))
+    # votes are counted over choice_ids, choice rows of answers may be not stored
+    votes = Counter()
+    for row in iter_choice_ids(Answer.objects.filter(question__in=questions).values('id', 'choice_ids').iterator()):
+        votes.update(row['choice_ids'])
+    return ([PollTally(poll_id=poll.id, participants=poll.participant_count)
+             for poll in poll_tallies],
+            [QuestionTally(question_id=question.id,
+                           answers=question.answer_count,
+                           text_answers=question.text_answer_count,
+                           participants=question.participant_count)
+             for question in question_tallies],
+            [ChoiceTally(choice_id=choice_id, votes=votes[choice_id])
+             for choice_id in choices.values_list('id', flat=True)])
+
+
+def rebuild(polls=None):
+    """
+    Replaces counters of the polls with freshly aggregated ones
+    :param polls: queryset of polls, all polls by default
+    :return: number of rebuilt tally rows
+    """
+    polls = Poll.objects.all() if polls is None else polls
+    with transaction.atomic():
+        # locks the counters before they are counted, answers saved meanwhile wait for
+        # the commit. On SQLite the write takes the database lock first, as in add_answers
+        PollTally.objects.filter(poll__in=polls).update(participants=F('participants'))
+        QuestionTally.objects.filter(question__poll__in=polls).update(answers=F('answers'))
+        ChoiceTally.objects.filter(choice__question__poll__in=polls).update(votes=F('votes'))
+        tallies = count(polls)
+        for model, rows in zip((PollTally, QuestionTally, ChoiceTally), tallies):
+            model.objects.filter(pk__in=[row.pk for row in rows]).delete()
+            model.objects.bulk_create(rows, batch_size=1000)
+    return sum(len(rows) for rows in tallies)
+
+
+def verify(polls=None):
+    """
+    Compares stored counters to freshly aggregated ones
+    :param polls: queryset of polls, all polls by default
+    :return: list of tuples (tally model name, pk, stored values, actual values)
+    """
+    mismatches = []
+    fields = {PollTally: ['participants'],
+              QuestionTally: ['answers', 'text_answers', 'participants'],
+              ChoiceTally: ['votes']}
+    for model, rows in zip((PollTally, QuestionTally, ChoiceTally), count(polls)):
+        stored = model.objects.in_bulk([row.pk for row in rows])
+        for row in rows:
+            actual = [getattr(row, name) for name in fields[model]]
+            # a missing row counts as zero, as in the results
+            saved = [getattr(stored[row.pk], name) if row.pk in stored else 0 for name in fields[model]]
+            if saved != actual:
+                mismatches.append((model.__name__, row.pk, saved, actual))
+    return mismatches
+
+
+def _value(instance, name):
+    """
+    Counter of the tally related to instance, zero if there is no tally row yet
+    """
+    try:
+        return getattr(instance.tally, name)
+    except instance.__class__.tally.RelatedObjectDoesNotExist:
+        return 0
+
+
+def question_results(question):
+    """
+    :param question: Question instance with tally and choices__tally fetched
+    :return: dict with counters of the question and its choices
+    """
+    return {'question': question.id,
+            'text': question.text,
+            'type': question.type,
+            'answers': _value(question, 'answers'),
+            'text_answers': _value(question, 'text_answers'),
+            'participants': _value(question, 'participants'),
+            'choices': [{'choice': choice.id,
+                         'title': choice.title,
+                         'votes': _value(choice, 'votes')}
+                        for choice in question.choices.all()]}
+
+
+def questions_with_tallies():
+    """
+    :return: queryset of questions with tallies of question and choices fetched
+    """
+    return Question.objects.select_related('tally').prefetch_related(
+        Prefetch('choices', queryset=Choice.objects.select_related('tally').order_by('id')))
+
+
+def poll_results(poll):
+    """
+    :param poll: Poll instance with tally fetched
+    :return: dict with counters of the poll and all of its questions
+    """
+    return {'poll': poll.id,
+            'title': poll.title,
+            'participants': _value(poll, 'participants'),
+            'questions': [question_results(question)
+                          for question in questions_with_tallies().filter(poll=poll).order_by('id')]}
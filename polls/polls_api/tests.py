@@ -1,3 +1,1280 @@
-from django.test import TestCase
+import asyncio
+import base64
+import datetime
+import json
+import os
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
+from uuid import UUID
+from asgiref.sync import async_to_sync, sync_to_async
+from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, Client, RequestFactory, override_settings
+from django.utils import timezone
+from django.utils.http import urlencode
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.settings import api_settings
+from .models import Poll, Question, Choice, Answer, ArchivedAnswer, Participant, known_participants, \
+    ChoiceTally, PollTally
+from .replicas import ReplicaRouter, ReplicaRoutingMiddleware, PIN_COOKIE
+from .live import LiveResultsApp, Subscriber, diff_counts, publishers
+from .archive import archive_cutoff, archive_poll, polls_to_archive
+from .admin import EstimatedCountPaginator
+from .cache import question_schemas, POLL_RESPONSE_TIMEOUT, POLL_VERSION_KEY
+from .export import EXPORT_COLUMNS
+from .middleware import QueryRecorder, stats as request_stats
+from .renderers import FastJSONParser, FastJSONRenderer
+from .serializers import AnswerSerializer, AnswerValuesSerializer, PollSerializer, PollValuesSerializer, \
+    QuestionSerializer, QuestionValuesSerializer
+from .spool import get_spool
+from . import benchmark, tallies
 
-# Create your tests here.
+
+class ParticipantUpsertTest(TransactionTestCase):
+    threads = 8
+
+    def setUp(self):
+        known_participants.clear()
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        self.question = Question.objects.create(text='question', type='TEXT', poll=poll)
+        self.url = '/api/poll/{}/question/{}/answer/'.format(poll.id, self.question.id)
+
+    def test_parallel_first_answers(self):
+        """
+        Parallel first answers of a new participant create it exactly once
+        """
+        barrier = threading.Barrier(self.threads)
+        statuses = []
+
+        def submit():
+            try:
+                barrier.wait()
+                response = Client().post(self.url, {'question': self.question.id,
+                                                    'text_input': 'answer',
+                                                    'user_id_requested': 42})
+                statuses.append(response.status_code)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=submit) for _ in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(statuses, [201] * self.threads)
+        self.assertEqual(Participant.objects.filter(user_id=42).count(), 1)
+        self.assertEqual(Answer.objects.filter(user_id=42).count(), self.threads)
+        self.assertEqual(tallies.verify(), [])
+
+
+class TallyRebuildTest(TransactionTestCase):
+    def test_rebuild_during_answers(self):
+        """
+        Answers saved while counters are rebuilt are counted once
+        """
+        dataset = benchmark.seed(polls=1, questions=3, participants=100, answers=2000)
+        poll_id, question_id, _ = next(question for question in dataset['questions'] if question[2] == 'SINGLE')
+        choice_id = dataset['choices'][question_id][0]
+        done = threading.Event()
+
+        def submit():
+            try:
+                client = Client()
+                for user_id in range(200, 230):
+                    client.post('/api/poll/{}/question/{}/answer/'.format(poll_id, question_id),
+                                {'question': question_id, 'choices': [choice_id], 'user_id_requested': user_id},
+                                content_type='application/json')
+            finally:
+                done.set()
+                connection.close()
+
+        worker = threading.Thread(target=submit)
+        worker.start()
+        while not done.wait(0.01):
+            tallies.rebuild()
+        worker.join()
+        self.assertEqual(tallies.verify(), [])
+
+
+class PollFullRetrieveTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def create_poll(self, questions):
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        for number in range(questions):
+            question = Question.objects.create(text='question {}'.format(number), type='SINGLE', poll=poll)
+            Choice.objects.bulk_create([Choice(question=question, title=str(choice)) for choice in range(4)])
+        return poll
+
+    def test_query_count_does_not_depend_on_questions(self):
+        """
+        Poll, questions and choices are fetched in three queries
+        """
+        for questions in (1, 5, 20):
+            poll = self.create_poll(questions)
+            with self.assertNumQueries(3):
+                response = self.client.get('/api/poll/{}/?expand=questions.choices'.format(poll.id),
+                                           HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['questions']), questions)
+            self.assertEqual([len(question['choices']) for question in response.data['questions']],
+                             [4] * questions)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'cached-retrieve-test'}})
+class CachedRetrieveTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        self.question = Question.objects.create(text='question', type='SINGLE', poll=self.poll)
+        self.url = '/api/poll/{}/'.format(self.poll.id)
+
+    def get(self, url, **headers):
+        return self.client.get(url, HTTP_ACCEPT='application/json', **headers)
+
+    def test_etag_and_invalidation(self):
+        response = self.get(self.url)
+        etag = response['ETag']
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            # parameters which don't change the response share the entry
+            self.assertEqual(self.get(self.url + '?utm_source=' + 'x' * 300)['ETag'], etag)
+        self.assertNotEqual(self.get(self.url + '?expand=questions.choices')['ETag'], etag)
+        Choice.objects.create(question=self.question, title='choice')
+        response = self.get(self.url + '?expand=questions.choices', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['questions'][0]['choices'][0]['title'], 'choice')
+        self.question.text = 'changed'
+        self.question.save()
+        response = self.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual((response.status_code, response.json()['questions'][0]['text']), (200, 'changed'))
+        self.assertNotEqual(response['ETag'], etag)
+
+
+    def test_missing_poll_versions_expire(self):
+        self.assertEqual(self.get('/api/poll/987654321/').status_code, 404)
+        key = POLL_VERSION_KEY.format(987654321)
+        self.assertIsNotNone(cache.get(key))
+        self.get(self.url)
+        # changed without signals, the cached response is served until it expires
+        Poll.objects.filter(pk=self.poll.pk).update(title='changed')
+        self.assertEqual(self.get(self.url).json()['title'], 'poll')
+        with mock.patch('time.time', return_value=time.time() + POLL_RESPONSE_TIMEOUT + 1):
+            self.assertIsNone(cache.get(key))
+            self.assertEqual(self.get(self.url).json()['title'], 'changed')
+
+class ActivePollsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_polls_near_their_dates(self):
+        """
+        The list compares dates with the current time, not with a time of a wrong offset
+        """
+        now = timezone.now()
+        expiring = Poll.objects.create(title='expiring', expiration_date=now + datetime.timedelta(minutes=10))
+        Poll.objects.create(title='expired', expiration_date=now - datetime.timedelta(minutes=10))
+        Poll.objects.filter(title='expired').update(start_date=now - datetime.timedelta(days=1))
+        response = self.client.get('/api/poll/', HTTP_ACCEPT='application/json')
+        self.assertEqual([poll['id'] for poll in response.json()['results']], [expiring.id])
+
+
+@override_settings(POLLS_DB_REPLICAS=['replica'])
+class ReplicaRoutingTest(SimpleTestCase):
+    def route(self, request, status=200):
+        """
+        :return: tuple (database the view reads from, response)
+        """
+        databases = []
+
+        def view(request):
+            databases.append(ReplicaRouter().db_for_read(Poll))
+            return HttpResponse(status=status)
+
+        response = ReplicaRoutingMiddleware(view)(request)
+        return databases[0], response
+
+    def test_reads_and_writes(self):
+        factory = RequestFactory()
+        self.assertEqual(self.route(factory.get('/api/poll/'))[0], 'replica')
+        database, response = self.route(factory.post('/api/poll/1/question/1/answer/'), status=201)
+        self.assertEqual(database, 'default')
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertNotIn(PIN_COOKIE, self.route(factory.post('/api/poll/1/answers'), status=400)[1].cookies)
+        self.assertEqual(ReplicaRouter().db_for_read(Poll), 'default')
+
+    def test_reads_after_write_are_pinned_to_primary(self):
+        request = RequestFactory().get('/api/user/1')
+        request.COOKIES[PIN_COOKIE] = '1'
+        self.assertEqual(self.route(request)[0], 'default')
+
+
+class ReplicaDatabaseTest(TransactionTestCase):
+    """
+    A second connection to the test database, as a replica which mirrors the primary
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # added after the checks of the test case, which only know the configured databases
+        connections.settings['replica'] = dict(connections['default'].settings_dict, TEST={'MIRROR': 'default'})
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections.settings['replica']
+        delattr(connections._connections, 'replica')
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        known_participants.clear()
+        overridden = override_settings(POLLS_DB_REPLICAS=['replica'])
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        self.question = Question.objects.create(text='question', type='TEXT', poll=poll)
+        self.url = '/api/poll/{}/question/{}/answer/'.format(poll.id, self.question.id)
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def request(self, method, *args, **kwargs):
+        """
+        :return: tuple (response, number of queries on the primary, number of queries on the replica)
+        """
+        with CaptureQueriesContext(connections['default']) as primary, \
+                CaptureQueriesContext(connections['replica']) as replica:
+            response = getattr(self.client, method)(*args, HTTP_ACCEPT='application/json', **kwargs)
+        return response, len(primary), len(replica)
+
+    def test_reads_go_to_the_replica(self):
+        self.assertNotEqual(connections['default'].connection, connections['replica'].connection)
+        response, primary, replica = self.request('get', self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((primary, replica > 0), (0, True))
+
+    def test_writes_and_reads_after_them_go_to_the_primary(self):
+        response, primary, replica = self.request('post', self.url, {
+            'question': self.question.id, 'text_input': 'answer', 'user_id_requested': 1})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((primary > 0, replica), (True, 0))
+        response, primary, replica = self.request('get', self.url)
+        self.assertEqual([answer['text_input'] for answer in response.json()['results']], ['answer'])
+        self.assertEqual((primary > 0, replica), (True, 0))
+        self.client.cookies.pop(PIN_COOKIE)
+        response, primary, replica = self.request('get', self.url)
+        self.assertEqual([answer['text_input'] for answer in response.json()['results']], ['answer'])
+        self.assertEqual((primary, replica > 0), (0, True))
+
+class AnswerSearchTest(TestCase):
+    def setUp(self):
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        self.question = Question.objects.create(text='question', type='TEXT', poll=poll)
+        participant = Participant.objects.create(user_id=1)
+        for text in ['apple pie', 'banana split', 'apple and apple crumble', 'cherry tart', 'green apple'] * 3:
+            Answer.objects.create(question=self.question, user_id=participant, text_input=text)
+        self.url = '/api/poll/{}/question/{}/search'.format(poll.id, self.question.id)
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def search(self, url):
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_of_ranked_matches(self):
+        page = self.search(self.url + '?q=apple&page_size=4')
+        self.assertEqual(page['results'][0]['text_input'], 'apple and apple crumble')
+        found = page['results']
+        while page['next']:
+            page = self.search(page['next'])
+            found += page['results']
+        self.assertEqual(len(found), 9)
+        self.assertEqual([answer['rank'] for answer in found], sorted(answer['rank'] for answer in found))
+
+    def test_new_answers_and_query_syntax(self):
+        self.client.post('/api/poll/{}/question/{}/answer/'.format(self.question.poll_id, self.question.id),
+                         {'question': self.question.id, 'text_input': 'Crème brûlée OR "tart"', 'user_id_requested': 1})
+        self.assertEqual(len(self.search(self.url + '?q=creme')['results']), 1)
+        self.assertEqual(len(self.search(self.url + '?q=tart OR')['results']), 1)
+        self.assertEqual(self.client.get(self.url, HTTP_ACCEPT='application/json').status_code, 400)
+
+
+class LiveSubscriberTest(SimpleTestCase):
+    def test_changes_are_merged_until_sent(self):
+        async def run():
+            subscriber = Subscriber()
+            counts = {'participants': 1, 'choices': {1: 1}}
+            subscriber.start(counts)
+            changed = {'participants': 2, 'choices': {1: 2, 2: 1}}
+            subscriber.push(diff_counts(counts, changed))
+            self.assertEqual(subscriber.pop(), [('counts', changed)])
+            subscriber.push({'choices': {1: 1}})
+            subscriber.push({'choices': {1: -1, 2: 1}, 'participants': 1})
+            self.assertEqual(subscriber.pop(), [('delta', {'choices': {2: 1}, 'participants': 1})])
+            self.assertFalse(subscriber.ready.is_set())
+            subscriber.close()
+            self.assertEqual(subscriber.pop(), [('end', {})])
+        asyncio.run(run())
+
+
+@override_settings(POLLS_LIVE_INTERVAL=0.02, POLLS_LIVE_KEEPALIVE=0.2)
+class LiveResultsAppTest(TestCase):
+    """
+    The ASGI application driven with fake receive and send, publishers
+    read the database through the test thread, where the test transaction is
+    """
+
+    def setUp(self):
+        self.app = LiveResultsApp(None)
+
+    def create_poll(self, expires):
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + expires)
+        question = Question.objects.create(text='question', type='SINGLE', poll=poll)
+        return poll, question, Choice.objects.create(question=question, title='choice')
+
+    def connect(self, path, method='GET'):
+        """
+        :return: tuple (task of the request, list of sent messages, event which disconnects the client)
+        """
+        messages, disconnect = [], asyncio.Event()
+
+        async def receive():
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            messages.append(message)
+        task = asyncio.ensure_future(self.app({'type': 'http', 'method': method, 'path': path}, receive, send))
+        return task, messages, disconnect
+
+    def events(self, messages):
+        """
+        :return: list of tuples (event name, data) and keep-alive comments
+        """
+        body = b''.join(message.get('body', b'') for message in messages[1:]).decode()
+        events = []
+        for block in body.split('\n\n')[:-1]:
+            if block.startswith(':'):
+                events.append(block)
+            elif block.startswith('event:'):
+                name, data = block.split('\n')
+                events.append((name[len('event: '):], json.loads(data[len('data: '):])))
+        return events
+
+    async def wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            await asyncio.sleep(0.01)
+        self.fail('timed out')
+
+    def test_fan_out_keep_alive_and_disconnect(self):
+        poll, question, choice = self.create_poll(datetime.timedelta(days=1))
+        path = '/api/poll/{}/live'.format(poll.id)
+        counts = ('counts', {'participants': 0, 'choices': {}})
+        delta = ('delta', {'choices': {str(choice.id): 1}, 'participants': 1})
+
+        async def run():
+            first, second = self.connect(path), self.connect(path)
+            await self.wait_for(lambda: all(counts in self.events(client[1]) for client in (first, second)))
+            self.assertEqual(first[1][0]['headers'][0], (b'content-type', b'text/event-stream'))
+            publisher = publishers[poll.id]
+            self.assertEqual(len(publisher.subscribers), 2)
+            response = await sync_to_async(self.client.post)(
+                '/api/poll/{}/question/{}/answer/'.format(poll.id, question.id),
+                {'question': question.id, 'choices': [choice.id], 'user_id_requested': 1},
+                content_type='application/json')
+            self.assertEqual(response.status_code, 201)
+            await self.wait_for(lambda: all(delta in self.events(client[1]) for client in (first, second)))
+            await self.wait_for(lambda: ': keep-alive' in self.events(first[1]))
+            first[2].set()
+            await first[0]
+            self.assertEqual(len(publisher.subscribers), 1)
+            second[2].set()
+            await second[0]
+            await self.wait_for(lambda: poll.id not in publishers)
+            self.assertEqual(self.events(second[1]).count(delta), 1)
+        async_to_sync(run)()
+
+    def test_end_at_expiry(self):
+        poll, _, _ = self.create_poll(datetime.timedelta(seconds=0.3))
+
+        async def run():
+            task, messages, _ = self.connect('/api/poll/{}/live'.format(poll.id))
+            await asyncio.wait_for(task, 5)
+            self.assertEqual([event[0] for event in self.events(messages) if isinstance(event, tuple)],
+                             ['counts', 'end'])
+            self.assertFalse(messages[-1]['more_body'])
+            self.assertNotIn(poll.id, publishers)
+            for path, method, status in [('/api/poll/{}/live'.format(poll.id), 'POST', 405),
+                                         ('/api/poll/0/live', 'GET', 404)]:
+                task, messages, _ = self.connect(path, method)
+                await task
+                self.assertEqual(messages[0]['status'], status)
+        async_to_sync(run)()
+
+
+class ArchiveTest(TestCase):
+    def test_archived_answers_keep_results_and_list(self):
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        question = Question.objects.create(text='question', type='SINGLE', poll=poll)
+        choice = Choice.objects.create(question=question, title='choice')
+        url = '/api/poll/{}/question/{}/answer/'.format(poll.id, question.id)
+        for user_id in range(5):
+            self.client.post(url, {'question': question.id, 'choices': [choice.id], 'user_id_requested': user_id},
+                             content_type='application/json')
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        results = self.client.get('/api/poll/{}/results'.format(poll.id)).json()
+        answers = self.client.get(url, HTTP_ACCEPT='application/json').json()['results']
+        Poll.objects.filter(pk=poll.pk).update(expiration_date=timezone.now() - datetime.timedelta(days=31))
+        self.assertEqual(list(polls_to_archive(archive_cutoff(30))), [poll])
+        self.assertEqual(archive_poll(poll, batch_size=2), 5)
+        self.assertFalse(Answer.objects.exists())
+        self.assertEqual(ArchivedAnswer.objects.count(), 5)
+        self.assertEqual(tallies.verify(), [])
+        self.assertEqual(self.client.get('/api/poll/{}/results'.format(poll.id)).json(), results)
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT='application/json').json()['results'], answers)
+
+    def test_unconverted_answers_keep_choices(self):
+        """
+        Choice rows of answers saved before choice_ids existed are copied into the archive
+        """
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() - datetime.timedelta(days=31))
+        question = Question.objects.create(text='question', type='MULTI', poll=poll)
+        choices = [Choice.objects.create(question=question, title=str(number)) for number in range(2)]
+        answer = Answer.objects.create(question=question, user_id=Participant.objects.create(user_id=1))
+        answer.choices.set(choices)
+        archive_poll(poll)
+        self.assertEqual(ArchivedAnswer.objects.get().choice_ids, [choice.id for choice in choices])
+
+
+class PollImportTest(TestCase):
+    def test_import_and_export_round_trip(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        definition = {'title': 'survey', 'expiration_date': '2030-01-01T00:00:00Z', 'description': '',
+                      'questions': [{'text': 'question {}'.format(number), 'type': 'SINGLE',
+                                     'choices': [{'title': str(choice), 'lock_other': False} for choice in range(3)]}
+                                    for number in range(20)]}
+        response = self.client.post('/api/poll/import', definition, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Choice.objects.filter(question__poll=response.json()['id']).count(), 60)
+        exported = self.client.get('/api/poll/{}/definition?format=yaml'.format(response.json()['id']))
+        clone = self.client.post('/api/poll/import', exported.content, content_type='application/yaml')
+        self.assertEqual(clone.json()['questions'], definition['questions'])
+        invalid = dict(definition, questions=[{'text': 'question', 'type': 'TEXT', 'choices': [{'title': 'a'}]}])
+        self.assertEqual(self.client.post('/api/poll/import', invalid, content_type='application/json').status_code,
+                         400)
+        self.assertEqual(Poll.objects.count(), 2)
+
+
+class ChoiceIdsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        self.question = Question.objects.create(text='question', type='MULTI', poll=self.poll)
+        self.choices = [Choice.objects.create(question=self.question, title=str(number)) for number in range(3)]
+        self.url = '/api/poll/{}/question/{}/answer/'.format(self.poll.id, self.question.id)
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def old_answer(self, user_id, choices):
+        """
+        Answer as saved before choice_ids were added: only choice rows
+        """
+        answer = Answer.objects.create(question=self.question, user_id=Participant.objects.create(user_id=user_id))
+        answer.choices.set(choices)
+        return answer
+
+    def listed_choices(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/json')
+        return [answer['choices'] for answer in response.json()['results']]
+
+    def test_compact_answers(self):
+        first, second, third = (choice.id for choice in self.choices)
+        self.old_answer(1, [first, third])
+        self.client.post(self.url, {'question': self.question.id, 'choices': [second], 'user_id_requested': 2},
+                         content_type='application/json')
+        # unconverted answers are read from the choice rows
+        self.assertEqual(self.listed_choices(), [[first, third], [second]])
+        tallies.rebuild()
+        self.assertEqual(ChoiceTally.objects.get(pk=third).votes, 1)
+        call_command('compact_answers', stdout=StringIO())
+        self.assertEqual(list(Answer.objects.order_by('id').values_list('choice_ids', flat=True)),
+                         [[first, third], [second]])
+        self.assertEqual(Answer.choices.through.objects.count(), 3)
+        call_command('compact_answers', '--drop-rows', stdout=StringIO())
+        self.assertFalse(Answer.choices.through.objects.exists())
+        self.assertEqual(self.listed_choices(), [[first, third], [second]])
+        self.assertEqual(tallies.verify(), [])
+        call_command('compact_answers', '--restore-rows', stdout=StringIO())
+        self.assertEqual(sorted(Answer.choices.through.objects.values_list('choice_id', flat=True)),
+                         [first, second, third])
+
+    def test_deleted_choices(self):
+        first, second, third = self.choices
+        for user_id, choices in enumerate([[first, second], [third], [second]]):
+            self.client.post(self.url, {'question': self.question.id, 'user_id_requested': user_id,
+                                        'choices': [choice.id for choice in choices]},
+                             content_type='application/json')
+        second.delete()
+        self.assertEqual(self.listed_choices(), [[first.id], [third.id], []])
+
+    def test_choices_deleted_by_another_process(self):
+        choice = self.choices[0]
+        data = {'question': self.question.id, 'choices': [choice.id], 'user_id_requested': 1}
+        self.assertEqual(self.client.post(self.url, data, content_type='application/json').status_code, 201)
+        schema = question_schemas.get(self.question.id)
+        choice.delete()
+        # the entry another process still has, the poll version is shared through the Django cache
+        question_schemas.set(self.question.id, schema)
+        response = self.client.post(self.url, data, content_type='application/json')
+        self.assertEqual(response.json(), {'choices': ['Choice do not correspond question']})
+
+    @override_settings(POLLS_ANSWER_CHOICE_ROWS=False)
+    def test_answers_without_choice_rows(self):
+        first, second, third = (choice.id for choice in self.choices)
+        response = self.client.post(self.url, {'question': self.question.id, 'choices': [third, first],
+                                               'user_id_requested': 1}, content_type='application/json')
+        self.assertEqual(response.json()['choices'], [first, third])
+        self.client.post('/api/poll/{}/answers'.format(self.poll.id),
+                         {'user_id_requested': 2, 'answers': [{'question': self.question.id, 'choices': [second]}]},
+                         content_type='application/json')
+        answer = Answer.objects.get(user_id=1)
+        self.client.patch('{}{}/'.format(self.url, answer.id), {'choices': [second, third]},
+                          content_type='application/json')
+        self.assertFalse(Answer.choices.through.objects.exists())
+        self.assertEqual(self.listed_choices(), [[second, third], [second]])
+        results = self.client.get('/api/poll/{}/results'.format(self.poll.id)).json()
+        self.assertEqual([choice['votes'] for choice in results['questions'][0]['choices']], [0, 2, 1])
+        self.assertEqual(tallies.verify(), [])
+
+
+class TallyTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        self.question = Question.objects.create(text='question', type='MULTI', poll=self.poll)
+        self.text_question = Question.objects.create(text='text', type='TEXT', poll=self.poll)
+        self.choices = [Choice.objects.create(question=self.question, title=str(number)) for number in range(2)]
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def url(self, question):
+        return '/api/poll/{}/question/{}/answer/'.format(self.poll.id, question.id)
+
+    def answer(self, user_id, choices=None, text_input=None):
+        question = self.text_question if text_input else self.question
+        return self.client.post(self.url(question), {'question': question.id, 'user_id_requested': user_id,
+                                                     'choices': choices or [], 'text_input': text_input},
+                                content_type='application/json')
+
+    def results(self):
+        results = self.client.get('/api/poll/{}/results'.format(self.poll.id)).json()
+        question, text_question = results['questions']
+        return (results['participants'], question['participants'], question['answers'],
+                [choice['votes'] for choice in question['choices']], text_question['text_answers'])
+
+    def test_create_update_delete(self):
+        first, second = (choice.id for choice in self.choices)
+        self.answer(1, [first, second])
+        self.answer(2, [first])
+        self.answer(3, text_input='text')
+        self.assertEqual(self.results(), (3, 2, 2, [2, 1], 1))
+        answer = Answer.objects.get(user_id=2)
+        self.client.patch('{}{}/'.format(self.url(self.question), answer.id), {'choices': [second]},
+                          content_type='application/json')
+        self.assertEqual(self.results(), (3, 2, 2, [1, 2], 1))
+        self.client.delete('{}{}/'.format(self.url(self.question), answer.id))
+        self.assertEqual(self.results(), (2, 1, 1, [1, 1], 1))
+        Participant.objects.filter(user_id=1).delete()
+        self.assertEqual(self.results(), (1, 0, 0, [0, 0], 1))
+        self.assertEqual(tallies.verify(), [])
+        self.text_question.delete()
+        self.assertEqual(self.client.get('/api/poll/{}/results'.format(self.poll.id)).json()['participants'], 0)
+        self.answer(4, [first])
+        self.poll.delete()
+        self.assertFalse(Answer.objects.exists())
+
+    def test_delete_queries_do_not_depend_on_answers(self):
+        queries = []
+        for answers in (4, 50):
+            for user_id in range(answers):
+                self.answer(user_id, [self.choices[user_id % 2].id])
+            with CaptureQueriesContext(connection) as context:
+                Answer.objects.all().delete()
+            queries.append(len(context))
+            self.assertEqual(self.results(), (0, 0, 0, [0, 0], 0))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_repeat_answer_policies(self):
+        first, second = (choice.id for choice in self.choices)
+        for user_id, policy in enumerate(['allow', 'reject', 'replace', 'keep-latest']):
+            with self.settings(POLLS_REPEAT_ANSWERS=policy):
+                self.answer(user_id, [first])
+                kept = Answer.objects.get(user_id=user_id)
+                status = self.answer(user_id, [second]).status_code
+                answers = list(Answer.objects.filter(user_id=user_id).values_list('id', 'date', 'choice_ids'))
+            if policy == 'allow':
+                self.assertEqual(len(answers), 2)
+            elif policy == 'reject':
+                self.assertEqual((status, answers), (400, [(kept.id, kept.date, [first])]))
+            elif policy == 'replace':
+                self.assertEqual(answers, [(kept.id, kept.date, [second])])
+            else:
+                self.assertEqual([choice_ids for _, _, choice_ids in answers], [[second]])
+                self.assertNotEqual(answers[0][0], kept.id)
+        self.assertEqual(tallies.verify(), [])
+        self.assertEqual(self.results(), (4, 4, 5, [2, 3], 0))
+
+    @override_settings(POLLS_REPEAT_ANSWERS='replace')
+    def test_submission_replaces_answers_in_place(self):
+        first, second = (choice.id for choice in self.choices)
+        self.answer(1, [first])
+        kept = Answer.objects.get()
+        url = '/api/poll/{}/answers'.format(self.poll.id)
+        response = self.client.post(url, {'user_id_requested': 1, 'answers': [
+            {'question': self.question.id, 'choices': [second]},
+            {'question': self.text_question.id, 'text_input': 'text'}]}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['answers'][0]['date'], self.client.get(
+            '{}{}/'.format(self.url(self.question), kept.id)).json()['date'])
+        self.assertEqual(list(Answer.objects.filter(question=self.question).values_list('id', 'date', 'choice_ids')),
+                         [(kept.id, kept.date, [second])])
+        self.assertEqual(list(kept.choices.values_list('id', flat=True)), [second])
+        self.assertEqual(self.results(), (1, 1, 1, [0, 1], 1))
+        self.assertEqual(tallies.verify(), [])
+
+    def test_rebuild_and_verify(self):
+        self.answer(1, [self.choices[0].id])
+        self.answer(2, text_input='text')
+        self.assertEqual(tallies.verify(), [])
+        ChoiceTally.objects.filter(pk=self.choices[0].id).update(votes=5)
+        self.assertEqual(tallies.verify(), [('ChoiceTally', self.choices[0].id, [5], [1])])
+        self.assertEqual(tallies.rebuild(), 1 + 2 + 2)
+        self.assertEqual(tallies.verify(), [])
+        self.assertEqual(self.results(), (2, 1, 1, [1, 0], 1))
+
+
+class AnswerAdminTest(TestCase):
+    def setUp(self):
+        participant = Participant.objects.create(user_id=1, email='one@example.com')
+        self.questions = []
+        for number, answers in enumerate([30, 3]):
+            poll = Poll.objects.create(title='poll {}'.format(number),
+                                       expiration_date=timezone.now() + datetime.timedelta(days=1))
+            question = Question.objects.create(text='question {}'.format(number), type='TEXT', poll=poll)
+            Answer.objects.bulk_create([Answer(question=question, user_id=participant, text_input='text')
+                                        for _ in range(answers)])
+            self.questions.append(question)
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def changelist(self, query=''):
+        response = self.client.get('/admin/polls_api/answer/' + query)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    @mock.patch.object(EstimatedCountPaginator, 'count_limit', 5)
+    def test_pages_past_the_count_limit(self):
+        with mock.patch.object(admin.site._registry[Answer], 'list_per_page', 2):
+            response = self.changelist()
+            self.assertContains(response, '5+ answers')
+            response = self.changelist('?p=10')
+            self.assertEqual(len(response.context['cl'].result_list), 2)
+            self.assertContains(response, '23+ answers')
+            self.assertEqual(len(self.changelist('?p=17').context['cl'].result_list), 1)
+
+    def test_filters(self):
+        first, second = self.questions
+        response = self.changelist('?poll={}'.format(second.poll_id))
+        self.assertEqual(response.context['cl'].result_count, 3)
+        question_filter = response.context['cl'].filter_specs[1]
+        self.assertEqual([question_id for question_id, _ in question_filter.lookup_choices], [second.id])
+        self.assertEqual(self.changelist('?question={}'.format(first.id)).context['cl'].result_count, 30)
+        self.assertEqual(self.changelist('?user_id__exact=1&date__gte=2000-01-01').context['cl'].result_count, 33)
+        self.assertEqual(self.changelist('?date__lt=2000-01-01').context['cl'].result_count, 0)
+        response = self.client.get('/admin/polls_api/participant/?q=one@example.com')
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertContains(self.client.get('/admin/polls_api/participant/1/change/'), '33 answers on 2 polls')
+
+
+    def change_choices(self, answer, data):
+        url = '/admin/polls_api/answer/{}/change/'.format(answer.id)
+        data = dict({'question': answer.question_id, 'text_input': '', 'user_id': answer.user_id_id,
+                     'user_id_requested': 0, '_save': 'Save'}, **data)
+        return self.client.post(url, data)
+
+    def multi_answer(self):
+        question = Question.objects.create(text='colours', type='MULTI', poll=self.questions[0].poll)
+        choices = [Choice.objects.create(question=question, title=title).id for title in ('red', 'green', 'blue')]
+        answer = Answer.objects.create(question=question, user_id_id=1, choice_ids=[choices[0]])
+        answer.choices.set([choices[0]])
+        return answer, choices
+
+    def test_choices_saved_to_choice_ids(self):
+        answer, (red, green, blue) = self.multi_answer()
+        form = self.client.get('/admin/polls_api/answer/{}/change/'.format(answer.id)).context['adminform'].form
+        self.assertIn('choices', form.fields)
+        self.assertNotIn('choice_ids', form.fields)
+        self.assertEqual(self.change_choices(answer, {'choices': '{},{}'.format(blue, green)}).status_code, 302)
+        answer.refresh_from_db()
+        self.assertEqual(answer.choice_ids, [green, blue])
+        self.assertEqual(sorted(answer.choices.values_list('id', flat=True)), [green, blue])
+        other = Choice.objects.create(question=self.questions[1], title='other')
+        self.assertEqual(self.change_choices(answer, {'choices': str(other.id)}).status_code, 200)
+
+    @override_settings(POLLS_ANSWER_CHOICE_ROWS=False)
+    def test_choice_ids_without_choice_rows(self):
+        answer, (red, green, blue) = self.multi_answer()
+        form = self.client.get('/admin/polls_api/answer/{}/change/'.format(answer.id)).context['adminform'].form
+        self.assertIn('choice_ids', form.fields)
+        self.assertNotIn('choices', form.fields)
+        self.assertEqual(self.change_choices(answer, {'choice_ids': json.dumps([blue, red])}).status_code, 302)
+        answer.refresh_from_db()
+        self.assertEqual(answer.choice_ids, [red, blue])
+        for invalid in ([blue + 100], ['red'], {'red': 1}):
+            self.assertEqual(self.change_choices(answer, {'choice_ids': json.dumps(invalid)}).status_code, 200)
+        answer.refresh_from_db()
+        self.assertEqual(answer.choice_ids, [red, blue])
+
+
+    def test_tallies_follow_admin_changes(self):
+        answer, (red, green, blue) = self.multi_answer()
+        tallies.rebuild()
+        self.change_choices(answer, {'choices': '{},{}'.format(green, blue)})
+        self.assertEqual(tallies.verify(), [])
+        self.assertEqual(ChoiceTally.objects.get(pk=green).votes, 1)
+        self.assertEqual(ChoiceTally.objects.get(pk=red).votes, 0)
+        # moved to a question of another poll
+        self.change_choices(answer, {'question': self.questions[1].id, 'text_input': 'text', 'choices': ''})
+        self.assertEqual(tallies.verify(), [])
+        Participant.objects.create(user_id=2)
+        response = self.client.post('/admin/polls_api/answer/add/', {
+            'question': self.questions[0].id, 'text_input': 'new', 'user_id': 2, 'user_id_requested': 2,
+            '_save': 'Save'})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(tallies.verify(), [])
+        self.assertEqual(PollTally.objects.get(pk=self.questions[0].poll_id).participants, 2)
+        with self.settings(POLLS_ANSWER_CHOICE_ROWS=False):
+            question = Question.objects.get(text='colours')
+            self.change_choices(answer, {'question': question.id, 'choice_ids': json.dumps([red])})
+        self.assertEqual(tallies.verify(), [])
+        self.assertEqual(ChoiceTally.objects.get(pk=red).votes, 1)
+
+class PollSubmissionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        self.single = Question.objects.create(text='single', type='SINGLE', poll=self.poll)
+        self.text = Question.objects.create(text='text', type='TEXT', poll=self.poll)
+        self.choices = [Choice.objects.create(question=self.single, title=str(number)) for number in range(2)]
+        self.url = '/api/poll/{}/answers'.format(self.poll.id)
+
+    def submit(self, answers, user_id=1, url=None):
+        return self.client.post(url or self.url, {'user_id_requested': user_id, 'answers': answers},
+                                content_type='application/json')
+
+    def test_all_answers_are_saved_at_once(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.submit([{'question': self.single.id, 'choices': [self.choices[1].id]},
+                                    {'question': self.text.id, 'text_input': 'text'}])
+        self.assertEqual(response.status_code, 201)
+        more = [Question.objects.create(text='more', type='TEXT', poll=self.poll) for _ in range(4)]
+        with self.assertNumQueries(len(context)):
+            self.submit([{'question': question.id, 'text_input': 'text'} for question in [self.text] + more] +
+                        [{'question': self.single.id, 'choices': [self.choices[0].id]}], user_id=2)
+        self.assertEqual([(answer['question'], answer['choices']) for answer in response.json()['answers']],
+                         [(self.single.id, [self.choices[1].id]), (self.text.id, [])])
+        self.assertEqual(list(Answer.objects.filter(user_id=1).order_by('id')
+                              .values_list('question', 'choice_ids')),
+                         [(self.single.id, [self.choices[1].id]), (self.text.id, [])])
+        self.assertEqual(list(Answer.objects.get(question=self.single, user_id=1).choices.all()), [self.choices[1]])
+        self.assertEqual(tallies.verify(), [])
+
+    def test_invalid_answers_save_nothing(self):
+        other = Question.objects.create(text='other', type='TEXT', poll=Poll.objects.create(
+            title='other', expiration_date=timezone.now() + datetime.timedelta(days=1)))
+        response = self.submit([{'question': self.single.id, 'choices': [choice.id for choice in self.choices]},
+                                {'question': self.text.id, 'text_input': 'text'},
+                                {'question': self.text.id, 'text_input': 'again'},
+                                {'question': other.id, 'text_input': 'text'}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['answers'], [{'choices': ['Select one']}, {},
+                                                      {'question': ['Question is answered twice']},
+                                                      {'question': ['Question do not correspond poll']}])
+        self.assertEqual(self.submit([]).status_code, 400)
+        self.assertEqual(self.submit([{'question': self.text.id, 'text_input': 'text'}],
+                                     url='/api/poll/0/answers').status_code, 404)
+        self.assertFalse(Answer.objects.exists())
+        self.assertFalse(Participant.objects.exists())
+
+
+class ParticipantListTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        self.question = Question.objects.create(text='question', type='TEXT', poll=poll)
+
+    def add_participants(self, first, count):
+        for user_id in range(first, first + count):
+            participant = Participant.objects.create(user_id=user_id)
+            Answer.objects.bulk_create([Answer(question=self.question, user_id=participant, text_input=str(number))
+                                        for number in range(3)])
+
+    def get(self, url):
+        response = self.client.get(url, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_pages_with_prefetched_answers(self):
+        self.add_participants(1, 3)
+        self.get('/api/user?page_size=3')
+        with CaptureQueriesContext(connection) as context:
+            self.get('/api/user?page_size=3')
+        self.add_participants(4, 7)
+        with self.assertNumQueries(len(context)):
+            page = self.get('/api/user?page_size=4')
+        self.assertEqual([participant['user_id'] for participant in page['results']], [1, 2, 3, 4])
+        self.assertEqual([len(participant['answers']) for participant in page['results']], [3] * 4)
+        page = self.get(page['next'])
+        self.assertEqual([participant['user_id'] for participant in page['results']], [5, 6, 7, 8])
+        self.assertEqual([participant['user_id'] for participant in self.get(page['previous'])['results']],
+                         [1, 2, 3, 4])
+        page = self.get('/api/user?answers=false&page_size=100')
+        self.assertEqual(len(page['results']), 10)
+        self.assertIsNone(page['next'])
+        self.assertNotIn('answers', page['results'][0])
+
+    def test_unconverted_answers_in_constant_queries(self):
+        multi = Question.objects.create(text='colours', type='MULTI', poll=self.question.poll)
+        choices = [Choice.objects.create(question=multi, title=str(number)).id for number in range(2)]
+
+        def add_old_answers(first, count):
+            self.add_participants(first, count)
+            for user_id in range(first, first + count):
+                # saved before choice_ids were added: only choice rows
+                Answer.objects.create(question=multi, user_id_id=user_id).choices.set(choices)
+
+        add_old_answers(1, 2)
+        self.get('/api/user?page_size=2')
+        with CaptureQueriesContext(connection) as context:
+            self.get('/api/user?page_size=2')
+        add_old_answers(3, 6)
+        with self.assertNumQueries(len(context)):
+            page = self.get('/api/user?page_size=8')
+        self.assertEqual([[answer['choices'] for answer in participant['answers']]
+                          for participant in page['results']], [[[], [], [], choices]] * 8)
+        with self.assertNumQueries(len(context)):
+            participant = self.get('/api/user/8')
+        self.assertEqual(participant['answers'][-1]['choices'], choices)
+
+    def test_participant_detail(self):
+        self.add_participants(1, 1)
+        self.assertEqual([answer['text_input'] for answer in self.get('/api/user/1')['answers']], ['0', '1', '2'])
+        self.assertNotIn('answers', self.get('/api/user/1?answers=false'))
+        self.assertEqual(self.client.get('/api/user/2', HTTP_ACCEPT='application/json').status_code, 404)
+        response = self.client.patch('/api/user/1', {'email': 'one@example.com'}, content_type='application/json')
+        self.assertEqual(response.json()['email'], 'one@example.com')
+        self.assertEqual(self.client.patch('/api/user/1', {'user_id': 2},
+                                           content_type='application/json').status_code, 403)
+
+
+class PollExportTest(TestCase):
+    def setUp(self):
+        self.poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        text = Question.objects.create(text='name', type='TEXT', poll=self.poll)
+        multi = Question.objects.create(text='colours', type='MULTI', poll=self.poll)
+        red, green = (Choice.objects.create(question=multi, title=title) for title in ('red', 'green'))
+        participant = Participant.objects.create(user_id=1, first_name='Ann', email='ann@example.com')
+        Answer.objects.create(question=text, user_id=participant, text_input='Ann, "A"')
+        Answer.objects.create(question=multi, user_id=participant, choice_ids=[red.id, green.id])
+        self.url = '/api/poll/{}/export'.format(self.poll.id)
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def export(self, format):
+        response = self.client.get(self.url, {'format': format})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="poll_{}.{}"'.format(
+            self.poll.id, format))
+        return b''.join(response.streaming_content).decode()
+
+    def test_admin_only(self):
+        self.assertEqual(self.client.get(self.url, {'format': 'csv'}).status_code, 403)
+
+    def test_csv(self):
+        self.client.login(username='admin', password='admin')
+        lines = self.export('csv').splitlines()
+        self.assertEqual(lines[0], ','.join(EXPORT_COLUMNS))
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(lines[1].endswith(',name,TEXT,1,Ann,,ann@example.com,"Ann, ""A""",'))
+        self.assertTrue(lines[2].endswith(',colours,MULTI,1,Ann,,ann@example.com,,red; green'))
+
+    def test_ndjson_of_archived_poll(self):
+        self.client.login(username='admin', password='admin')
+        archive_poll(self.poll)
+        rows = [json.loads(line) for line in self.export('ndjson').splitlines()]
+        self.assertEqual([row['question_text'] for row in rows], ['name', 'colours'])
+        self.assertEqual([row['choices'] for row in rows], [[], ['red', 'green']])
+        self.assertEqual(rows[0]['text_input'], 'Ann, "A"')
+        self.assertEqual(set(rows[0]), set(EXPORT_COLUMNS))
+
+
+class InstrumentationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        request_stats.reset()
+        Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def test_disabled_by_default(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/poll/', HTTP_ACCEPT='application/json'))
+        self.assertEqual(request_stats.snapshot(), {})
+
+    @override_settings(POLLS_INSTRUMENTATION=True)
+    def test_route_stats(self):
+        for _ in range(2):
+            response = self.client.get('/api/poll/', HTTP_ACCEPT='application/json')
+        self.assertRegex(response['Server-Timing'], r'^app;dur=[0-9.]+, db;dur=[0-9.]+;desc="[0-9]+ queries", '
+                                                    r'dup;desc="0 duplicate queries"$')
+        self.assertEqual(self.client.get('/api/stats').status_code, 403)
+        self.client.login(username='admin', password='admin')
+        routes = self.client.get('/api/stats', HTTP_ACCEPT='application/json').json()
+        poll_list = routes['PollViewSet.list']
+        self.assertEqual(poll_list['requests'], 2)
+        self.assertEqual(sum(poll_list['histogram'].values()), 2)
+        self.assertEqual(poll_list['mean_queries'], poll_list['queries'] / 2)
+        self.assertEqual(self.client.delete('/api/stats').status_code, 204)
+        # the reset request itself is measured after the reset
+        self.assertEqual(list(self.client.get('/api/stats', HTTP_ACCEPT='application/json').json()),
+                         ['RequestStatsView.delete'])
+
+    def test_duplicate_queries(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            for _ in range(3):
+                list(Poll.objects.filter(pk=1))
+            list(Poll.objects.all())
+        self.assertEqual(recorder.count, 4)
+        self.assertEqual(recorder.duplicates, 2)
+
+
+class QueuedIngestionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        overridden = override_settings(POLLS_ANSWER_INGESTION='queue',
+                                     POLLS_ANSWER_SPOOL=os.path.join(directory.name, 'spool.sqlite3'))
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+        self.spool = get_spool()
+        self.addCleanup(lambda: self.spool.connection.close())
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        self.question = Question.objects.create(text='question', type='TEXT', poll=poll)
+        self.url = '/api/poll/{}/question/{}/answer/'.format(poll.id, self.question.id)
+
+    def submit(self, user_id, text='answer'):
+        response = self.client.post(self.url, {'question': self.question.id, 'text_input': text,
+                                               'user_id_requested': user_id})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response['Location'], '/api/submission/{}'.format(response.json()['submission']))
+        return response.json()['submission']
+
+    def status(self, submission_id):
+        return self.client.get('/api/submission/{}'.format(submission_id), HTTP_ACCEPT='application/json').json()
+
+    def drain(self):
+        call_command('drain_answers', '--once', stdout=StringIO())
+
+    def test_drain(self):
+        submissions = [self.submit(user_id) for user_id in (1, 2)]
+        self.assertEqual(self.status(submissions[0])['status'], 'queued')
+        self.assertFalse(Answer.objects.exists())
+        self.drain()
+        answers = Answer.objects.order_by('user_id')
+        self.assertEqual([answer.text_input for answer in answers], ['answer', 'answer'])
+        self.assertEqual([self.status(submission) for submission in submissions],
+                         [{'submission': submission, 'status': 'done', 'answer': answer.id, 'error': None}
+                          for submission, answer in zip(submissions, answers)])
+
+    def test_invalid_submissions(self):
+        response = self.client.post(self.url, {'question': self.question.id, 'user_id_requested': 1})
+        self.assertEqual(response.status_code, 400)
+        submission = self.spool.put({'question': self.question.id + 1, 'text_input': 'answer', 'choices': [],
+                                     'user_id_requested': 1})
+        self.drain()
+        self.assertEqual(self.status(submission)['status'], 'failed')
+        self.assertIn('question', self.status(submission)['error'])
+        self.assertFalse(Answer.objects.exists())
+        unknown = '00000000-0000-0000-0000-000000000000'
+        self.assertEqual(self.client.get('/api/submission/{}'.format(unknown)).status_code, 404)
+
+    def test_replayed_submission(self):
+        submission = self.submit(1)
+        self.drain()
+        answer_id = self.status(submission)['answer']
+        # a worker which stopped before finish() leaves the submission to be claimed again
+        self.spool.connection.execute("UPDATE submission SET status = 'queued' WHERE id = ?", (submission,))
+        self.drain()
+        self.assertEqual(self.status(submission)['answer'], answer_id)
+        self.assertEqual(Answer.objects.count(), 1)
+
+
+@mock.patch.dict(api_settings.DEFAULT_THROTTLE_RATES, {'answer_ip': '4/minute', 'answer_participant': '2/minute'})
+class AnswerThrottleTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        # emptied buckets of the test client address would throttle later tests
+        self.addCleanup(cache.clear)
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        self.question = Question.objects.create(text='question', type='TEXT', poll=poll)
+        self.url = '/api/poll/{}/question/{}/answer/'.format(poll.id, self.question.id)
+
+    def submit(self, user_id, **extra):
+        return self.client.post(self.url, {'question': self.question.id, 'text_input': 'answer',
+                                           'user_id_requested': user_id}, **extra).status_code
+
+    def test_participant_bucket(self):
+        self.assertEqual([self.submit(1) for _ in range(3)], [201, 201, 429])
+        self.assertEqual(self.submit(2), 201)
+        # one token of two per minute is back after 30 seconds
+        now = time.time()
+        with mock.patch('time.time', return_value=now + 31):
+            self.assertEqual([self.submit(1) for _ in range(2)], [201, 429])
+
+    def test_address_bucket(self):
+        self.assertEqual([self.submit(user_id) for user_id in range(5)], [201] * 4 + [429])
+        response = self.client.post(self.url, {'question': self.question.id, 'text_input': 'answer',
+                                               'user_id_requested': 9})
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.submit(9, REMOTE_ADDR='10.0.0.2'), 201)
+
+    def test_only_submissions_are_throttled(self):
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        statuses = {self.client.get(self.url, HTTP_ACCEPT='application/json').status_code for _ in range(5)}
+        self.assertEqual(statuses, {200})
+
+
+class DefaultThrottleRatesTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_long_poll_behind_one_address(self):
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        questions = [Question.objects.create(text=str(number), type='TEXT', poll=poll) for number in range(40)]
+        # respondents sharing an address answer question by question
+        statuses = {self.client.post('/api/poll/{}/question/{}/answer/'.format(poll.id, question.id),
+                                     {'question': question.id, 'text_input': 'answer',
+                                      'user_id_requested': user_id}).status_code
+                    for user_id in range(6) for question in questions}
+        self.assertEqual(statuses, {201})
+
+class AnswerListPaginationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        poll = Poll.objects.create(title='poll', expiration_date=timezone.now() + datetime.timedelta(days=1))
+        self.question = Question.objects.create(text='question', type='TEXT', poll=poll)
+        self.url = '/api/poll/{}/question/{}/answer/'.format(poll.id, self.question.id)
+        self.start = timezone.now().replace(microsecond=0) - datetime.timedelta(days=1)
+        self.participant = Participant.objects.create(user_id=1)
+        # answers 1, 2 and 3 have the same date, the page boundary falls between them
+        for number, hours in enumerate([0, 1, 1, 1, 2, 3]):
+            self.add_answer(str(number), hours)
+        User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        self.client.login(username='admin', password='admin')
+
+    def add_answer(self, text, hours):
+        answer = Answer.objects.create(question=self.question, user_id=self.participant, text_input=text)
+        Answer.objects.filter(pk=answer.pk).update(date=self.start + datetime.timedelta(hours=hours))
+
+    def get(self, url, **params):
+        response = self.client.get(url, params, HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def texts(self, page):
+        return [answer['text_input'] for answer in page['results']]
+
+    def test_pages(self):
+        page = self.get(self.url, page_size=2)
+        self.assertIsNone(page['previous'])
+        self.assertEqual(self.texts(page), ['0', '1'])
+        page = self.get(page['next'])
+        self.assertEqual(self.texts(page), ['2', '3'])
+        # an answer added after the cursor with a date already reached is on the next page, not skipped
+        self.add_answer('6', 1)
+        page = self.get(page['next'])
+        self.assertEqual(self.texts(page), ['6', '4'])
+        page = self.get(page['next'])
+        self.assertEqual(self.texts(page), ['5'])
+        self.assertIsNone(page['next'])
+        page = self.get(page['previous'])
+        self.assertEqual(self.texts(page), ['6', '4'])
+        self.assertEqual(self.texts(self.get(page['previous'])), ['2', '3'])
+
+    def test_date_filters(self):
+        since = (self.start + datetime.timedelta(hours=1)).isoformat()
+        until = (self.start + datetime.timedelta(hours=3)).isoformat()
+        self.assertEqual(self.texts(self.get(self.url, since=since, until=until)), ['1', '2', '3', '4'])
+        page = self.get(self.url, since=since, page_size=3)
+        self.assertEqual(self.texts(self.get(page['next'])), ['4', '5'])
+        self.assertEqual(self.client.get(self.url, {'since': 'yesterday'}).status_code, 400)
+
+    def test_invalid_cursor(self):
+        for cursor in ('garbage', base64.urlsafe_b64encode(b'["after", 1]').decode()):
+            response = self.client.get(self.url, {'cursor': cursor}, HTTP_ACCEPT='application/json')
+            self.assertEqual(response.status_code, 404)
+
+
+class FastJSONTest(SimpleTestCase):
+    data = {'date': datetime.datetime(2021, 7, 1, 12, 30, 15, 250000, tzinfo=datetime.timezone.utc),
+            'local': datetime.datetime(2021, 7, 1, 12, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=3))),
+            'day': datetime.date(2021, 7, 1), 'time': datetime.time(12, 30, 15, 1),
+            'amount': Decimal('1.50'), 'uuid': UUID(int=1), 1: ['text', None, True, 2.5]}
+
+    def test_same_output_as_stdlib_json(self):
+        self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+        with mock.patch('polls_api.renderers.orjson', None):
+            self.assertEqual(FastJSONRenderer().render(self.data), JSONRenderer().render(self.data))
+
+    def test_parser(self):
+        body = '{"text": "опрос", "choices": [1, 2], "value": 1.5}'.encode()
+        self.assertEqual(FastJSONParser().parse(BytesIO(body)), JSONParser().parse(BytesIO(body)))
+        with self.assertRaises(ParseError):
+            FastJSONParser().parse(BytesIO(b'{"text": '))
+
+
+class ValuesSerializerTest(TestCase):
+    def setUp(self):
+        poll = Poll.objects.create(title='poll', description='',
+                                   expiration_date=timezone.now() + datetime.timedelta(days=1))
+        Poll.objects.create(title='exact second', description='second',
+                            expiration_date=timezone.now().replace(microsecond=0) + datetime.timedelta(days=2))
+        Poll.objects.filter(pk=poll.pk).update(start_date=datetime.datetime(2021, 1, 1, tzinfo=datetime.timezone.utc))
+        text = Question.objects.create(text='name', type='TEXT', poll=poll)
+        multi = Question.objects.create(text='colours', type='MULTI', poll=poll)
+        choices = [Choice.objects.create(question=multi, title=title).id for title in ('red', 'green')]
+        participant = Participant.objects.create(user_id=1)
+        Answer.objects.create(question=text, user_id=participant, text_input='Ann')
+        Answer.objects.create(question=multi, user_id=participant, choice_ids=choices[::-1], user_id_requested=1)
+        # saved before choice_ids were added
+        Answer.objects.create(question=multi, user_id=participant).choices.set(choices)
+
+    def assertSameOutput(self, values_serializer, serializer, queryset):
+        rows = values_serializer.serialize(values_serializer.values(queryset))
+        data = serializer(queryset, many=True).data
+        self.assertEqual(JSONRenderer().render(rows), JSONRenderer().render(data))
+
+    def test_same_output_as_model_serializers(self):
+        self.assertSameOutput(PollValuesSerializer, PollSerializer, Poll.objects.order_by('id'))
+        self.assertSameOutput(QuestionValuesSerializer, QuestionSerializer, Question.objects.order_by('id'))
+        with override_settings(TIME_ZONE='UTC'):
+            self.assertSameOutput(PollValuesSerializer, PollSerializer, Poll.objects.order_by('id'))
+
+    def test_answers(self):
+        cache.clear()
+        self.assertSameOutput(AnswerValuesSerializer, AnswerSerializer, Answer.objects.order_by('id'))
+        with override_settings(POLLS_ANSWER_CHOICE_ROWS=False):
+            self.assertSameOutput(AnswerValuesSerializer, AnswerSerializer, Answer.objects.order_by('id'))
+
+
+class AsyncViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        expires = timezone.now() + datetime.timedelta(days=1)
+        self.polls = [Poll.objects.create(title='poll {}'.format(number), expiration_date=expires)
+                      for number in range(3)]
+        Poll.objects.create(title='expired', expiration_date=timezone.now() - datetime.timedelta(days=1))
+        poll = self.polls[0]
+        self.question = Question.objects.create(text='colour', type='SINGLE', poll=poll)
+        self.choices = [Choice.objects.create(question=self.question, title=title).id for title in ('red', 'green')]
+        self.url = '/api/async/poll/{}/question/{}/'.format(poll.id, self.question.id)
+
+    async def get(self, url, status=200, **params):
+        # AsyncClient of Django 3.2 drops the data argument of get()
+        response = await self.async_client.get(url + ('?' + urlencode(params) if params else ''))
+        self.assertEqual(response.status_code, status)
+        return json.loads(response.content)
+
+    async def post(self, data, **extra):
+        return await self.async_client.post(self.url + 'answer/', data, content_type='application/json', **extra)
+
+    async def test_poll_list(self):
+        page = await self.get('/api/async/poll/', page_size=2)
+        self.assertEqual([poll['title'] for poll in page['results']], ['poll 0', 'poll 1'])
+        self.assertIsNone(page['previous'])
+        self.assertEqual(page['results'], (await sync_to_async(self.client.get)(
+            '/api/poll/', {'page_size': 2}, HTTP_ACCEPT='application/json')).json()['results'])
+        page = await self.get(page['next'])
+        self.assertEqual([poll['title'] for poll in page['results']], ['poll 2'])
+        self.assertIsNone(page['next'])
+        await self.get('/api/async/poll/', status=400, since='yesterday')
+        await self.get('/api/async/poll/', status=404, cursor='garbage')
+
+    async def test_details(self):
+        poll = self.polls[0]
+        data = await self.get('/api/async/poll/{}/'.format(poll.id), expand='questions.choices')
+        self.assertEqual(data['title'], 'poll 0')
+        self.assertEqual([choice['title'] for choice in data['questions'][0]['choices']], ['red', 'green'])
+        self.assertEqual((await self.get('/api/async/poll/{}/'.format(poll.id)))['questions'][0]['text'], 'colour')
+        self.assertEqual((await self.get(self.url))['type'], 'SINGLE')
+        await self.get('/api/async/poll/0/', status=404)
+        await self.get('/api/async/poll/{}/question/{}/'.format(self.polls[1].id, self.question.id), status=404)
+
+    async def test_methods(self):
+        for url in ('/api/async/poll/', '/api/async/poll/{}/'.format(self.polls[0].id), self.url):
+            self.assertEqual((await self.async_client.post(url, {})).status_code, 405)
+        self.assertEqual((await self.async_client.get(self.url + 'answer/')).status_code, 405)
+
+    async def test_answer_create(self):
+        response = await self.post({'question': self.question.id, 'choices': [self.choices[1]],
+                                    'user_id_requested': 1})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)['choices'], [self.choices[1]])
+        answer = await sync_to_async(Answer.objects.get)()
+        self.assertEqual(answer.choice_ids, [self.choices[1]])
+        response = await self.post({'question': self.question.id, 'choices': self.choices, 'user_id_requested': 1})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('choices', json.loads(response.content))
+        response = await self.async_client.post(self.url + 'answer/', '{"question": ',
+                                                content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+    @mock.patch.dict(api_settings.DEFAULT_THROTTLE_RATES, {'answer_participant': '2/minute'})
+    async def test_throttling(self):
+        statuses = [(await self.post({'question': self.question.id, 'choices': [self.choices[0]],
+                                      'user_id_requested': 1})).status_code for _ in range(3)]
+        self.assertEqual(statuses, [201, 201, 429])
+
+    async def test_queue(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                self.settings(POLLS_ANSWER_INGESTION='queue', POLLS_ANSWER_SPOOL=os.path.join(directory, 'spool')):
+            response = await self.post({'question': self.question.id, 'choices': [self.choices[0]],
+                                        'user_id_requested': 1})
+            self.assertEqual(response.status_code, 202)
+            submission = json.loads(response.content)['submission']
+            self.assertFalse(await sync_to_async(Answer.objects.exists)())
+            await sync_to_async(call_command)('drain_answers', '--once', stdout=StringIO())
+            self.assertEqual((await sync_to_async(get_spool)()).status(submission)['status'], 'done')
+            get_spool().connection.close()
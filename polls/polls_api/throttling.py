@@ -0,0 +1,64 @@
+"""
+Token bucket throttles of answer submission
+"""
+import time
+from rest_framework.settings import api_settings
+from rest_framework.throttling import SimpleRateThrottle
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    Rate 'N/period' allows bursts of N requests, tokens are refilled
+    at N per period. Buckets are kept in the default cache
+    """
+    cache_format = 'throttle_%(scope)s_%(ident)s'
+
+    def get_rate(self):
+        # read on every request unlike THROTTLE_RATES, so changed settings apply
+        return api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        capacity, period = self.num_requests, self.duration
+        now = time.time()
+        tokens, updated = self.cache.get(self.key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated) * capacity / period)
+        if tokens < 1:
+            self.tokens = tokens
+            return False
+        self.cache.set(self.key, (tokens - 1, now), period)
+        return True
+
+    def wait(self):
+        """
+        Seconds until the next token
+        """
+        return (1 - self.tokens) * self.duration / self.num_requests
+
+
+class AnswerIPThrottle(TokenBucketThrottle):
+    """
+    Answer submissions per client address
+    """
+    scope = 'answer_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {'scope': self.scope, 'ident': self.get_ident(request)}
+
+
+class AnswerParticipantThrottle(TokenBucketThrottle):
+    """
+    Answer submissions per participant (user_id_requested)
+    """
+    scope = 'answer_participant'
+
+    def get_cache_key(self, request, view):
+        try:
+            user_id = int(request.data.get('user_id_requested', 0))
+        except (TypeError, ValueError, AttributeError):
+            return None
+        return self.cache_format % {'scope': self.scope, 'ident': user_id}
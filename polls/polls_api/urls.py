@@ -3,7 +3,7 @@ from rest_framework.routers import DefaultRouter
 from rest_framework.schemas import get_schema_view
 from rest_framework.documentation import include_docs_urls
 
-from . import views
+from . import views, async_views
 
 router = DefaultRouter()
 router.register(r'poll', views.PollViewSet)
@@ -17,6 +17,23 @@ app_name = "polls"
 
 urlpatterns = [
     path('api/', include(router.urls)),
+    re_path(r'^api/poll/import$', views.PollImportView.as_view()),
+    re_path(r'^api/poll/(?P<poll_id>[0-9]+)/definition$', views.PollDefinitionView.as_view()),
+    re_path(r'^api/poll/(?P<poll_id>[0-9]+)/answers$', views.PollAnswerView.as_view()),
+    re_path(r'^api/poll/(?P<poll_id>[0-9]+)/export$', views.PollExportView.as_view()),
+    re_path(r'^api/poll/(?P<poll_id>[0-9]+)/results$', views.PollResultsView.as_view()),
+    re_path(r'^api/poll/(?P<poll_id>[0-9]+)/question/(?P<question_id>[0-9]+)/results$',
+            views.QuestionResultsView.as_view()),
+    re_path(r'^api/poll/(?P<poll_id>[0-9]+)/search$', views.AnswerSearchView.as_view()),
+    re_path(r'^api/poll/(?P<poll_id>[0-9]+)/question/(?P<question_id>[0-9]+)/search$',
+            views.AnswerSearchView.as_view()),
+    re_path(r'^api/stats$', views.RequestStatsView.as_view()),
+    re_path(r'^api/async/poll/$', async_views.poll_list),
+    re_path(r'^api/async/poll/(?P<poll_id>[0-9]+)/$', async_views.poll_detail),
+    re_path(r'^api/async/poll/(?P<poll_id>[0-9]+)/question/(?P<question_id>[0-9]+)/$', async_views.question_detail),
+    re_path(r'^api/async/poll/(?P<poll_id>[0-9]+)/question/(?P<question_id>[0-9]+)/answer/$',
+            async_views.answer_create),
+    re_path(r'^api/submission/(?P<submission_id>[0-9a-f-]+)$', views.SubmissionStatusView.as_view()),
     re_path(r'api/user/(?P<user_id>[0-9]+)', views.UserView.as_view()),
     re_path(r'api/user', views.UserListView.as_view()),
 
@@ -1,11 +1,31 @@
-import datetime
+import hashlib
 from django.contrib.auth.models import User
-from django.utils.timezone import get_default_timezone
+from django.core.cache import cache
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
+from django.utils.http import parse_etags
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import authentication, permissions, status, viewsets, generics
-from .models import Poll, Question, Choice, Answer, Participant
+from rest_framework.exceptions import ValidationError
+from .models import Poll, Question, Choice, Answer, ArchivedAnswer, Participant
 from . import serializers
+from .pagination import (AnswerKeysetPagination, ParticipantKeysetPagination, PollKeysetPagination,
+                         SearchKeysetPagination)
+from .throttling import AnswerIPThrottle, AnswerParticipantThrottle
+from .renderers import CSVRenderer, NDJSONRenderer, FastJSONRenderer, FastJSONParser, YAMLRenderer, YAMLParser
+from .export import EXPORT_COLUMNS, iter_answer_rows
+from . import tallies, replicas
+from .middleware import stats as request_stats
+from .spool import get_spool, queue_enabled
+from .ingestion import queue_payload
+from .cache import poll_version, POLL_RESPONSE_TIMEOUT
+from .active import active_polls, cached_active_polls
+from .search import search_answers
+from .archive import is_archived
 
 
 # Permissions
@@ -44,16 +64,142 @@ class IsAdminOrPostOnly(permissions.BasePermission):
         return request.user.is_superuser
 
 
-class PollViewSet(viewsets.ModelViewSet):
+class IsAdmin(permissions.BasePermission):
+    """
+    Permission to only allow admin to read and edit
+    """
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_superuser)
+
+
+def date_range(request):
+    """
+    Dates of since (inclusive) and until (exclusive) query parameters
+    :param request:
+    :return: tuple of datetimes or None
+    """
+    dates = []
+    for param in ('since', 'until'):
+        value = request.query_params.get(param)
+        if value is None:
+            dates.append(None)
+            continue
+        try:
+            date = parse_datetime(value)
+        except ValueError:
+            date = None
+        if date is None:
+            raise ValidationError({param: ['Expected ISO 8601 date and time']})
+        dates.append(timezone.make_aware(date) if timezone.is_naive(date) else date)
+    return tuple(dates)
+
+
+def date_filters(request, field):
+    """
+    :param request:
+    :param field: name of the date field
+    :return: dict of lookups for filter() by since and until query parameters
+    """
+    since, until = date_range(request)
+    lookups = {}
+    if since is not None:
+        lookups[field + '__gte'] = since
+    if until is not None:
+        lookups[field + '__lt'] = until
+    return lookups
+
+
+def active_polls_started(request):
+    """
+    Active polls filtered by start date with since and until query parameters
+    :param request:
+    :return: list of dicts of PollValuesSerializer.values() ordered by start date and id
+    """
+    since, until = date_range(request)
+    return [poll for poll in cached_active_polls()
+            if (since is None or poll['start_date'] >= since) and (until is None or poll['start_date'] < until)]
+
+
+class ValuesListMixin:
+    """
+    List action serialized from .values() rows by values_serializer_class
+    """
+    values_serializer_class = None
+
+    def list(self, request, *args, **kwargs):
+        serializer = self.values_serializer_class
+        queryset = serializer.values(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(serializer.serialize(page))
+        return Response(serializer.serialize(queryset))
+
+
+class CachedRetrieveMixin:
+    """
+    Caches retrieve responses until the structure of their poll changes
+    and answers with 304 to clients which have the current version
+    """
+
+    def get_poll_id(self):
+        raise NotImplementedError
+
+    def get_active_window(self, instance):
+        """
+        Start and expiration dates outside of which cached response is not served
+        :return: tuple of datetimes or None
+        """
+        return None
+
+    def get_response_variant(self):
+        """
+        Query parameters which change the response, in a normalized form. Other
+        parameters don't make new cache entries
+        :return: tuple
+        """
+        return ()
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Serve response from the cache, keyed by poll version, path, format and response variant
+        """
+        # hashed, the key has a fixed length whatever the path
+        variant = hashlib.sha1(repr((request.path, request.accepted_renderer.format,
+                                     self.get_response_variant())).encode()).hexdigest()
+        key = 'polls_api:response:{}:{}'.format(poll_version(self.get_poll_id()), variant)
+        entry = cache.get(key)
+        if entry is None:
+            with replicas.primary():
+                instance = self.get_object()
+                entry = {'data': self.get_serializer(instance).data,
+                         'window': self.get_active_window(instance)}
+            cache.set(key, entry, POLL_RESPONSE_TIMEOUT)
+        elif entry['window'] is not None:
+            start, expires = entry['window']
+            if not start <= timezone.now() < expires:
+                raise Http404
+        etag = '"{}"'.format(hashlib.sha1(key.encode()).hexdigest())
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in if_none_match or '*' in if_none_match:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(entry['data'])
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept'])
+        return response
+
+
+class PollViewSet(CachedRetrieveMixin, viewsets.ModelViewSet):
     """
     list:
-    Return a list of all polls that aren't expired
+    Return active polls page by page ordered by start date, since and until filter by start date
 
     create:
     Create new poll
 
     retrieve:
-    Return the given poll.
+    Return the given poll. With expand=questions.choices returns choices of every question too.
 
     update:
     Replace poll
@@ -67,14 +213,25 @@ class PollViewSet(viewsets.ModelViewSet):
     queryset = Poll.objects.all()
     serializer_class = serializers.PollSerializer  # for list view
     detail_serializer_class = serializers.PollDetailSerializer  # for detail view
+    full_serializer_class = serializers.PollFullSerializer  # for detail view with choices
     permission_classes = [IsAdminOrReadOnly]
+    pagination_class = PollKeysetPagination
+
+    def expand_choices(self):
+        """
+        Whether choices of questions are requested with expand=questions.choices
+        :return: bool
+        """
+        return 'questions.choices' in self.request.query_params.get('expand', '').split(',')
 
     def get_serializer_class(self):
         """
-        Determines which serializer to use 'list' or 'detail'
+        Determines which serializer to use 'list', 'detail' or 'full' detail
         :return: serializer class
         """
         if self.action == 'retrieve':
+            if self.expand_choices():
+                return self.full_serializer_class
             if hasattr(self, 'detail_serializer_class'):
                 return self.detail_serializer_class
         return super().get_serializer_class()
@@ -85,13 +242,29 @@ class PollViewSet(viewsets.ModelViewSet):
         against a 'expiration_date' query parameter
         :return: queryset of active polls
         """
-        queryset = Poll.objects.all()
-        now = datetime.datetime.now(tz=None).replace(tzinfo=get_default_timezone())
-        queryset = queryset.filter(start_date__lte=now, expiration_date__gt=now)
+        queryset = active_polls()
+        if self.action == 'retrieve':
+            queryset = queryset.prefetch_related('questions__choices' if self.expand_choices() else 'questions')
         return queryset
 
+    def list(self, request, *args, **kwargs):
+        """
+        Active polls are served from memory until a poll changes or the next start or expiration date
+        """
+        page = self.paginate_queryset(active_polls_started(request))
+        return self.get_paginated_response(serializers.PollValuesSerializer.serialize(page))
+
+    def get_poll_id(self):
+        return self.kwargs['pk']
+
+    def get_response_variant(self):
+        return (self.expand_choices(),)
 
-class QuestionViewSet(viewsets.ModelViewSet):
+    def get_active_window(self, instance):
+        return instance.start_date, instance.expiration_date
+
+
+class QuestionViewSet(CachedRetrieveMixin, ValuesListMixin, viewsets.ModelViewSet):
     """
     retrieve:
     Return the given question with choices.
@@ -102,6 +275,7 @@ class QuestionViewSet(viewsets.ModelViewSet):
     queryset = Question.objects.all()
     serializer_class = serializers.QuestionSerializer
     detail_serializer_class = serializers.QuestionDetailSerializer
+    values_serializer_class = serializers.QuestionValuesSerializer
     # detail_serializer_class_text_type = serializers.QuestionWithTextInputType
     # detail_serializer_class_single_type = serializers.QuestionWithSingleChoiceType
     # detail_serializer_class_multiple_type = serializers.QuestionWithMultipleChoicesType
@@ -125,6 +299,9 @@ class QuestionViewSet(viewsets.ModelViewSet):
         queryset = Question.objects.filter(poll=self.kwargs['poll_id'])
         return queryset
 
+    def get_poll_id(self):
+        return self.kwargs['poll_id']
+
 
 class ChoicesViewSet(viewsets.ModelViewSet):
     """
@@ -143,17 +320,42 @@ class ChoicesViewSet(viewsets.ModelViewSet):
         return queryset
 
 
-class AnswerViewSet(viewsets.ModelViewSet):
+class AnswerViewSet(ValuesListMixin, viewsets.ModelViewSet):
     """
     list:
-    Return a list of all answers of users
+    Return answers on the question page by page in date order,
+    filtered by since, until and user_id. Answers of archived polls come from the archive
 
     create:
     post an answer on question
     """
     queryset = Answer.objects.all()
     serializer_class = serializers.AnswerSerializer
+    values_serializer_class = serializers.AnswerValuesSerializer
     permission_classes = [IsAdminOrPostOnly]
+    throttle_classes = [AnswerIPThrottle, AnswerParticipantThrottle]
+    pagination_class = AnswerKeysetPagination
+
+    def get_throttles(self):
+        """
+        Only submission of answers is throttled
+        """
+        if self.action != 'create':
+            return []
+        return super().get_throttles()
+
+    def create(self, request, *args, **kwargs):
+        """
+        With queued ingestion the validated answer is put into the spool
+        and saved later by drain_answers
+        """
+        if not queue_enabled():
+            return super().create(request, *args, **kwargs)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        submission_id = get_spool().put(queue_payload(serializer.validated_data))
+        return Response({'submission': submission_id, 'status': 'queued'}, status=status.HTTP_202_ACCEPTED,
+                        headers={'Location': '/api/submission/{}'.format(submission_id)})
 
     def perform_create(self, serializer):
         """
@@ -170,29 +372,228 @@ class AnswerViewSet(viewsets.ModelViewSet):
         :return: queryset of answers on the question
         """
         queryset = Answer.objects.filter(question=self.kwargs['question_id'])
+        if self.action == 'list':
+            if is_archived(self.kwargs['poll_id']):
+                queryset = ArchivedAnswer.objects.filter(question=self.kwargs['question_id'])
+            queryset = queryset.filter(**date_filters(self.request, 'date'))
+            user_id = self.request.query_params.get('user_id')
+            if user_id is not None:
+                try:
+                    queryset = queryset.filter(user_id=int(user_id))
+                except ValueError:
+                    raise ValidationError({'user_id': ['Expected integer']})
         return queryset
 
 
-class UserListView(APIView):
+class AnswerSearchView(ValuesListMixin, generics.ListAPIView):
     """
     get:
-    Returns all participants in all polls
+    Return answers of the poll, or of its question, whose text contains all words of q,
+    best matches first, page by page. Filtered by since and until
     """
+    queryset = Answer.objects.all()
+    values_serializer_class = serializers.AnswerSearchValuesSerializer
+    permission_classes = [IsAdmin]
+    pagination_class = SearchKeysetPagination
+
+    def get_queryset(self):
+        """
+        Answers matching the q parameter
+        :return: queryset of answers annotated with rank
+        """
+        text = self.request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'q': ['This parameter is required']})
+        queryset = Answer.objects.filter(question__poll=self.kwargs['poll_id'],
+                                         **date_filters(self.request, 'date'))
+        if 'question_id' in self.kwargs:
+            queryset = queryset.filter(question=self.kwargs['question_id'])
+        return search_answers(queryset, text)
+
+
+class PollAnswerView(APIView):
+    """
+    post:
+    Submit answers on all questions of the poll at once
+    """
+    throttle_classes = [AnswerIPThrottle, AnswerParticipantThrottle]
+
+    def post(self, request, poll_id):
+        """
+        Validate all answers of the participant and save them in one transaction
+        """
+        poll = get_object_or_404(Poll, pk=poll_id)
+        serializer = serializers.PollSubmissionSerializer(data=request.data, context={'poll': poll})
+        if serializer.is_valid():
+            serializer.save()
+            return Response(data=serializer.data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class PollExportView(APIView):
+    """
+    get:
+    Stream all answers of the poll as CSV (format=csv) or newline delimited JSON (format=ndjson)
+    """
+    permission_classes = [IsAdmin]
+    renderer_classes = [CSVRenderer, NDJSONRenderer]
+
+    def get(self, request, poll_id):
+        """
+        Rows are read from the database in chunks and written out as they come
+        """
+        poll = get_object_or_404(Poll, pk=poll_id)
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(renderer.stream(EXPORT_COLUMNS, iter_answer_rows(poll)),
+                                         content_type='{}; charset={}'.format(renderer.media_type, renderer.charset))
+        response['Content-Disposition'] = 'attachment; filename="poll_{}.{}"'.format(poll.id, renderer.format)
+        return response
+
+
+class PollImportView(APIView):
+    """
+    post:
+    Create a poll with all its questions and choices from one JSON or YAML definition
+    """
+    permission_classes = [IsAdmin]
+    parser_classes = [FastJSONParser, YAMLParser]
+
+    def post(self, request):
+        """
+        The definition is validated as a whole, nothing is saved if any part is invalid
+        """
+        serializer = serializers.PollDefinitionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        poll = serializer.save()
+        data = serializers.PollDefinitionSerializer(serializers.polls_with_definitions().get(pk=poll.id)).data
+        return Response({'id': poll.id, **data}, status=status.HTTP_201_CREATED,
+                        headers={'Location': '/api/poll/{}/'.format(poll.id)})
+
+
+class PollDefinitionView(APIView):
+    """
+    get:
+    Return the poll with all its questions and choices as JSON or YAML (format=yaml),
+    in the format accepted by the import
+    """
+    permission_classes = [IsAdmin]
+    renderer_classes = [FastJSONRenderer, YAMLRenderer]
+
+    def get(self, request, poll_id):
+        poll = get_object_or_404(serializers.polls_with_definitions(), pk=poll_id)
+        return Response(serializers.PollDefinitionSerializer(poll).data)
+
+
+class PollResultsView(APIView):
+    """
+    get:
+    Return vote counts of every choice, number of text answers and participants of the poll
+    """
+    permission_classes = [IsAdminOrReadOnly]
+
+    def get(self, request, poll_id):
+        """
+        Results are read from counters, answers are not aggregated
+        """
+        poll = get_object_or_404(Poll.objects.select_related('tally'), pk=poll_id)
+        return Response(tallies.poll_results(poll))
+
+
+class QuestionResultsView(APIView):
+    """
+    get:
+    Return vote counts of every choice, number of text answers and participants of the question
+    """
+    permission_classes = [IsAdminOrReadOnly]
+
+    def get(self, request, poll_id, question_id):
+        """
+        Results are read from counters, answers are not aggregated
+        """
+        question = get_object_or_404(tallies.questions_with_tallies(), poll=poll_id, pk=question_id)
+        return Response(tallies.question_results(question))
+
+
+class RequestStatsView(APIView):
+    """
+    get:
+    Return request totals and duration histograms per route, collected by InstrumentationMiddleware
+
+    delete:
+    Reset collected statistics
+    """
+    permission_classes = [IsAdmin]
 
     def get(self, request):
+        return Response(request_stats.snapshot())
+
+    def delete(self, request):
+        request_stats.reset()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SubmissionStatusView(APIView):
+    """
+    get:
+    Return status of a queued answer submission: queued, processing, done or failed
+    """
+
+    def get(self, request, submission_id):
+        submission = get_spool().status(submission_id)
+        if submission is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        return Response(submission)
+
+
+def include_answers(request):
+    """
+    Participant endpoints leave out nested answers when called with answers=false
+    :param request:
+    :return: whether to serialize answers
+    """
+    return request.query_params.get('answers', 'true').lower() not in ('false', '0', 'no')
+
+
+def participants_queryset(request):
+    """
+    Participants with answers prefetched if they are requested
+    :param request:
+    :return: queryset of participants
+    """
+    queryset = Participant.objects.all()
+    if include_answers(request):
+        queryset = queryset.prefetch_related('answers')
+    return queryset
+
+
+def participant_serializer_class(request):
+    if include_answers(request):
+        return serializers.ParticipantSerializer
+    return serializers.ParticipantSummarySerializer
+
+
+class UserListView(generics.ListAPIView):
+    """
+    get:
+    Returns participants in all polls page by page, pass answers=false to leave out answers
+    """
+    pagination_class = ParticipantKeysetPagination
+
+    def get_queryset(self):
         """
-        Return only answers related to the question
-        :return: queryset of answers on the question
+        Return participants ordered by id for the cursor pagination
+        :return: queryset of participants
         """
-        queryset = Participant.objects.all()
-        serializer = serializers.ParticipantSerializer(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return participants_queryset(self.request)
+
+    def get_serializer_class(self):
+        return participant_serializer_class(self.request)
 
 
 class UserView(APIView):
     """
     get:
-    Returns all answers of the participant
+    Returns all answers of the participant, pass answers=false to leave them out
 
     patch:
     Change user data
@@ -202,10 +603,8 @@ class UserView(APIView):
         """
         Return only answers related to the question
         """
-        queryset = Participant.objects.filter(user_id=user_id)
-        if queryset.count() < 1:
-            return Response(status=status.HTTP_404_NOT_FOUND)
-        serializer = serializers.ParticipantSerializer(queryset.last())
+        participant = get_object_or_404(participants_queryset(request), user_id=user_id)
+        serializer = participant_serializer_class(request)(participant)
         return Response(serializer.data)
 
     def patch(self, request, user_id):
@@ -214,11 +613,9 @@ class UserView(APIView):
         """
         if request.data.get('answers') or request.data.get('user_id'):
             return Response(status=status.HTTP_403_FORBIDDEN)
-        queryset = Participant.objects.filter(user_id=user_id)
-        if queryset.count() < 1:
-            return Response(status=status.HTTP_404_NOT_FOUND)
-        serializer = serializers.ParticipantSerializer(queryset.last(), data=request.data, partial=True)
+        participant = get_object_or_404(participants_queryset(request), user_id=user_id)
+        serializer = participant_serializer_class(request)(participant, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
             return Response(data=serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)